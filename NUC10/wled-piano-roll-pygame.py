@@ -1,10 +1,15 @@
 import pygame
-import socket
-import time
-import threading
+import os
+import sys
 from typing import List, Tuple
 import pygame.gfxdraw
-import mido
+import numpy as np
+
+sys.path.insert(0, os.path.join(os.path.dirname(os.path.abspath(__file__)), '..'))
+from src.visualizers.led_frame import LEDFrameEngine, NO_NOTE
+from src.communication.wled_client import WLEDManager
+from src.config.device_config import WLEDDevice
+from src.midi.midi_merger import MIDIInputMerger
 
 # WLED Controller settings
 WLED_IP = "192.168.8.106"
@@ -14,6 +19,10 @@ WLED_PORT = 21324  # Default WLED UDP port
 SCREEN_WIDTH = 1200
 SCREEN_HEIGHT = 400
 FPS = 30
+LED_FPS = 60  # LED output rate, independent of the display clock
+
+# Posted by the MIDI device watcher thread: event.device, event.connected
+MIDI_DEVICE_EVENT = pygame.USEREVENT + 1
 
 # Note and color mappings
 NOTE_NAMES = ['C', 'C♯', 'D', 'D♯', 'E', 'F', 'F♯', 'G', 'G♯', 'A', 'A♯', 'B']
@@ -56,15 +65,19 @@ class PianoVisualizer:
         self.num_leds = 144  # or whatever number of LEDs you have
         
         self.color_mapping = "chromatic"
+        self.led_engine = self.create_led_engine()
+        self.active_pitch_classes = np.zeros(12, dtype=bool)
         self.initial_brightness = 0.50
-        self.midi_input = None
         self.midi_notes = set()
-        self.midi_devices = mido.get_input_names()
-        self.current_midi_device_index = -1
+        # Every connected MIDI device (keyboard, guitar, pads...) feeds one merged stream
+        self.midi = MIDIInputMerger(self.handle_midi_note, self.handle_midi_message)
         self.last_midi_message = "No message"
         self.setup_midi()
         self.perform_mode = False
-        self.udp_socket = socket.socket(socket.AF_INET, socket.SOCK_DGRAM)
+        self.wled_device = WLEDDevice(name="Piano Roll", ip=WLED_IP, port=WLED_PORT,
+                                      num_leds=self.num_leds, instrument="piano")
+        self.wled = WLEDManager([self.wled_device])
+        self.wled.start_output(LED_FPS)
 
     def draw_piano(self):
         white_key_width = SCREEN_WIDTH // (len(WHITE_KEYS) * OCTAVES)
@@ -156,39 +169,31 @@ class PianoVisualizer:
                     return
                 x += white_key_width
 
-    def get_note_color(self, note: int) -> Tuple[int, int, int]:
-        base_color = CHROMATIC_COLORS[note % 12] if self.color_mapping == "chromatic" else HARMONIC_COLORS[note % 12]
-        
-        # Check if any note in the same pitch class (across octaves) is active
-        active_pitch_classes = {n % 12 for n in self.midi_notes}
-        if note % 12 in active_pitch_classes:
-            return tuple(min(int(c * 1.5), 255) for c in base_color)
-        else:
-            return tuple(int(c * 0.1) for c in base_color)
+    def get_palette(self) -> List[Tuple[int, int, int]]:
+        return CHROMATIC_COLORS if self.color_mapping == "chromatic" else HARMONIC_COLORS
 
-    def create_wled_data(self) -> bytes:
-        data = []
+    def create_led_engine(self) -> LEDFrameEngine:
         # Assuming MIDI notes start at 21 (A0) and end at 108 (C8)
-        # Map each LED to its corresponding MIDI note
+        # Map each LED to the pitch class of its note; LEDs past C8 stay black
+        led_keys = []
         for led in range(self.num_leds):
             note = led + 21  # Start from A0 (MIDI note 21)
-            if note <= 108:  # Up to C8 (MIDI note 108)
-                color = self.get_note_color(note)
-                data.extend(color)
-        
-        # Fill any remaining LEDs with black
-        remaining_leds = self.num_leds - len(data) // 3
-        data.extend([0, 0, 0] * remaining_leds)
-        
-        return bytes(data)
+            led_keys.append(note % 12 if note <= 108 else NO_NOTE)
+        return LEDFrameEngine(led_keys, self.get_palette(), active_scale=1.5, inactive_scale=0.1)
 
-    def send_udp_packet(self, data: List[int]):
-        packet = bytearray([2, 255])  # WARLS protocol with 255 as the second byte
-        packet.extend(data)
-        self.udp_socket.sendto(packet, (WLED_IP, WLED_PORT))
+    def create_wled_data(self) -> bytearray:
+        # Any note of the same pitch class (across octaves) lights the LED
+        active = self.active_pitch_classes
+        active[:] = False
+        if self.midi_notes:
+            active[[n % 12 for n in self.midi_notes]] = True
+        return self.led_engine.render(active)
+
+    def send_udp_packet(self, data: bytes):
+        self.wled.submit_frame(self.wled_device.name, data)
 
     def draw_info(self):
-        midi_device = self.midi_devices[self.current_midi_device_index] if self.midi_input else "None"
+        midi_device = ", ".join(self.midi.ports) or "None"
         midi_info = f"MIDI Input Device [M]: {midi_device} [{self.last_midi_message}]"
         
         info_text = (f"Mapping (c): {self.color_mapping.capitalize()} | "
@@ -203,9 +208,14 @@ class PianoVisualizer:
         for event in pygame.event.get():
             if event.type == pygame.QUIT:
                 return False
+            elif event.type == MIDI_DEVICE_EVENT:
+                state = "Connected to" if event.connected else "Disconnected"
+                self.last_midi_message = f"{state}: {event.device}"
+                print(f"MIDI {state.lower()}: {event.device}")
             elif event.type == pygame.KEYDOWN:
                 if event.key == pygame.K_c:
                     self.color_mapping = "harmonic" if self.color_mapping == "chromatic" else "chromatic"
+                    self.led_engine.set_palette(self.get_palette())
                 elif event.key == pygame.K_m:
                     self.setup_midi()
                 elif event.key == pygame.K_q:
@@ -215,68 +225,17 @@ class PianoVisualizer:
             elif event.type == pygame.MOUSEBUTTONUP:
                 self.midi_notes.clear()
         
-        # Handle MIDI input
-        if self.midi_input:
-            for message in self.midi_input.iter_pending():
-                if message.type == 'note_on' and message.velocity > 0:
-                    self.midi_notes.add(message.note % 12)  # Store note class (0-11)
-                    print(f"Note ON: {message.note} -> {message.note % 12}")
-                elif message.type == 'note_off' or (message.type == 'note_on' and message.velocity == 0):
-                    self.midi_notes.discard(message.note % 12)
-                    print(f"Note OFF: {message.note} -> {message.note % 12}")
-        
         return True
 
     def setup_midi(self):
-        try:
-            # Store current devices
-            new_devices = mido.get_input_names()
-            
-            # Update device list
-            self.midi_devices = new_devices
-            
-            if self.midi_devices:
-                # Safely close existing MIDI input first
-                if self.midi_input:
-                    try:
-                        self.midi_input.close()
-                        self.midi_input = None
-                        time.sleep(0.1)  # Give it time to close
-                    except:
-                        pass  # Ignore errors when closing
-                
-                # Calculate new device index
-                if self.current_midi_device_index >= len(self.midi_devices) - 1:
-                    self.current_midi_device_index = 0
-                else:
-                    self.current_midi_device_index += 1
-                
-                try:
-                    device_name = self.midi_devices[self.current_midi_device_index]
-                    self.midi_input = mido.open_input(device_name)
-                    self.last_midi_message = f"Connected to: {device_name}"
-                    print(f"Connected to MIDI input: {device_name}")
-                    
-                    # Start MIDI listening thread
-                    midi_thread = threading.Thread(target=self.midi_listener, daemon=True)
-                    midi_thread.start()
-                    
-                except Exception as e:
-                    print(f"Error opening MIDI device: {e}")
-                    self.midi_input = None
-                    self.last_midi_message = "Failed to connect"
-                    self.current_midi_device_index = -1
-            else:
-                self.midi_input = None
-                self.last_midi_message = "No MIDI devices found"
-                self.current_midi_device_index = -1
-                print("No MIDI input ports available.")
-                
-        except Exception as e:
-            print(f"Error in MIDI setup: {e}")
-            self.midi_input = None
-            self.last_midi_message = "MIDI setup error"
-            self.current_midi_device_index = -1
+        # Ports are scanned and opened on the watcher thread, never here
+        if self.midi.watcher:
+            self.midi.rescan()
+        else:
+            self.midi.watch(on_change=self.post_midi_device_event)
+
+    def post_midi_device_event(self, device: str, connected: bool):
+        pygame.event.post(pygame.event.Event(MIDI_DEVICE_EVENT, device=device, connected=connected))
 
     def get_note_name(self, midi_note: int) -> str:
         note_names = ['C', 'C#', 'D', 'D#', 'E', 'F', 'F#', 'G', 'G#', 'A', 'A#', 'B']
@@ -284,35 +243,21 @@ class PianoVisualizer:
         octave = (midi_note // 12) - 1  # MIDI note 60 is middle C (C4)
         return f"{note}{octave}"
 
-    def midi_listener(self):
-        try:
-            while self.midi_input:
-                try:
-                    for message in self.midi_input.iter_pending():
-                        # Only update last_midi_message for note-related messages
-                        if message.type in ['note_on', 'note_off']:
-                            note_name = self.get_note_name(message.note)
-                            self.last_midi_message = f"{str(message)} ({note_name})"
-                        
-                        if message.type == 'note_on' and message.velocity > 0:
-                            note = message.note % 12  # Store just the note class (0-11)
-                            self.midi_notes.add(note)
-                            print(f"MIDI Note ON: {message.note} -> {note}")  # Debug print
-                        elif message.type == 'note_off' or (message.type == 'note_on' and message.velocity == 0):
-                            note = message.note % 12
-                            self.midi_notes.discard(note)
-                            print(f"MIDI Note OFF: {message.note} -> {note}")  # Debug print
-                    time.sleep(0.001)
-                except Exception as e:
-                    print(f"Error in MIDI listener: {e}")
-                    self.last_midi_message = f"Error: {str(e)}"
-                    break
-        except Exception as e:
-            print(f"MIDI listener thread error: {e}")
-            self.last_midi_message = f"Thread Error: {str(e)}"
-        finally:
-            print("MIDI listener thread ended")
-            self.last_midi_message = "MIDI disconnected"
+    def handle_midi_message(self, port: str, message):
+        """Show the latest note message from any MIDI input"""
+        if message.type in ['note_on', 'note_off']:
+            note_name = self.get_note_name(message.note)
+            self.last_midi_message = f"{str(message)} ({note_name})"
+
+    def handle_midi_note(self, note: int, is_on: bool, velocity: int = 127):
+        """Handle a note from the merged MIDI input"""
+        pitch_class = note % 12  # Store just the note class (0-11)
+        if is_on:
+            self.midi_notes.add(pitch_class)
+            print(f"MIDI Note ON: {note} -> {pitch_class}")  # Debug print
+        else:
+            self.midi_notes.discard(pitch_class)
+            print(f"MIDI Note OFF: {note} -> {pitch_class}")  # Debug print
 
     def run(self):
         print("Starting main loop...")
@@ -333,10 +278,9 @@ class PianoVisualizer:
                 
         finally:
             print("Closing UDP socket...")
-            self.udp_socket.close()
-            if self.midi_input:
-                print("Closing MIDI input...")
-                self.midi_input.close()
+            self.wled.close()
+            print("Closing MIDI inputs...")
+            self.midi.close()
             print("Main loop ended. Quitting Pygame...")
             pygame.quit()
 
@@ -0,0 +1,75 @@
+"""NTP-style clock offset estimates between MQTT peers.
+
+A client sends a request carrying its send time t0; the peer replies with
+t0, its receive time t1 and its send time t2; the client notes the reply's
+arrival time t3. Then
+
+    offset = ((t1 - t0) + (t2 - t3)) / 2    (peer clock - our clock)
+    delay  = (t3 - t0) - (t2 - t1)          (round trip, minus peer time)
+
+The sample with the smallest round trip among the last few is the most
+trustworthy, so that is the estimate used. All times are wall clock
+microseconds, the same clock as the note payload timestamps.
+
+Replies are handled on the MQTT network thread while offsets are read on
+the render thread, so the samples are guarded by a lock.
+"""
+import struct
+import threading
+from collections import deque
+from typing import Deque, Dict, Optional, Tuple
+
+from .note_codec import now_us
+
+# Samples kept per peer; the lowest-delay one wins
+CLOCK_SAMPLES = 8
+
+REQUEST = struct.Struct("<Q")
+REPLY = struct.Struct("<QQQ")
+
+class ClockSync:
+    """Clock offset estimates for each peer"""
+
+    def __init__(self, samples: int = CLOCK_SAMPLES):
+        self.samples = samples
+        self.peers: Dict[str, Deque[Tuple[int, int]]] = {}  # {peer_id: (delay_us, offset_us)}
+        self._lock = threading.Lock()
+
+    @staticmethod
+    def make_request() -> bytes:
+        return REQUEST.pack(now_us())
+
+    @staticmethod
+    def make_reply(request: bytes, received_us: int) -> bytes:
+        """Answer a peer's request; received_us is when it arrived here"""
+        t0, = REQUEST.unpack(request)
+        return REPLY.pack(t0, received_us, now_us())
+
+    def handle_reply(self, peer_id: str, reply: bytes, received_us: int):
+        t0, t1, t2 = REPLY.unpack(reply)
+        t3 = received_us
+        delay = (t3 - t0) - (t2 - t1)
+        if delay < 0:
+            return  # Peer clock stepped mid-exchange
+        offset = ((t1 - t0) + (t2 - t3)) // 2
+        with self._lock:
+            samples = self.peers.get(peer_id)
+            if samples is None:
+                samples = self.peers[peer_id] = deque(maxlen=self.samples)
+            samples.append((delay, offset))
+
+    def offset_us(self, peer_id: str) -> Optional[int]:
+        """Peer clock minus our clock, or None before the first reply"""
+        with self._lock:
+            samples = self.peers.get(peer_id)
+            return min(samples)[1] if samples else None
+
+    def delay_us(self, peer_id: str) -> Optional[int]:
+        """Best round-trip time seen to the peer"""
+        with self._lock:
+            samples = self.peers.get(peer_id)
+            return min(samples)[0] if samples else None
+
+    def forget(self, peer_id: str):
+        with self._lock:
+            self.peers.pop(peer_id, None)
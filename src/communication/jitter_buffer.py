@@ -0,0 +1,83 @@
+"""Adaptive playout buffer for remote note updates.
+
+Each update is placed on a common timeline: its sender timestamp mapped
+into our clock (with a ClockSync offset when one is known, otherwise
+relative to the fastest recent delivery from that source). It is released
+a fixed delay later. The delay follows a high percentile of recent
+transit times, so all sources play out aligned and evenly spaced instead
+of whenever the network delivers them.
+"""
+import heapq
+import itertools
+from collections import deque
+from typing import Any, Deque, Dict, List, Optional
+
+from .note_codec import now_us
+
+# Upper bound on the added delay, microseconds
+JITTER_MAX_DELAY = 100_000
+
+# Transit samples used to pick the delay, and the percentile covered
+JITTER_WINDOW = 256
+JITTER_PERCENTILE = 95
+
+# Recent transits per source used as the baseline when no clock offset is known
+BASELINE_WINDOW = 64
+
+class JitterBuffer:
+    def __init__(self, max_delay_us: int = JITTER_MAX_DELAY, percentile: float = JITTER_PERCENTILE,
+                 window: int = JITTER_WINDOW):
+        self.max_delay_us = max_delay_us
+        self.percentile = percentile
+        self.delay_us = 0  # Current playout delay
+        self._transits: Deque[int] = deque(maxlen=window)
+        self._baselines: Dict[str, Deque[int]] = {}
+        self._last_play: Dict[str, int] = {}  # Keeps each source's updates in order
+        self._heap: List = []
+        self._counter = itertools.count()
+
+    def push(self, source_id: str, sent_us: int, arrival_us: int, item: Any,
+             offset_us: Optional[int] = None):
+        """Queue an update sent at sent_us (sender clock) that arrived at arrival_us (ours)"""
+        if offset_us is not None:
+            event_us = sent_us - offset_us
+        else:
+            baseline = self._baselines.get(source_id)
+            if baseline is None:
+                baseline = self._baselines[source_id] = deque(maxlen=BASELINE_WINDOW)
+            baseline.append(arrival_us - sent_us)
+            event_us = sent_us + min(baseline)
+        self._transits.append(max(0, arrival_us - event_us))
+        self._adapt()
+        self._schedule(source_id, event_us + self.delay_us, item)
+
+    def push_now(self, source_id: str, item: Any):
+        """Queue an update to play as soon as the source's earlier updates have"""
+        self._schedule(source_id, now_us(), item)
+
+    def _schedule(self, source_id: str, play_us: int, item: Any):
+        play_us = max(play_us, self._last_play.get(source_id, 0))
+        self._last_play[source_id] = play_us
+        heapq.heappush(self._heap, (play_us, next(self._counter), source_id, item))
+
+    def _adapt(self):
+        transits = sorted(self._transits)
+        index = min(len(transits) - 1, int(len(transits) * self.percentile / 100))
+        self.delay_us = min(transits[index], self.max_delay_us)
+
+    def pop_due(self, now: Optional[int] = None) -> List[Any]:
+        """Updates whose playout time has come, in playout order"""
+        now = now_us() if now is None else now
+        due = []
+        while self._heap and self._heap[0][0] <= now:
+            due.append(heapq.heappop(self._heap)[3])
+        return due
+
+    def forget(self, source_id: str):
+        """Drop a source's timing state and any of its updates still waiting to play"""
+        self._baselines.pop(source_id, None)
+        self._last_play.pop(source_id, None)
+        kept = [entry for entry in self._heap if entry[2] != source_id]
+        if len(kept) != len(self._heap):
+            heapq.heapify(kept)
+            self._heap = kept
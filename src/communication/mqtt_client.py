@@ -1,13 +1,83 @@
 import paho.mqtt.client as mqtt
 import json
-from typing import Dict, Callable, Set
+import numpy as np
+from typing import Dict, Callable, Optional, Set
+import queue
 import threading
 import time
 
+from . import note_codec
+from .clock_sync import ClockSync
+from .jitter_buffer import JitterBuffer
+from .topic_trie import TopicTrie
+from ..metrics.link_quality import LinkStats
+
+# Instrument wildcard for register_callback(): notes from every instrument
+ANY_INSTRUMENT = "+"
+
+# Room used when none is given; its topics are the original centaurus/music/... tree
+DEFAULT_ROOM = "music"
+
+# Seconds between full-state snapshots in event mode
+SNAPSHOT_INTERVAL = 2.0
+
+# Minimum seconds between snapshots sent on request, and between our own
+# requests to the same source
+SNAPSHOT_MIN_INTERVAL = 0.05
+SNAPSHOT_REQUEST_INTERVAL = 0.5
+
+# Consecutive stale payloads from a source after which we assume it restarted its sequence
+STALE_RESYNC_LIMIT = 20
+
+# Hard cap on how long the coalescing window may hold back a change
+COALESCE_MAX_DELAY = 0.010
+
+# Seconds between clock offset requests to each known source
+CLOCK_SYNC_INTERVAL = 5.0
+
 class MusicMQTTClient:
-    def __init__(self, client_id: str, instrument_type: str):
+    def __init__(self, client_id: str, instrument_type: str, mode: str = "snapshot",
+                 snapshot_interval: float = SNAPSHOT_INTERVAL, coalesce_window: float = 0.0,
+                 coalesce_max_delay: float = COALESCE_MAX_DELAY, deferred: bool = False,
+                 clock_sync: bool = False, jitter_buffer: bool = False, room: str = DEFAULT_ROOM):
+        """room: every topic lives under centaurus/<room>/, so clients only
+        exchange notes, statuses and requests with others in the same room.
+
+        mode: "snapshot" publishes the full note state on every change,
+        "events" publishes only note on/off deltas. Both also publish a full
+        snapshot every snapshot_interval seconds (0 disables), which doubles
+        as a heartbeat for receivers' source timeouts, and whenever a
+        receiver asks for one.
+
+        coalesce_window: if > 0, changes arriving within this many seconds of
+        each other (a strummed chord) go out as one publish, held back at
+        most coalesce_max_delay seconds after the first of them.
+
+        deferred: queue incoming notes instead of handling them on paho's
+        network thread; callbacks then run from process_messages() on the
+        caller's thread (once per frame in the visualizers).
+
+        clock_sync: estimate each source's clock offset (see clock_sync) so
+        its timestamps can be read in our time. Every client answers these
+        requests either way.
+
+        jitter_buffer: with deferred, hold remote updates in an adaptive
+        playout buffer (see jitter_buffer) so sources are rendered aligned
+        in shared time rather than as the network delivers them.
+        """
+        if not room or any(c in room for c in "/+#"):
+            raise ValueError(f"Invalid room id: {room!r}")
         self.client_id = client_id
         self.instrument_type = instrument_type
+        self.room = room
+        self.mode = mode
+        self.snapshot_interval = snapshot_interval
+        self.coalesce_window = coalesce_window
+        self.coalesce_max_delay = max(coalesce_max_delay, coalesce_window)
+        self.deferred = deferred
+        self.inbox: "queue.SimpleQueue" = queue.SimpleQueue()  # (topic, payload, arrival_us) in deferred mode
+        self.clock = ClockSync() if clock_sync else None
+        self.jitter_buffer = JitterBuffer() if jitter_buffer and deferred else None
         
         # Create MQTT client with protocol v5
         self.client = mqtt.Client(
@@ -17,17 +87,52 @@ class MusicMQTTClient:
         )
         
         # MQTT topics
-        self.base_topic = "centaurus/music"
-        self.notes_topic = f"{self.base_topic}/notes/{instrument_type}"
+        self.base_topic = f"centaurus/{room}"
+        # Notes are binary payloads (see note_codec); sender identity is in the topic
+        self.notes_topic = f"{self.base_topic}/notes/{instrument_type}/{client_id}"
         self.status_topic = f"{self.base_topic}/status/{instrument_type}/{client_id}"
+        self.status_filter = f"{self.base_topic}/status/+/+"
+        # Empty messages here ask senders for a snapshot: all of them, or one client
+        self.snapshot_request_topic = f"{self.base_topic}/snapshot"
+        self.snapshot_topic = f"{self.snapshot_request_topic}/{client_id}"
+        # Clock requests to us arrive on clock/<us>/<requester>, replies on clock_reply/<requester>/<peer>
+        self._clock_request_prefix = f"{self.base_topic}/clock/{client_id}/"
+        self._clock_reply_prefix = f"{self.base_topic}/clock_reply/{client_id}/"
         
         # Set up callbacks
         self.client.on_connect = self._on_connect
         self.client.on_message = self._on_message
         self.client.on_disconnect = self._on_disconnect
         
-        self.callbacks: Dict[str, Callable] = {}
+        self.callbacks = TopicTrie()  # Notes topic filters -> callbacks
         self.connected = False
+        self.sequence = 0  # Sequence number of the last published notes payload
+
+        # Sender state: velocities as last published, guarded so sequence order == publish order
+        self.published = np.zeros(note_codec.NUM_NOTES, dtype=np.uint8)
+        self._publish_lock = threading.Lock()
+        self._last_snapshot = 0.0
+        self._snapshot_stop = threading.Event()
+        self._snapshot_thread = None
+
+        # Coalescing: latest (notes, velocities) waiting for its publish deadline
+        self._pending = None
+        self._pending_first = 0.0
+        self._pending_deadline = 0.0
+        self._coalesce_cond = threading.Condition()
+        self._coalescing = False
+        self._coalesce_thread = None
+        self.changes = 0    # publish_notes calls while connected
+        self.publishes = 0  # Note payloads actually sent (including snapshots)
+
+        # Receiver state rebuilt from snapshots and events: {client_id: velocities}.
+        # The lock guards adding/removing sources against the clock thread's reads
+        self.remote_velocities: Dict[str, np.ndarray] = {}
+        self._state_lock = threading.Lock()
+        self.link_stats: Dict[str, LinkStats] = {}  # Sequence checks per source
+        self._snapshot_requested: Dict[str, float] = {}
+        self._clock_stop = threading.Event()
+        self._clock_thread = None
 
     def _on_connect(self, client, userdata, flags, reason_code, properties):
         """Callback when connected to MQTT broker"""
@@ -35,20 +140,220 @@ class MusicMQTTClient:
             print(f"Connected to MQTT broker with result code: {reason_code}")
             self.connected = True
             # Resubscribe to topics
-            for topic in self.callbacks.keys():
+            for topic in self.callbacks.filters():
                 self.client.subscribe(topic)
+            self.client.subscribe(self.snapshot_request_topic)
+            self.client.subscribe(self.snapshot_topic)
+            self.client.subscribe(self._clock_request_prefix + "+")
+            if self.clock:
+                self.client.subscribe(self._clock_reply_prefix + "+")
+            if self.callbacks.filters():
+                # Offline statuses (including Last Wills) release a source's notes
+                self.client.subscribe(self.status_filter)
+                # Late joiner: ask everyone for their current notes
+                self.client.publish(self.snapshot_request_topic, b"")
         else:
             print(f"Failed to connect to MQTT broker: {reason_code}")
 
     def _on_message(self, client, userdata, msg):
         """Callback when message received"""
+        arrival = note_codec.now_us()
         try:
-            if msg.topic in self.callbacks:
-                payload = json.loads(msg.payload.decode())
-                self.callbacks[msg.topic](payload)
+            if msg.topic.startswith(self._clock_request_prefix):
+                # Answered right here on the network thread to keep the timing tight
+                requester = msg.topic[len(self._clock_request_prefix):]
+                self.client.publish(f"{self.base_topic}/clock_reply/{requester}/{self.client_id}",
+                                    ClockSync.make_reply(msg.payload, arrival))
+            elif msg.topic.startswith(self._clock_reply_prefix):
+                if self.clock:
+                    self.clock.handle_reply(msg.topic[len(self._clock_reply_prefix):], msg.payload, arrival)
+            elif msg.topic in (self.snapshot_request_topic, self.snapshot_topic):
+                self._on_snapshot_request()
+            elif msg.topic == self.status_topic:
+                return  # Our own retained status
+            elif self.deferred:
+                self.inbox.put((msg.topic, msg.payload, arrival))
+            else:
+                self._dispatch([(msg.topic, msg.payload, arrival)])
         except Exception as e:
             print(f"Error processing MQTT message: {e}")
 
+    def process_messages(self) -> int:
+        """Handle the note messages queued in deferred mode; returns how many there were.
+
+        Only messages already queued are taken, so a flood cannot stall the
+        caller. A source that sent several updates gets one callback with
+        its latest state, unless the jitter buffer is on: then each update
+        is released in order once its playout time has come.
+        """
+        messages = []
+        for _ in range(self.inbox.qsize()):
+            try:
+                messages.append(self.inbox.get_nowait())
+            except queue.Empty:
+                break
+        if messages:
+            self._dispatch(messages)
+        if self.jitter_buffer:
+            self._deliver(self.jitter_buffer.pop_due())
+        return len(messages)
+
+    def _dispatch(self, messages):
+        latest = {}  # {topic: (callbacks, data)}, one entry per source
+        for topic, payload, arrival in messages:
+            try:
+                if topic.startswith(self._status_prefix):
+                    self._on_status(topic, payload, latest)
+                    continue
+                callbacks = self.callbacks.match(topic)
+                if not callbacks:
+                    continue
+                # centaurus/<room>/notes/<instrument>/<client_id>
+                instrument, client_id = topic.rsplit("/", 2)[-2:]
+                packet = note_codec.decode(payload)
+                velocities = self._apply_packet(client_id, packet)
+                if velocities is None:
+                    continue  # Stale or duplicate
+                update = (callbacks, {
+                    "client_id": client_id,
+                    "instrument": instrument,
+                    "notes": set(np.flatnonzero(velocities).tolist()),
+                    "velocities": velocities,
+                    "sequence": packet.sequence,
+                    "timestamp": packet.timestamp,
+                })
+                if self.jitter_buffer:
+                    offset = self.clock.offset_us(client_id) if self.clock else None
+                    self.jitter_buffer.push(client_id, packet.timestamp, arrival, update, offset)
+                else:
+                    latest[topic] = update
+            except Exception as e:
+                print(f"Error processing MQTT message: {e}")
+        self._deliver(latest.values())
+
+    def _deliver(self, updates):
+        for callbacks, data in updates:
+            for callback in callbacks:
+                try:
+                    callback(data)
+                except Exception as e:
+                    print(f"Error in MQTT callback: {e}")
+
+    @property
+    def _status_prefix(self) -> str:
+        return f"{self.base_topic}/status/"
+
+    def _on_status(self, topic: str, payload: bytes, latest: dict):
+        """An offline status (clean disconnect or Last Will) clears that source's notes"""
+        # centaurus/<room>/status/<instrument>/<client_id>
+        instrument, client_id = topic.rsplit("/", 2)[-2:]
+        if client_id not in self.remote_velocities:
+            return  # Retained status of a source we never heard from
+        if json.loads(payload).get("status") != "offline":
+            return
+        notes_topic = f"{self.base_topic}/notes/{instrument}/{client_id}"
+        update = (self.callbacks.match(notes_topic), {
+            "client_id": client_id,
+            "instrument": instrument,
+            "notes": set(),
+            "velocities": np.zeros(note_codec.NUM_NOTES, dtype=np.uint8),
+            "sequence": None,
+            "timestamp": None,
+            "offline": True,
+        })
+        # Forgetting also drops its updates still waiting in the jitter buffer
+        self.forget_source(client_id)
+        if self.jitter_buffer:
+            self.jitter_buffer.push_now(client_id, update)
+        else:
+            latest[notes_topic] = update
+
+    def forget_source(self, client_id: str):
+        """Drop the reconstructed state kept for a remote source"""
+        with self._state_lock:
+            self.remote_velocities.pop(client_id, None)
+        self.link_stats.pop(client_id, None)
+        self._snapshot_requested.pop(client_id, None)
+        if self.clock:
+            self.clock.forget(client_id)
+        if self.jitter_buffer:
+            self.jitter_buffer.forget(client_id)
+
+    def _check_sequence(self, stats: LinkStats, sequence: int) -> bool:
+        """True if a payload is newer than the last applied one; counts gaps"""
+        if stats.last_sequence is None:
+            return True
+        step = (sequence - stats.last_sequence) % note_codec.SEQUENCE_MOD
+        if step == 0:
+            stats.duplicates += 1
+            return False
+        if step >= note_codec.SEQUENCE_MOD // 2:
+            stats.stale += 1
+            stats.stale_streak += 1
+            if stats.stale_streak < STALE_RESYNC_LIMIT:
+                return False
+            stats.resyncs += 1  # Sender restarted its counter
+        elif step > 1:
+            stats.gaps += 1
+            stats.lost += step - 1
+        stats.stale_streak = 0
+        return True
+
+    def _apply_packet(self, client_id: str, packet: note_codec.NotePacket) -> Optional[np.ndarray]:
+        """Update a source's reconstructed note state from a snapshot or events.
+
+        Returns the source's velocities, or None if the payload was stale or
+        a duplicate and has been dropped.
+        """
+        stats = self.link_stats.get(client_id)
+        if stats is None:
+            stats = self.link_stats[client_id] = LinkStats()
+            self.request_clock(client_id)  # New source: estimate its offset now
+        last = stats.last_sequence
+        if not self._check_sequence(stats, packet.sequence):
+            return None
+        stats.received += 1
+        stats.last_sequence = packet.sequence
+
+        velocities = self.remote_velocities.get(client_id)
+        if packet.is_snapshot:
+            if packet.velocities is not None:
+                velocities = packet.velocities.copy()
+            else:
+                velocities = np.zeros(note_codec.NUM_NOTES, dtype=np.uint8)
+                velocities[list(packet.notes)] = 127
+        else:
+            if velocities is None or packet.sequence != (last + 1) % note_codec.SEQUENCE_MOD:
+                # Joined mid-stream or lost a message: apply what we have, then resync
+                if velocities is None:
+                    velocities = np.zeros(note_codec.NUM_NOTES, dtype=np.uint8)
+                self.request_snapshot(client_id)
+            for note, is_on, velocity in packet.events:
+                velocities[note] = velocity if is_on else 0
+        with self._state_lock:
+            self.remote_velocities[client_id] = velocities
+        return velocities.copy()
+
+    def get_link_stats(self) -> Dict[str, Dict[str, float]]:
+        """Link quality counters per remote source"""
+        return {client_id: stats.as_dict() for client_id, stats in self.link_stats.items()}
+
+    def request_snapshot(self, client_id: Optional[str] = None):
+        """Ask one source (or every source) to publish its full note state"""
+        if not self.connected:
+            return
+        now = time.monotonic()
+        key = client_id or ""
+        if now - self._snapshot_requested.get(key, 0.0) < SNAPSHOT_REQUEST_INTERVAL:
+            return
+        self._snapshot_requested[key] = now
+        topic = f"{self.snapshot_request_topic}/{client_id}" if client_id else self.snapshot_request_topic
+        self.client.publish(topic, b"")
+
+    def _on_snapshot_request(self):
+        if time.monotonic() - self._last_snapshot >= SNAPSHOT_MIN_INTERVAL:
+            self.publish_snapshot()
+
     def _on_disconnect(self, client, userdata, flags, reason_code, properties):
         """Callback when disconnected"""
         print(f"Disconnected from MQTT broker with result code: {reason_code}")
@@ -57,8 +362,26 @@ class MusicMQTTClient:
     def connect(self, broker: str = "localhost", port: int = 1883) -> bool:
         """Connect to MQTT broker"""
         try:
+            # Retained offline status the broker publishes for us if we drop without disconnecting
+            self.client.will_set(
+                self.status_topic,
+                json.dumps({"status": "offline", "client_id": self.client_id}),
+                retain=True
+            )
             self.client.connect(broker, port)
             self.client.loop_start()
+            if self.coalesce_window > 0 and not self._coalesce_thread:
+                self._coalescing = True
+                self._coalesce_thread = threading.Thread(target=self._coalesce_loop, daemon=True)
+                self._coalesce_thread.start()
+            if self.snapshot_interval > 0 and not self._snapshot_thread:
+                self._snapshot_stop.clear()
+                self._snapshot_thread = threading.Thread(target=self._snapshot_loop, daemon=True)
+                self._snapshot_thread.start()
+            if self.clock and not self._clock_thread:
+                self._clock_stop.clear()
+                self._clock_thread = threading.Thread(target=self._clock_loop, daemon=True)
+                self._clock_thread.start()
             
             # Publish online status
             self.client.publish(
@@ -73,6 +396,20 @@ class MusicMQTTClient:
 
     def disconnect(self):
         """Disconnect from MQTT broker"""
+        if self._coalesce_thread:
+            with self._coalesce_cond:
+                self._coalescing = False
+                self._coalesce_cond.notify()
+            self._coalesce_thread.join(timeout=1.0)  # Flushes anything pending
+            self._coalesce_thread = None
+        self._snapshot_stop.set()
+        if self._snapshot_thread:
+            self._snapshot_thread.join(timeout=1.0)
+            self._snapshot_thread = None
+        self._clock_stop.set()
+        if self._clock_thread:
+            self._clock_thread.join(timeout=1.0)
+            self._clock_thread = None
         if self.connected:
             # Publish offline status
             self.client.publish(
@@ -83,22 +420,121 @@ class MusicMQTTClient:
             self.client.loop_stop()
             self.client.disconnect()
 
-    def publish_notes(self, notes: Set[int]):
-        """Publish current notes"""
-        if self.connected:
-            try:
-                payload = json.dumps({
-                    "client_id": self.client_id,
-                    "instrument": self.instrument_type,
-                    "notes": list(notes)
-                })
+    def publish_notes(self, notes: Set[int], velocities: Optional[np.ndarray] = None):
+        """Publish the current notes (velocities, if given, is the full 128-note array).
+
+        In snapshot mode the full state goes out as a 16-byte bitmask, or a
+        velocity array if given. In event mode only the notes that started
+        or stopped since the last publish are sent.
+        """
+        if not self.connected:
+            return
+        self.changes += 1
+        if not self._coalescing:
+            self._publish_now(notes, velocities)
+            return
+        with self._coalesce_cond:
+            now = time.monotonic()
+            if self._pending is None:
+                self._pending_first = now
+            # Copy: callers may pass live state that keeps changing
+            self._pending = (set(notes), None if velocities is None else velocities.copy())
+            self._pending_deadline = min(now + self.coalesce_window,
+                                         self._pending_first + self.coalesce_max_delay)
+            self._coalesce_cond.notify()
+
+    def _coalesce_loop(self):
+        """Publish the pending state once its window closes (or the cap is hit)"""
+        while True:
+            with self._coalesce_cond:
+                while self._coalescing:
+                    if self._pending is None:
+                        self._coalesce_cond.wait()
+                        continue
+                    remaining = self._pending_deadline - time.monotonic()
+                    if remaining <= 0:
+                        break
+                    self._coalesce_cond.wait(remaining)
+                pending, self._pending = self._pending, None
+                stopping = not self._coalescing
+            if pending:
+                self._publish_now(*pending)
+            if stopping:
+                return
+
+    def _publish_now(self, notes: Set[int], velocities: Optional[np.ndarray] = None):
+        with_velocity = velocities is not None
+        if not with_velocity:
+            velocities = np.zeros(note_codec.NUM_NOTES, dtype=np.uint8)
+            velocities[list(notes)] = 127
+        try:
+            with self._publish_lock:
+                if self.mode == "events":
+                    changed = np.flatnonzero((velocities > 0) != (self.published > 0))
+                    if not changed.size:
+                        return
+                    events = [(int(note), bool(velocities[note]), int(velocities[note])) for note in changed]
+                    self.sequence = (self.sequence + 1) % note_codec.SEQUENCE_MOD
+                    payload = note_codec.encode_events(events, self.sequence)
+                else:
+                    self.sequence = (self.sequence + 1) % note_codec.SEQUENCE_MOD
+                    if with_velocity:
+                        payload = note_codec.encode_velocities(velocities, self.sequence)
+                    else:
+                        payload = note_codec.encode_notes(notes, self.sequence)
+                self.published[:] = velocities
                 self.client.publish(self.notes_topic, payload)
-            except Exception as e:
-                print(f"Error publishing notes: {e}")
+                self.publishes += 1
+        except Exception as e:
+            print(f"Error publishing notes: {e}")
+
+    def publish_snapshot(self):
+        """Publish the full note state as last published"""
+        if not self.connected:
+            return
+        try:
+            with self._publish_lock:
+                self.sequence = (self.sequence + 1) % note_codec.SEQUENCE_MOD
+                self.client.publish(self.notes_topic, note_codec.encode_velocities(self.published, self.sequence))
+                self.publishes += 1
+                self._last_snapshot = time.monotonic()
+        except Exception as e:
+            print(f"Error publishing snapshot: {e}")
+
+    def _snapshot_loop(self):
+        while not self._snapshot_stop.wait(self.snapshot_interval):
+            self.publish_snapshot()
+
+    def _clock_loop(self):
+        """Refresh the clock offset of every source we receive from"""
+        while not self._clock_stop.wait(CLOCK_SYNC_INTERVAL):
+            self.sync_clocks()
+
+    def sync_clocks(self):
+        """Send a clock offset request to each known source"""
+        with self._state_lock:
+            sources = list(self.remote_velocities)
+        for client_id in sources:
+            self.request_clock(client_id)
+
+    def request_clock(self, client_id: str):
+        if self.connected and self.clock:
+            self.client.publish(f"{self.base_topic}/clock/{client_id}/{self.client_id}",
+                                ClockSync.make_request())
+
+    def _notes_filter(self, instrument_type: str) -> str:
+        return f"{self.base_topic}/notes/{instrument_type}/+"
 
     def register_callback(self, instrument_type: str, callback: Callable):
-        """Register callback for receiving notes from specific instrument type"""
-        topic = f"{self.base_topic}/notes/{instrument_type}"
-        self.callbacks[topic] = callback
-        if self.connected:
-            self.client.subscribe(topic)
\ No newline at end of file
+        """Register callback for receiving notes from specific instrument type,
+        or from every instrument with ANY_INSTRUMENT (one wildcard subscription).
+
+        The callback gets a dict with client_id, instrument, notes (a set),
+        velocities (array), sequence and timestamp.
+        """
+        topic = self._notes_filter(instrument_type)
+        subscribed = topic in self.callbacks.filters()
+        self.callbacks.add(topic, callback)
+        if self.connected and not subscribed:
+            self.client.subscribe(topic)
+            self.client.subscribe(self.status_filter)
\ No newline at end of file
@@ -0,0 +1,94 @@
+"""Binary note payloads for MQTT.
+
+Every payload starts with a 14-byte little-endian header:
+
+    version   uint8   PAYLOAD_VERSION
+    kind      uint8   KIND_BITMASK, KIND_VELOCITY or KIND_EVENTS
+    sequence  uint32  per-sender counter, wraps at 2**32
+    timestamp uint64  sender wall clock, microseconds since the epoch
+
+Snapshots carry the full note state, either as a 16-byte bitmask (bit n of
+byte n // 8 is MIDI note n) or as 128 velocity bytes. Event payloads carry
+only changes, two bytes each: note | 0x80 for note on, then velocity.
+Sender and instrument identity live in the topic.
+"""
+import struct
+import time
+from dataclasses import dataclass
+from typing import Iterable, List, Optional, Set, Tuple
+
+import numpy as np
+
+PAYLOAD_VERSION = 1
+
+KIND_BITMASK = 0
+KIND_VELOCITY = 1
+KIND_EVENTS = 2
+
+NUM_NOTES = 128
+BITMASK_BYTES = NUM_NOTES // 8
+
+HEADER = struct.Struct("<BBIQ")
+SEQUENCE_MOD = 1 << 32
+NOTE_ON_FLAG = 0x80
+
+NoteEvent = Tuple[int, bool, int]  # (note, is_on, velocity)
+
+@dataclass
+class NotePacket:
+    sequence: int
+    timestamp: int  # Microseconds since the epoch
+    notes: Set[int]  # Empty for event payloads
+    velocities: Optional[np.ndarray] = None  # uint8[128], velocity payloads only
+    events: Optional[List[NoteEvent]] = None  # Event payloads only
+
+    @property
+    def is_snapshot(self) -> bool:
+        return self.events is None
+
+def now_us() -> int:
+    return time.time_ns() // 1000
+
+def encode_notes(notes: Iterable[int], sequence: int, timestamp: Optional[int] = None) -> bytes:
+    """Bitmask payload for a set of sounding notes"""
+    active = np.zeros(NUM_NOTES, dtype=bool)
+    active[list(notes)] = True
+    header = HEADER.pack(PAYLOAD_VERSION, KIND_BITMASK, sequence % SEQUENCE_MOD,
+                         now_us() if timestamp is None else timestamp)
+    return header + np.packbits(active, bitorder="little").tobytes()
+
+def encode_velocities(velocities: np.ndarray, sequence: int, timestamp: Optional[int] = None) -> bytes:
+    """Velocity payload from a 128-entry array (0 = silent)"""
+    header = HEADER.pack(PAYLOAD_VERSION, KIND_VELOCITY, sequence % SEQUENCE_MOD,
+                         now_us() if timestamp is None else timestamp)
+    return header + np.asarray(velocities, dtype=np.uint8).tobytes()
+
+def encode_events(events: Iterable[NoteEvent], sequence: int, timestamp: Optional[int] = None) -> bytes:
+    """Event payload of note on/off changes"""
+    body = bytearray()
+    for note, is_on, velocity in events:
+        body.append(note | NOTE_ON_FLAG if is_on else note)
+        body.append(velocity if is_on else 0)
+    header = HEADER.pack(PAYLOAD_VERSION, KIND_EVENTS, sequence % SEQUENCE_MOD,
+                         now_us() if timestamp is None else timestamp)
+    return header + bytes(body)
+
+def decode(payload: bytes) -> NotePacket:
+    """Parse a note payload; raises ValueError if it is not one we understand"""
+    if len(payload) < HEADER.size:
+        raise ValueError(f"Note payload too short: {len(payload)} bytes")
+    version, kind, sequence, timestamp = HEADER.unpack_from(payload)
+    if version != PAYLOAD_VERSION:
+        raise ValueError(f"Unsupported note payload version: {version}")
+    body = np.frombuffer(payload, dtype=np.uint8, offset=HEADER.size)
+
+    if kind == KIND_BITMASK and len(body) == BITMASK_BYTES:
+        active = np.unpackbits(body, bitorder="little")
+        return NotePacket(sequence, timestamp, set(np.flatnonzero(active).tolist()))
+    if kind == KIND_VELOCITY and len(body) == NUM_NOTES:
+        return NotePacket(sequence, timestamp, set(np.flatnonzero(body).tolist()), body.copy())
+    if kind == KIND_EVENTS and len(body) % 2 == 0:
+        events = [(int(body[i]) & 0x7F, bool(body[i] & NOTE_ON_FLAG), int(body[i + 1]))
+                  for i in range(0, len(body), 2)]
+        return NotePacket(sequence, timestamp, set(), events=events)
+    raise ValueError(f"Malformed note payload (kind {kind}, {len(body)} bytes)")
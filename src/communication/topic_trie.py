@@ -0,0 +1,78 @@
+from typing import Callable, Dict, List, Optional
+
+# Concrete topics whose match results are kept (one per remote client in practice)
+CACHE_SIZE = 1024
+
+class _Node:
+    __slots__ = ("children", "handlers")
+
+    def __init__(self):
+        self.children: Dict[str, "_Node"] = {}
+        self.handlers: List[Callable] = []
+
+class TopicTrie:
+    """MQTT topic filters (with + and # wildcards) mapped to handlers.
+
+    Filters are stored one level per trie node, so matching a topic walks
+    its levels once regardless of how many filters are registered. The
+    handler list for each concrete topic is cached until the filters change.
+    """
+
+    def __init__(self):
+        self.root = _Node()
+        self._filters: Dict[str, List[Callable]] = {}
+        self._cache: Dict[str, List[Callable]] = {}
+
+    def add(self, topic_filter: str, handler: Callable):
+        node = self.root
+        for level in topic_filter.split("/"):
+            node = node.children.setdefault(level, _Node())
+        node.handlers.append(handler)
+        self._filters.setdefault(topic_filter, []).append(handler)
+        self._cache.clear()
+
+    def remove(self, topic_filter: str, handler: Optional[Callable] = None):
+        """Remove one handler from a filter, or all of them"""
+        node = self.root
+        for level in topic_filter.split("/"):
+            node = node.children.get(level)
+            if node is None:
+                return
+        if handler is None:
+            node.handlers.clear()
+        elif handler in node.handlers:
+            node.handlers.remove(handler)
+        if node.handlers:
+            self._filters[topic_filter] = list(node.handlers)
+        else:
+            self._filters.pop(topic_filter, None)
+        self._cache.clear()
+
+    def filters(self) -> List[str]:
+        return list(self._filters)
+
+    def match(self, topic: str) -> List[Callable]:
+        """Handlers of every filter matching a concrete topic"""
+        handlers = self._cache.get(topic)
+        if handlers is None:
+            handlers = []
+            self._match(self.root, topic.split("/"), 0, handlers)
+            if len(self._cache) >= CACHE_SIZE:
+                self._cache.clear()
+            self._cache[topic] = handlers
+        return handlers
+
+    def _match(self, node: _Node, levels: List[str], index: int, handlers: List[Callable]):
+        multi = node.children.get("#")
+        if multi:
+            # '#' also matches the parent level itself ("a/#" matches "a")
+            handlers.extend(multi.handlers)
+        if index == len(levels):
+            handlers.extend(node.handlers)
+            return
+        exact = node.children.get(levels[index])
+        if exact:
+            self._match(exact, levels, index + 1, handlers)
+        single = node.children.get("+")
+        if single:
+            self._match(single, levels, index + 1, handlers)
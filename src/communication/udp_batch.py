@@ -0,0 +1,149 @@
+import ctypes
+import errno
+import os
+import socket
+import sys
+from typing import Dict, List, Optional, Tuple
+
+Address = Tuple[str, int]
+
+class _IOVec(ctypes.Structure):
+    _fields_ = [("iov_base", ctypes.c_void_p), ("iov_len", ctypes.c_size_t)]
+
+class _MsgHdr(ctypes.Structure):
+    _fields_ = [
+        ("msg_name", ctypes.c_void_p),
+        ("msg_namelen", ctypes.c_uint32),
+        ("msg_iov", ctypes.POINTER(_IOVec)),
+        ("msg_iovlen", ctypes.c_size_t),
+        ("msg_control", ctypes.c_void_p),
+        ("msg_controllen", ctypes.c_size_t),
+        ("msg_flags", ctypes.c_int),
+    ]
+
+class _MMsgHdr(ctypes.Structure):
+    _fields_ = [("msg_hdr", _MsgHdr), ("msg_len", ctypes.c_uint)]
+
+class _SockAddrIn(ctypes.Structure):
+    _fields_ = [
+        ("sin_family", ctypes.c_ushort),
+        ("sin_port", ctypes.c_uint16),
+        ("sin_addr", ctypes.c_uint8 * 4),
+        ("sin_zero", ctypes.c_uint8 * 8),
+    ]
+
+def _load_sendmmsg():
+    """libc sendmmsg(2) if this platform has it"""
+    if not sys.platform.startswith("linux"):
+        return None
+    try:
+        libc = ctypes.CDLL(None, use_errno=True)
+        sendmmsg = libc.sendmmsg
+    except (OSError, AttributeError):
+        return None
+    sendmmsg.argtypes = [ctypes.c_int, ctypes.c_void_p, ctypes.c_uint, ctypes.c_int]
+    sendmmsg.restype = ctypes.c_int
+    return sendmmsg
+
+class BatchSender:
+    """Sends many UDP datagrams over one non-blocking socket.
+
+    On Linux a whole batch goes out in one sendmmsg() call; elsewhere (or if
+    the call is unavailable) it falls back to a sendto() loop. Datagrams that
+    would block, or that fail (e.g. host unreachable while a controller
+    reboots), are dropped rather than stalling or raising to the caller.
+    """
+
+    def __init__(self, sock: Optional[socket.socket] = None):
+        self.sock = sock or socket.socket(socket.AF_INET, socket.SOCK_DGRAM)
+        self.sock.setblocking(False)
+        self.sock.setsockopt(socket.SOL_SOCKET, socket.SO_BROADCAST, 1)
+        self._sendmmsg = _load_sendmmsg()
+        self._addresses: Dict[Address, _SockAddrIn] = {}
+        self.dropped = 0
+        self.errors = 0  # Sends that failed with something other than a full buffer
+        self.last_error: Optional[OSError] = None
+
+    @property
+    def uses_sendmmsg(self) -> bool:
+        return self._sendmmsg is not None
+
+    def _sockaddr(self, address: Address) -> _SockAddrIn:
+        sockaddr = self._addresses.get(address)
+        if sockaddr is None:
+            host, port = address
+            sockaddr = _SockAddrIn()
+            sockaddr.sin_family = socket.AF_INET
+            sockaddr.sin_port = socket.htons(port)
+            sockaddr.sin_addr[:] = socket.inet_aton(socket.gethostbyname(host))
+            self._addresses[address] = sockaddr
+        return sockaddr
+
+    def send(self, batch: List[Tuple[memoryview, Address]]) -> int:
+        """Send (packet, address) pairs, returning how many were sent.
+
+        Sending stops at the first packet that would block or fails, so the
+        packets sent are always the first ones of the batch.
+
+        Packets must be writable buffers (bytearray or memoryviews of one)
+        when sendmmsg is used.
+        """
+        if not batch:
+            return 0
+        if self._sendmmsg is not None:
+            return self._send_mmsg(batch)
+        return self._send_loop(batch)
+
+    def _send_loop(self, batch: List[Tuple[memoryview, Address]]) -> int:
+        sent = 0
+        for packet, address in batch:
+            try:
+                self.sock.sendto(packet, address)
+            except BlockingIOError:
+                break  # Buffer full: drop the rest, as sendmmsg does
+            except OSError as e:
+                self._record_error(e)
+                break
+            sent += 1
+        self.dropped += len(batch) - sent
+        return sent
+
+    def _send_mmsg(self, batch: List[Tuple[memoryview, Address]]) -> int:
+        count = len(batch)
+        messages = (_MMsgHdr * count)()
+        iovecs = (_IOVec * count)()
+        buffers = []  # Keep the ctypes views alive until the call returns
+        for i, (packet, address) in enumerate(batch):
+            data = (ctypes.c_char * len(packet)).from_buffer(packet)
+            buffers.append(data)
+            iovecs[i].iov_base = ctypes.addressof(data)
+            iovecs[i].iov_len = len(packet)
+            sockaddr = self._sockaddr(address)
+            header = messages[i].msg_hdr
+            header.msg_name = ctypes.addressof(sockaddr)
+            header.msg_namelen = ctypes.sizeof(sockaddr)
+            header.msg_iov = ctypes.pointer(iovecs[i])
+            header.msg_iovlen = 1
+
+        sent = 0
+        fd = self.sock.fileno()
+        base = ctypes.addressof(messages)
+        while sent < count:
+            result = self._sendmmsg(fd, base + sent * ctypes.sizeof(_MMsgHdr), count - sent, 0)
+            if result < 0:
+                err = ctypes.get_errno()
+                if err == errno.EINTR:
+                    continue
+                if err not in (errno.EAGAIN, errno.EWOULDBLOCK):
+                    self._record_error(OSError(err, os.strerror(err)))
+                break
+            sent += result
+        self.dropped += count - sent
+        return sent
+
+    def _record_error(self, error: OSError):
+        self.errors += 1
+        self.last_error = error
+
+    def close(self):
+        self.sock.close()
@@ -1,45 +1,535 @@
-from typing import List, Dict, Tuple
+from typing import List, Dict, Tuple, Union, Optional
 from ..config.device_config import WLEDDevice
-import socket
+from .udp_batch import BatchSender
+from ..metrics.latency import LatencyTracer
+import numpy as np
+import threading
+import time
+import uuid
+
+# WLED UDP realtime protocols (first byte of every packet)
+WARLS = 1   # [index, r, g, b] per LED, index is one byte
+DRGB = 2    # Sequential RGB for the whole strip
+DNRGB = 4   # Start index (high, low byte) followed by sequential RGB
+
+WARLS_MAX_LEDS = 255
+DRGB_MAX_LEDS = 490
+DNRGB_MAX_LEDS = 489  # Per packet
+
+# Second header byte: seconds before WLED leaves realtime mode, 255 = never
+REALTIME_TIMEOUT = 255
+
+# WLEDDevice.protocol names for explicitly chosen realtime protocols
+REALTIME_PROTOCOLS = {"warls": WARLS, "drgb": DRGB, "dnrgb": DNRGB}
+
+# DDP (Distributed Display Protocol) header fields
+DDP_HEADER_LEN = 10
+DDP_MAX_DATA = 1440     # Bytes of pixel data per packet (480 RGB pixels)
+DDP_FLAGS_VER1 = 0x40
+DDP_FLAGS_PUSH = 0x01
+DDP_TYPE_RGB24 = 0x0B
+DDP_ID_DISPLAY = 1
+
+# DMX universes carry 512 slots, i.e. 170 RGB pixels
+DMX_PIXELS_PER_UNIVERSE = 170
+
+# E1.31 (sACN) data packet layout
+E131_HEADER_LEN = 126
+E131_SEQUENCE_OFFSET = 111
+E131_PRIORITY = 100
+E131_SOURCE_NAME = "Centaurus SeeMusic"
+
+# Art-Net ArtDmx packet layout
+ARTNET_HEADER_LEN = 18
+ARTNET_SEQUENCE_OFFSET = 12
+ARTNET_OPCODE_DMX = 0x5000
+ARTNET_PROTOCOL_VERSION = 14
+
+# Resend an unchanged frame at least this often so WLED stays in realtime mode
+# (and recovers after a controller reboot)
+KEEPALIVE_INTERVAL = 1.0
+
+# Default rate of the background output thread (frames per second)
+OUTPUT_RATE = 60
+
+def select_protocol(num_leds: int) -> int:
+    """Pick the realtime protocol for a full frame of num_leds.
+
+    DRGB carries 3 bytes per LED against WARLS' 4, so WARLS is only used when
+    requested explicitly; strips longer than one DRGB packet use DNRGB.
+    """
+    return DRGB if num_leds <= DRGB_MAX_LEDS else DNRGB
+
+class RealtimeEncoder:
+    """Preallocated WLED UDP realtime packets for one strip.
+
+    All packets of a frame live in a single buffer; encode() only copies the
+    RGB data into place and returns memoryviews of the packets to send.
+    """
+
+    def __init__(self, num_leds: int, protocol: Optional[int] = None,
+                 timeout: int = REALTIME_TIMEOUT):
+        self.num_leds = num_leds
+        self.protocol = protocol or select_protocol(num_leds)
+
+        if self.protocol == WARLS:
+            if num_leds > WARLS_MAX_LEDS:
+                raise ValueError(f"WARLS supports at most {WARLS_MAX_LEDS} LEDs, got {num_leds}")
+            self.buffer = bytearray(2 + num_leds * 4)
+            self.buffer[0:2] = bytes([WARLS, timeout])
+            # [index, r, g, b] records; indices are fixed, RGB is patched per frame
+            records = np.frombuffer(self.buffer, dtype=np.uint8, offset=2).reshape(num_leds, 4)
+            records[:, 0] = np.arange(num_leds)
+            self._rgb = records[:, 1:]
+            self.packets = [memoryview(self.buffer)]
+            self._chunks = []
+        elif self.protocol == DRGB:
+            if num_leds > DRGB_MAX_LEDS:
+                raise ValueError(f"DRGB supports at most {DRGB_MAX_LEDS} LEDs, got {num_leds}")
+            self.buffer = bytearray(2 + num_leds * 3)
+            self.buffer[0:2] = bytes([DRGB, timeout])
+            view = memoryview(self.buffer)
+            self.packets = [view]
+            self._chunks = [(view[2:], 0, num_leds * 3)]
+        elif self.protocol == DNRGB:
+            packet_count = -(-num_leds // DNRGB_MAX_LEDS)
+            self.buffer = bytearray(packet_count * 4 + num_leds * 3)
+            view = memoryview(self.buffer)
+            self.packets = []
+            self._chunks = []
+            offset = 0
+            for start in range(0, num_leds, DNRGB_MAX_LEDS):
+                count = min(DNRGB_MAX_LEDS, num_leds - start)
+                size = 4 + count * 3
+                self.buffer[offset:offset + 4] = bytes([DNRGB, timeout, start >> 8, start & 0xFF])
+                self.packets.append(view[offset:offset + size])
+                self._chunks.append((view[offset + 4:offset + size], start * 3, (start + count) * 3))
+                offset += size
+        else:
+            raise ValueError(f"Unsupported WLED realtime protocol: {self.protocol}")
+
+    def encode(self, frame: Union[bytes, bytearray]) -> List[memoryview]:
+        """Copy a frame of num_leds * 3 RGB bytes into the packets"""
+        if self.protocol == WARLS:
+            self._rgb[...] = np.frombuffer(frame, dtype=np.uint8).reshape(self.num_leds, 3)
+        else:
+            frame = memoryview(frame)
+            for payload, start, end in self._chunks:
+                payload[:] = frame[start:end]
+        return self.packets
+
+class DDPEncoder:
+    """Preallocated DDP packets for one strip.
+
+    A frame is split into packets of up to 1440 data bytes, all sharing one
+    4-bit sequence number. The push flag on the last packet tells the
+    controller to latch the frame; it can be left off and sent separately
+    with push_packet() so several controllers display a frame together.
+    """
+
+    def __init__(self, num_leds: int):
+        self.num_leds = num_leds
+        self.sequence = 0
+        frame_size = num_leds * 3
+        packet_count = max(1, -(-frame_size // DDP_MAX_DATA))
+        self.buffer = bytearray(packet_count * DDP_HEADER_LEN + frame_size)
+        view = memoryview(self.buffer)
+        self.packets: List[memoryview] = []
+        self._chunks = []
+        offset = 0
+        for start in range(0, max(frame_size, 1), DDP_MAX_DATA):
+            length = min(DDP_MAX_DATA, frame_size - start)
+            size = DDP_HEADER_LEN + length
+            self.buffer[offset:offset + DDP_HEADER_LEN] = bytes([
+                DDP_FLAGS_VER1, 0, DDP_TYPE_RGB24, DDP_ID_DISPLAY,
+                *start.to_bytes(4, "big"), *length.to_bytes(2, "big")
+            ])
+            self.packets.append(view[offset:offset + size])
+            self._chunks.append((view[offset + DDP_HEADER_LEN:offset + size], start, start + length))
+            offset += size
+
+        # Header-only packet that latches whatever data was sent last
+        self._push = bytearray([DDP_FLAGS_VER1 | DDP_FLAGS_PUSH, 0, DDP_TYPE_RGB24, DDP_ID_DISPLAY,
+                                0, 0, 0, 0, 0, 0])
+
+    def encode(self, frame: Union[bytes, bytearray], push: bool = True) -> List[memoryview]:
+        """Copy a frame into the packets and stamp flags and sequence number"""
+        self.sequence = self.sequence % 15 + 1  # 1-15, 0 means "not used"
+        frame = memoryview(frame)
+        for packet, (payload, start, end) in zip(self.packets, self._chunks):
+            payload[:] = frame[start:end]
+            packet[0] = DDP_FLAGS_VER1
+            packet[1] = self.sequence
+        if push:
+            self.packets[-1][0] = DDP_FLAGS_VER1 | DDP_FLAGS_PUSH
+        return self.packets
+
+    def push_packet(self) -> bytearray:
+        """Push-only packet for the frame last passed to encode()"""
+        self._push[1] = self.sequence
+        return self._push
+
+class UniverseEncoder:
+    """Base for DMX universe protocols (E1.31, Art-Net).
+
+    The strip is mapped onto consecutive universes of 170 pixels. Every
+    universe packet is preallocated with its header in one buffer; encode()
+    only patches the DMX payload and sequence number in place.
+    """
+
+    header_len = 0
+    sequence_offset = 0
+
+    def __init__(self, num_leds: int, universe: int):
+        self.num_leds = num_leds
+        self.first_universe = universe
+        self.sequence = 0
+
+        layout = []
+        size = 0
+        for index, start in enumerate(range(0, num_leds, DMX_PIXELS_PER_UNIVERSE)):
+            slots = min(DMX_PIXELS_PER_UNIVERSE, num_leds - start) * 3
+            packet_size = self.header_len + self._payload_len(slots)
+            layout.append((universe + index, start * 3, slots, size, packet_size))
+            size += packet_size
+
+        self.buffer = bytearray(size)
+        view = memoryview(self.buffer)
+        self.packets: List[memoryview] = []
+        self._chunks = []
+        for universe_number, start, slots, offset, packet_size in layout:
+            payload_len = packet_size - self.header_len
+            self.buffer[offset:offset + self.header_len] = self._build_header(universe_number, payload_len)
+            self.packets.append(view[offset:offset + packet_size])
+            payload = view[offset + self.header_len:offset + self.header_len + slots]
+            self._chunks.append((payload, start, start + slots))
+
+    def _payload_len(self, slots: int) -> int:
+        return slots
+
+    def _build_header(self, universe: int, payload_len: int) -> bytes:
+        raise NotImplementedError
+
+    def _next_sequence(self) -> int:
+        self.sequence = (self.sequence + 1) % 256
+        return self.sequence
+
+    def encode(self, frame: Union[bytes, bytearray]) -> List[memoryview]:
+        """Copy a frame into the universe packets and bump the sequence number"""
+        sequence = self._next_sequence()
+        frame = memoryview(frame)
+        for packet, (payload, start, end) in zip(self.packets, self._chunks):
+            payload[:] = frame[start:end]
+            packet[self.sequence_offset] = sequence
+        return self.packets
+
+class E131Encoder(UniverseEncoder):
+    """E1.31 / streaming ACN data packets"""
+
+    header_len = E131_HEADER_LEN
+    sequence_offset = E131_SEQUENCE_OFFSET
+
+    def __init__(self, num_leds: int, universe: int = 1, source_name: str = E131_SOURCE_NAME):
+        self.cid = uuid.uuid4().bytes
+        self.source_name = source_name.encode("utf-8")[:63]
+        super().__init__(num_leds, universe)
+
+    def _build_header(self, universe: int, payload_len: int) -> bytes:
+        total = E131_HEADER_LEN + payload_len
+        header = bytearray(E131_HEADER_LEN)
+        # Root layer
+        header[0:2] = (0x0010).to_bytes(2, "big")         # Preamble size
+        header[4:16] = b"ASC-E1.17\x00\x00\x00"          # ACN packet identifier
+        header[16:18] = (0x7000 | (total - 16)).to_bytes(2, "big")
+        header[18:22] = (0x00000004).to_bytes(4, "big")   # VECTOR_ROOT_E131_DATA
+        header[22:38] = self.cid
+        # Framing layer
+        header[38:40] = (0x7000 | (total - 38)).to_bytes(2, "big")
+        header[40:44] = (0x00000002).to_bytes(4, "big")   # VECTOR_E131_DATA_PACKET
+        header[44:44 + len(self.source_name)] = self.source_name
+        header[108] = E131_PRIORITY
+        header[113:115] = universe.to_bytes(2, "big")
+        # DMP layer
+        header[115:117] = (0x7000 | (total - 115)).to_bytes(2, "big")
+        header[117] = 0x02                                # VECTOR_DMP_SET_PROPERTY
+        header[118] = 0xA1                                # Address & data type
+        header[121:123] = (0x0001).to_bytes(2, "big")     # Address increment
+        header[123:125] = (payload_len + 1).to_bytes(2, "big")  # Slots + start code
+        return bytes(header)
+
+class ArtNetEncoder(UniverseEncoder):
+    """Art-Net ArtDmx packets; universe is the 15-bit port address"""
+
+    header_len = ARTNET_HEADER_LEN
+    sequence_offset = ARTNET_SEQUENCE_OFFSET
+
+    def _payload_len(self, slots: int) -> int:
+        return slots + slots % 2  # ArtDmx data length must be even
+
+    def _build_header(self, universe: int, payload_len: int) -> bytes:
+        header = bytearray(ARTNET_HEADER_LEN)
+        header[0:8] = b"Art-Net\x00"
+        header[8:10] = ARTNET_OPCODE_DMX.to_bytes(2, "little")
+        header[10:12] = ARTNET_PROTOCOL_VERSION.to_bytes(2, "big")
+        header[14] = universe & 0xFF         # SubUni
+        header[15] = (universe >> 8) & 0x7F  # Net
+        header[16:18] = payload_len.to_bytes(2, "big")
+        return bytes(header)
+
+    def _next_sequence(self) -> int:
+        self.sequence = self.sequence % 255 + 1  # 0 disables sequencing
+        return self.sequence
+
+def create_encoder(device: WLEDDevice) -> Union[RealtimeEncoder, DDPEncoder, UniverseEncoder]:
+    """Build the packet encoder for a device's configured protocol"""
+    if device.protocol == "ddp":
+        return DDPEncoder(device.num_leds)
+    if device.protocol == "e131":
+        return E131Encoder(device.num_leds, device.universe)
+    if device.protocol == "artnet":
+        return ArtNetEncoder(device.num_leds, device.universe)
+    if device.protocol == "realtime":
+        return RealtimeEncoder(device.num_leds)
+    if device.protocol in REALTIME_PROTOCOLS:
+        return RealtimeEncoder(device.num_leds, REALTIME_PROTOCOLS[device.protocol])
+    raise ValueError(f"Unknown LED protocol for {device.name}: {device.protocol}")
 
 class WLEDManager:
-    def __init__(self, devices: List[WLEDDevice]):
+    def __init__(self, devices: List[WLEDDevice], keepalive_interval: float = KEEPALIVE_INTERVAL,
+                 tracer: Optional[LatencyTracer] = None):
+        """tracer: if given, the "send" latency stage is recorded for the notes in
+        each submitted frame once its packets have actually been transmitted"""
         self.devices = {device.name: device for device in devices}
-        self.sockets: Dict[str, socket.socket] = {}
-        
-        # Create socket for each device
+        self.tracer = tracer
+        self.sender = BatchSender()  # One non-blocking socket shared by all devices
+        self.encoders: Dict[str, Union[RealtimeEncoder, DDPEncoder, UniverseEncoder]] = {}
+        self.keepalive_interval = keepalive_interval
+
+        # Last frame sent to each device, used to suppress unchanged frames
+        self.last_frames: Dict[str, bytes] = {}
+        self.last_sent: Dict[str, float] = {}
+        self.stats: Dict[str, Dict[str, int]] = {}
+
+        # Single-slot mailbox per device for the output thread: newest frame wins
+        self.output_rate = OUTPUT_RATE
+        self._mailbox: Dict[str, bytes] = {}
+        self._mailbox_traces: Dict[str, List[float]] = {}  # Note timestamps riding on each frame
+        self._mailbox_lock = threading.Lock()
+        # Encoders, suppression state, stats and the socket are shared by
+        # direct sends and the output thread
+        self._send_lock = threading.Lock()
+        self._output_thread: Optional[threading.Thread] = None
+        self._output_running = False
+
+        # Realtime devices with the same settings produce identical packets
+        # for identical frames, so those are only encoded once per send.
+        # DDP, E1.31 and Art-Net packets carry a per-device sequence number
+        # (and E1.31 a per-encoder CID), so they are keyed by device
+        self._encoding_keys: Dict[str, Tuple] = {}
+
         for name, device in self.devices.items():
-            self.sockets[name] = socket.socket(socket.AF_INET, socket.SOCK_DGRAM)
-    
-    def send_data(self, device_name: str, colors: List[Tuple[int, int, int]]):
-        """Send color data to specific WLED device"""
+            self.encoders[name] = create_encoder(device)
+            if isinstance(self.encoders[name], RealtimeEncoder):
+                self._encoding_keys[name] = (device.protocol, device.num_leds)
+            else:
+                self._encoding_keys[name] = (name,)
+            self.stats[name] = {"sent": 0, "suppressed": 0, "keepalives": 0}
+
+    def _prepare_frame(self, device_name: str, frame: Union[bytes, bytearray],
+                       force: bool, now: float) -> Optional[Union[bytes, bytearray]]:
+        """Normalize a frame to the strip length, or return None if it should be skipped"""
         if device_name not in self.devices:
             print(f"Unknown WLED device: {device_name}")
-            return
-            
+            return None
+
         device = self.devices[device_name]
-        sock = self.sockets[device_name]
-        
+        stats = self.stats[device_name]
+
+        # Pad with black / truncate to the strip length
+        frame_size = device.num_leds * 3
+        if len(frame) != frame_size:
+            frame = bytes(frame[:frame_size]).ljust(frame_size, b'\x00')
+
+        unchanged = self.last_frames.get(device_name) == frame
+        if unchanged and not force:
+            if now - self.last_sent.get(device_name, 0.0) < self.keepalive_interval:
+                stats["suppressed"] += 1
+                return None
+            stats["keepalives"] += 1
+        return frame
+
+    def send_frame(self, device_name: str, frame: Union[bytes, bytearray], force: bool = False) -> bool:
+        """Send a raw RGB frame to a WLED device, skipping unchanged frames.
+
+        Returns True if the frame was sent.
+        """
+        traces = {device_name: self.tracer.take_framed()} if self.tracer else None
+        return self.send_frames({device_name: frame}, force, traces) > 0
+
+    def send_frames(self, frames: Dict[str, Union[bytes, bytearray]], force: bool = False,
+                    traces: Optional[Dict[str, List[float]]] = None) -> int:
+        """Send one frame per device, skipping unchanged frames.
+
+        When several DDP devices are updated, their data goes out first and
+        the push packets last, so the controllers latch the frame together.
+        traces holds the latency tracer timestamps of each frame's notes;
+        they are recorded only for frames whose packets all went out. A
+        frame that was dropped is not remembered as sent, so it is not
+        suppressed on the next call.
+        Returns the number of devices a frame was sent to.
+        """
+        with self._send_lock:
+            return self._send_frames(frames, force, traces)
+
+    def _send_frames(self, frames: Dict[str, Union[bytes, bytearray]], force: bool,
+                     traces: Optional[Dict[str, List[float]]]) -> int:
+        now = time.monotonic()
+        pending = []
+        for device_name, frame in frames.items():
+            frame = self._prepare_frame(device_name, frame, force, now)
+            if frame is not None:
+                pending.append((device_name, frame))
+
+        ddp_devices = [name for name, _ in pending if isinstance(self.encoders[name], DDPEncoder)]
+        deferred_push = len(ddp_devices) > 1
+
+        batch = []
+        batch_ends: Dict[str, int] = {}  # Index just past each device's last packet
+        encoded: Dict[Tuple, Tuple[List[memoryview], object]] = {}
+        push_encoders = []
+        for device_name, frame in pending:
+            device = self.devices[device_name]
+            frame = bytes(frame)
+            key = (self._encoding_keys[device_name], frame)
+            if key not in encoded:
+                encoder = self.encoders[device_name]
+                if isinstance(encoder, DDPEncoder):
+                    packets = encoder.encode(frame, push=not deferred_push)
+                else:
+                    packets = encoder.encode(frame)
+                encoded[key] = (packets, encoder)
+            packets, encoder = encoded[key]
+
+            # Every packet of the frame goes out back-to-back in one batch
+            address = (device.ip, device.port)
+            batch.extend((packet, address) for packet in packets)
+            batch_ends[device_name] = len(batch)
+            if deferred_push and isinstance(encoder, DDPEncoder):
+                push_encoders.append((device_name, encoder, address))
+
+        # DDP push packets last, so the controllers latch the frame together
+        for device_name, encoder, address in push_encoders:
+            batch.append((encoder.push_packet(), address))
+            batch_ends[device_name] = len(batch)
+        sent = self.sender.send(batch)
+
+        # Packets go out in order, so a device's frame is on the wire if its last packet is
+        delivered = 0
+        for device_name, frame in pending:
+            if batch_ends[device_name] > sent:
+                continue
+            self.last_frames[device_name] = bytes(frame)
+            self.last_sent[device_name] = now
+            self.stats[device_name]["sent"] += 1
+            if self.tracer and traces:
+                self.tracer.frame_sent(traces.get(device_name))
+            delivered += 1
+        return delivered
+
+    def start_output(self, rate: float = OUTPUT_RATE):
+        """Send submitted frames from a background thread at a fixed rate"""
+        if self._output_thread:
+            return
+        self.output_rate = rate
+        self._output_running = True
+        self._output_thread = threading.Thread(target=self._output_worker, daemon=True)
+        self._output_thread.start()
+
+    def stop_output(self):
+        """Stop the output thread, flushing the last submitted frames"""
+        self._output_running = False
+        if self._output_thread:
+            self._output_thread.join(timeout=1.0)
+            self._output_thread = None
+
+    def submit_frame(self, device_name: str, frame: Union[bytes, bytearray]):
+        """Hand a frame to the output thread, replacing any frame not yet sent.
+
+        Without a running output thread the frame is sent immediately.
+        """
+        if not self._output_thread:
+            self.send_frame(device_name, frame)
+            return
+        with self._mailbox_lock:
+            self._mailbox[device_name] = bytes(frame)
+            if self.tracer:
+                # A replaced frame's notes are in the newer frame too
+                self._mailbox_traces.setdefault(device_name, []).extend(self.tracer.take_framed())
+
+    def _take_frames(self) -> Tuple[Dict[str, bytes], Dict[str, List[float]]]:
+        with self._mailbox_lock:
+            frames, self._mailbox = self._mailbox, {}
+            traces, self._mailbox_traces = self._mailbox_traces, {}
+        return frames, traces
+
+    def _output_worker(self):
+        """Output thread: send the newest frames once per tick"""
+        interval = 1.0 / self.output_rate
+        next_tick = time.monotonic()
+        while self._output_running:
+            frames, traces = self._take_frames()
+
+            # Devices without a new frame still need their keepalive
+            now = time.monotonic()
+            with self._send_lock:
+                for device_name, last_frame in self.last_frames.items():
+                    if (device_name not in frames
+                            and now - self.last_sent[device_name] >= self.keepalive_interval):
+                        frames[device_name] = last_frame
+
+            if frames:
+                try:
+                    self.send_frames(frames, traces=traces)
+                except OSError as e:
+                    print(f"WLED output error: {e}")
+
+            next_tick += interval
+            delay = next_tick - time.monotonic()
+            if delay > 0:
+                time.sleep(delay)
+            else:
+                next_tick = time.monotonic()  # Fell behind, don't try to catch up
+
+        # Flush anything submitted after the last tick
+        frames, traces = self._take_frames()
+        if frames:
+            self.send_frames(frames, traces=traces)
+
+    def send_data(self, device_name: str, colors: List[Tuple[int, int, int]]):
+        """Send color data to specific WLED device"""
         data = []
         for color in colors:
             data.extend(color)
-        
-        # Fill remaining LEDs with black
-        remaining = device.num_leds - len(colors)
-        data.extend([0, 0, 0] * remaining)
-        
-        # Create WARLS packet
-        packet = bytearray([2, 255])
-        packet.extend(bytes(data))
-        
-        sock.sendto(packet, (device.ip, device.port))
-    
+        self.send_frame(device_name, bytes(data))
+
     def broadcast_data(self, colors: List[Tuple[int, int, int]]):
         """Send same data to all WLED devices"""
-        for device_name in self.devices:
-            self.send_data(device_name, colors)
-    
+        data = []
+        for color in colors:
+            data.extend(color)
+        frame = bytes(data)
+        self.send_frames({device_name: frame for device_name in self.devices})
+
+    def get_stats(self) -> Dict[str, Dict[str, int]]:
+        """Per-device counts of sent, suppressed and keepalive packets"""
+        return {name: dict(stats) for name, stats in self.stats.items()}
+
+    @property
+    def dropped_packets(self) -> int:
+        """Packets dropped because the socket buffer was full"""
+        return self.sender.dropped
+
     def close(self):
-        """Close all sockets"""
-        for sock in self.sockets.values():
-            sock.close() 
\ No newline at end of file
+        """Stop the output thread and close the socket"""
+        self.stop_output()
+        self.sender.close()
@@ -0,0 +1,311 @@
+"""Local WLED realtime emulator for benchmarking the LED output path.
+
+Binds one UDP port per emulated device, decodes WARLS, DRGB, DNRGB and DDP
+packets into an LED state buffer and keeps throughput/jitter statistics.
+
+    python -m src.communication.wled_emulator --ports 21324 4048
+    python -m src.communication.wled_emulator --bench --devices 10 --leds 600 --protocol ddp
+"""
+import argparse
+import os
+import selectors
+import socket
+import statistics
+import threading
+import time
+from collections import deque
+from typing import Dict, List, Optional
+
+from .wled_client import (
+    WARLS, DRGB, DNRGB, DNRGB_MAX_LEDS, DDP_HEADER_LEN, DDP_FLAGS_PUSH, DDP_FLAGS_VER1, WLEDManager
+)
+from ..config.device_config import WLEDDevice
+
+DRGBW = 3  # Not sent by WLEDManager, decoded for completeness
+
+# Number of inter-arrival samples kept for jitter statistics
+JITTER_WINDOW = 1000
+
+class EmulatedDevice:
+    """LED state and receive statistics for one emulated controller"""
+
+    def __init__(self, port: int, num_leds: int = 0):
+        """num_leds: the strip length if known (0 = learn it from the packets)"""
+        self.port = port
+        self.num_leds = num_leds
+        self.leds = bytearray(num_leds * 3)
+        self.packets = 0
+        self.frames = 0
+        self.bytes = 0
+        self.dropped = 0        # Frames lost (DDP sequence gaps, incomplete DNRGB frames)
+        self.out_of_order = 0   # DDP packets older than the last one seen
+        self.duplicates = 0     # DDP fragments received twice for the same frame
+        self.malformed = 0
+        self.first_packet: Optional[float] = None
+        self.last_packet: Optional[float] = None
+        self.last_frame: Optional[float] = None
+        self.intervals = deque(maxlen=JITTER_WINDOW)  # Seconds between frames
+
+        self._ddp_sequence = 0
+        self._ddp_offsets = set()  # Fragments seen for the current DDP sequence number
+        self._dnrgb_expected = 0  # Next DNRGB start index within the current frame
+        self._dnrgb_length = 0    # Longest DNRGB frame seen, in bytes
+
+    def _write(self, start: int, data: bytes):
+        end = start + len(data)
+        if end > len(self.leds):
+            self.leds.extend(bytes(end - len(self.leds)))
+        self.leds[start:end] = data
+
+    def _frame_done(self, now: float):
+        self.frames += 1
+        if self.last_frame is not None:
+            self.intervals.append(now - self.last_frame)
+        self.last_frame = now
+
+    def receive(self, packet: bytes, now: float):
+        """Decode one datagram"""
+        self.packets += 1
+        self.bytes += len(packet)
+        if self.first_packet is None:
+            self.first_packet = now
+        self.last_packet = now
+
+        if not packet:
+            self.malformed += 1
+            return
+        kind = packet[0]
+        if kind & 0xC0 == DDP_FLAGS_VER1:
+            self._receive_ddp(packet, now)
+        elif kind == WARLS:
+            records = packet[2:]
+            for i in range(0, len(records) - 3, 4):
+                self._write(records[i] * 3, records[i + 1:i + 4])
+            self._frame_done(now)
+        elif kind == DRGB:
+            self._write(0, packet[2:])
+            self._frame_done(now)
+        elif kind == DRGBW:
+            rgbw = packet[2:]
+            rgb = bytearray()
+            for i in range(0, len(rgbw) - 3, 4):
+                rgb += rgbw[i:i + 3]
+            self._write(0, bytes(rgb))
+            self._frame_done(now)
+        elif kind == DNRGB:
+            self._receive_dnrgb(packet, now)
+        else:
+            self.malformed += 1
+
+    def _receive_dnrgb(self, packet: bytes, now: float):
+        if len(packet) < 4:
+            self.malformed += 1
+            return
+        start = (packet[2] << 8) | packet[3]
+        data = packet[4:]
+        # Frame length: the configured strip if given, or longer if the packets say so
+        length = max(self.num_leds * 3, self._dnrgb_length)
+        if start == 0 and self._dnrgb_expected:
+            # A new frame began while the previous one was still open
+            if self._dnrgb_expected < length:
+                self.dropped += 1  # Strip length not reached: incomplete
+            else:
+                self._end_dnrgb_frame(now)  # Strip is a whole number of full packets
+        elif start and start * 3 != self._dnrgb_expected:
+            self.out_of_order += 1
+        self._write(start * 3, data)
+        self._dnrgb_expected = start * 3 + len(data)
+        # A frame ends with a short packet, or at the strip length if it is known
+        if len(data) < DNRGB_MAX_LEDS * 3 or (length and self._dnrgb_expected >= length):
+            self._end_dnrgb_frame(now)
+
+    def _end_dnrgb_frame(self, now: float):
+        self._dnrgb_length = max(self._dnrgb_length, self._dnrgb_expected)
+        self._dnrgb_expected = 0
+        self._frame_done(now)
+
+    def _receive_ddp(self, packet: bytes, now: float):
+        if len(packet) < DDP_HEADER_LEN:
+            self.malformed += 1
+            return
+        flags = packet[0]
+        sequence = packet[1] & 0x0F
+        offset = int.from_bytes(packet[4:8], "big")
+        length = int.from_bytes(packet[8:10], "big")
+
+        if sequence and self._ddp_sequence:
+            step = (sequence - self._ddp_sequence) % 15
+            if step > 7:
+                self.out_of_order += 1
+                return  # Stale data, don't overwrite newer LEDs
+            if step > 1:
+                self.dropped += step - 1
+        if sequence:
+            if sequence != self._ddp_sequence:
+                self._ddp_offsets.clear()
+            elif length and offset in self._ddp_offsets:
+                self.duplicates += 1
+                return
+            if length:
+                self._ddp_offsets.add(offset)
+            self._ddp_sequence = sequence
+
+        if length:
+            self._write(offset, packet[DDP_HEADER_LEN:DDP_HEADER_LEN + length])
+        if flags & DDP_FLAGS_PUSH:
+            self._frame_done(now)
+
+    def report(self) -> Dict[str, float]:
+        """Throughput and timing statistics"""
+        elapsed = (self.last_packet - self.first_packet) if self.packets > 1 else 0.0
+        intervals = list(self.intervals)
+        return {
+            "port": self.port,
+            "leds": len(self.leds) // 3,
+            "packets": self.packets,
+            "frames": self.frames,
+            "packet_rate": self.packets / elapsed if elapsed else 0.0,
+            "frame_rate": self.frames / elapsed if elapsed else 0.0,
+            "bytes_per_s": self.bytes / elapsed if elapsed else 0.0,
+            "jitter_ms": statistics.pstdev(intervals) * 1000 if len(intervals) > 1 else 0.0,
+            "max_interval_ms": max(intervals) * 1000 if intervals else 0.0,
+            "dropped": self.dropped,
+            "out_of_order": self.out_of_order,
+            "duplicates": self.duplicates,
+            "malformed": self.malformed,
+        }
+
+class WLEDEmulator:
+    """Receives LED packets on one or more UDP ports, one device per port"""
+
+    def __init__(self, ports: List[int], host: str = "127.0.0.1", num_leds: int = 0):
+        self.host = host
+        self.devices: Dict[int, EmulatedDevice] = {}
+        self.selector = selectors.DefaultSelector()
+        self.sockets: List[socket.socket] = []
+        for port in ports:
+            sock = socket.socket(socket.AF_INET, socket.SOCK_DGRAM)
+            sock.setsockopt(socket.SOL_SOCKET, socket.SO_RCVBUF, 4 * 1024 * 1024)
+            sock.bind((host, port))
+            sock.setblocking(False)
+            bound_port = sock.getsockname()[1]  # Port 0 picks a free port
+            self.devices[bound_port] = EmulatedDevice(bound_port, num_leds)
+            self.selector.register(sock, selectors.EVENT_READ, self.devices[bound_port])
+            self.sockets.append(sock)
+        self.running = False
+        self.thread = None
+
+    @property
+    def ports(self) -> List[int]:
+        return list(self.devices)
+
+    def poll(self, timeout: float = 0.1):
+        """Receive and decode everything that is pending"""
+        for key, _ in self.selector.select(timeout):
+            sock, device = key.fileobj, key.data
+            while True:
+                try:
+                    packet = sock.recv(65535)
+                except BlockingIOError:
+                    break
+                device.receive(packet, time.perf_counter())
+
+    def start(self):
+        """Receive in a background thread"""
+        self.running = True
+        self.thread = threading.Thread(target=self._run, daemon=True)
+        self.thread.start()
+
+    def _run(self):
+        while self.running:
+            self.poll()
+
+    def stop(self):
+        self.running = False
+        if self.thread:
+            self.thread.join(timeout=1.0)
+            self.thread = None
+
+    def report(self) -> List[Dict[str, float]]:
+        return [device.report() for device in self.devices.values()]
+
+    def close(self):
+        self.stop()
+        self.selector.close()
+        for sock in self.sockets:
+            sock.close()
+
+def print_report(reports: List[Dict[str, float]]):
+    for r in reports:
+        print(f"port {r['port']}: {r['leds']} LEDs | {r['frame_rate']:.1f} fps "
+              f"{r['packet_rate']:.1f} pkt/s {r['bytes_per_s'] / 1024:.1f} KiB/s | "
+              f"jitter {r['jitter_ms']:.2f} ms (max gap {r['max_interval_ms']:.1f} ms) | "
+              f"dropped {r['dropped']} out-of-order {r['out_of_order']} malformed {r['malformed']}")
+
+def run_benchmark(devices: int, num_leds: int, protocol: str, rate: float, duration: float):
+    """Drive WLEDManager's output thread against emulated devices on loopback"""
+    emulator = WLEDEmulator([0] * devices, num_leds=num_leds)
+    wled_devices = [
+        WLEDDevice(name=f"Emulated {i}", ip="127.0.0.1", port=port, num_leds=num_leds, protocol=protocol)
+        for i, port in enumerate(emulator.ports)
+    ]
+    manager = WLEDManager(wled_devices)
+    emulator.start()
+    manager.start_output(rate)
+
+    frame_size = num_leds * 3
+    submit_times = []
+    end = time.perf_counter() + duration
+    while time.perf_counter() < end:
+        frame = os.urandom(frame_size)  # Always changes, so nothing is suppressed
+        start = time.perf_counter()
+        for device in wled_devices:
+            manager.submit_frame(device.name, frame)
+        submit_times.append(time.perf_counter() - start)
+        time.sleep(1.0 / rate)
+
+    manager.close()
+    time.sleep(0.2)
+    emulator.stop()
+
+    print(f"{devices} devices x {num_leds} LEDs over {protocol} at {rate} Hz for {duration}s")
+    print(f"submit_frame per render frame: mean {statistics.mean(submit_times) * 1e6:.1f} us, "
+          f"max {max(submit_times) * 1e6:.1f} us; dropped by sender: {manager.dropped_packets}")
+    print_report(emulator.report())
+    emulator.close()
+
+def main():
+    parser = argparse.ArgumentParser(description="Emulate WLED devices and report receive statistics")
+    parser.add_argument("--host", default="127.0.0.1")
+    parser.add_argument("--ports", type=int, nargs="+", default=[21324])
+    parser.add_argument("--interval", type=float, default=1.0, help="Seconds between reports")
+    parser.add_argument("--bench", action="store_true", help="Run a loopback WLEDManager benchmark")
+    parser.add_argument("--devices", type=int, default=4)
+    parser.add_argument("--leds", type=int,
+                        help="LEDs per device (benchmark default 144; otherwise learned from the packets)")
+    parser.add_argument("--protocol", default="realtime",
+                        choices=["realtime", "warls", "drgb", "dnrgb", "ddp"])
+    parser.add_argument("--rate", type=float, default=60.0)
+    parser.add_argument("--duration", type=float, default=5.0)
+    args = parser.parse_args()
+
+    if args.bench:
+        run_benchmark(args.devices, args.leds or 144, args.protocol, args.rate, args.duration)
+        return
+
+    emulator = WLEDEmulator(args.ports, args.host, args.leds or 0)
+    print(f"Emulating WLED devices on {args.host}:{emulator.ports}")
+    try:
+        next_report = time.monotonic() + args.interval
+        while True:
+            emulator.poll()
+            if time.monotonic() >= next_report:
+                print_report(emulator.report())
+                next_report += args.interval
+    except KeyboardInterrupt:
+        pass
+    finally:
+        emulator.close()
+
+if __name__ == "__main__":
+    main()
@@ -5,14 +5,31 @@ import os
 import socket
 import uuid
 
+# Default UDP port for each LED output protocol
+WLED_REALTIME_PORT = 21324
+DDP_PORT = 4048
+E131_PORT = 5568
+ARTNET_PORT = 6454
+PROTOCOL_PORTS = {
+    "ddp": DDP_PORT,
+    "e131": E131_PORT,
+    "artnet": ARTNET_PORT,
+}
+
 @dataclass
 class WLEDDevice:
     name: str
     ip: str
-    port: int = 21324
+    port: Optional[int] = None  # Defaults to the protocol's standard port
     num_leds: int = 144
     instrument: str = ""  # Which instrument this WLED strip is for
     location: str = ""    # Physical location description
+    protocol: str = "realtime"  # "realtime" (WLED UDP, auto), "warls", "drgb", "dnrgb", "ddp", "e131" or "artnet"
+    universe: int = 1  # First DMX universe for e131/artnet, 170 LEDs per universe
+
+    def __post_init__(self):
+        if self.port is None:
+            self.port = PROTOCOL_PORTS.get(self.protocol, WLED_REALTIME_PORT)
 
 @dataclass
 class UserConfig:
@@ -111,7 +128,9 @@ class DeviceManager:
                     'port': device.port,
                     'num_leds': device.num_leds,
                     'instrument': device.instrument,
-                    'location': device.location
+                    'location': device.location,
+                    'protocol': device.protocol,
+                    'universe': device.universe
                 }
                 for device in self.config.wled_devices
             ]
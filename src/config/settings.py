@@ -5,6 +5,7 @@ WLED_PORT = 21324
 # MQTT settings
 MQTT_BROKER = "localhost"
 MQTT_PORT = 1883
+MQTT_ROOM = "music"  # Only clients in the same room see each other's notes
 
 # Piano settings
 SCREEN_WIDTH = 1200
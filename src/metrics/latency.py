@@ -0,0 +1,147 @@
+"""End-to-end note latency, from the MIDI input callback to the LED packet.
+
+Every note event is stamped with time.perf_counter() in the MIDI input
+callback. LatencyTracer records how long after that stamp the event
+reached each stage of the visualizer pipeline:
+
+    dispatch  note callback starts on the MIDI dispatcher thread
+    note      handle_local_note has updated the note state
+    draw      the next draw() begins on the render thread
+    frame     create_wled_data has built a frame containing the note
+    send      WLEDManager has transmitted that frame's packets
+"""
+import bisect
+import threading
+import time
+from typing import Dict, List, Optional
+
+import numpy as np
+
+STAGES = ("dispatch", "note", "draw", "frame", "send")
+
+# Log-spaced bucket edges from 1 us to 10 s, about 2.3% apart
+BUCKET_EDGES: List[float] = np.geomspace(1e-6, 10.0, 701).tolist()
+
+class LatencyHistogram:
+    """Fixed-size log-bucketed histogram of latencies in seconds"""
+
+    def __init__(self):
+        self.counts = np.zeros(len(BUCKET_EDGES) + 1, dtype=np.int64)
+        self.count = 0
+        self.total = 0.0
+        self.max = 0.0
+
+    def record(self, seconds: float):
+        self.counts[bisect.bisect_left(BUCKET_EDGES, seconds)] += 1
+        self.count += 1
+        self.total += seconds
+        if seconds > self.max:
+            self.max = seconds
+
+    def percentile(self, p: float) -> float:
+        """Upper edge of the bucket holding the p-th percentile, in seconds"""
+        if not self.count:
+            return 0.0
+        index = int(np.searchsorted(np.cumsum(self.counts), self.count * p / 100.0))
+        return min(BUCKET_EDGES[min(index, len(BUCKET_EDGES) - 1)], self.max)
+
+    def summary(self) -> Dict[str, float]:
+        """Count plus mean/p50/p95/p99/max in milliseconds"""
+        return {
+            "count": self.count,
+            "mean_ms": self.total / self.count * 1000 if self.count else 0.0,
+            "p50_ms": self.percentile(50) * 1000,
+            "p95_ms": self.percentile(95) * 1000,
+            "p99_ms": self.percentile(99) * 1000,
+            "max_ms": self.max * 1000,
+        }
+
+class LatencyTracer:
+    """Tracks note events through the pipeline and keeps per-stage histograms.
+
+    begin() and note_applied() run on the thread delivering the note (the
+    MIDI dispatcher), the frame stages on the render thread. Notes that
+    arrive without a MIDI timestamp (mouse clicks, remote notes) start
+    their trace in note_applied().
+    """
+
+    def __init__(self):
+        self.histograms: Dict[str, LatencyHistogram] = {stage: LatencyHistogram() for stage in STAGES}
+        self._local = threading.local()  # Input timestamp of the event being delivered
+        self._lock = threading.Lock()
+        self._pending: List[float] = []   # Applied, not yet drawn
+        self._drawing: List[float] = []   # Drawn, frame not built yet
+        self._framed: List[float] = []    # In a frame that has not been sent
+
+    def begin(self, timestamp: float):
+        """A note event stamped by the MIDI input callback is about to be delivered"""
+        self._local.timestamp = timestamp
+        self._record("dispatch", time.perf_counter() - timestamp)
+
+    def note_applied(self):
+        """The note state now reflects the event being delivered"""
+        timestamp: Optional[float] = getattr(self._local, "timestamp", None)
+        self._local.timestamp = None
+        now = time.perf_counter()
+        if timestamp is None:
+            timestamp = now
+        with self._lock:
+            self.histograms["note"].record(now - timestamp)
+            self._pending.append(timestamp)
+
+    def draw_started(self):
+        self._advance("draw", "_pending", "_drawing")
+
+    def frame_built(self):
+        self._advance("frame", "_drawing", "_framed")
+
+    def take_framed(self) -> List[float]:
+        """Timestamps of notes in frames built since the last call, for the
+        output side to hand back to frame_sent() once the frame is on the wire"""
+        with self._lock:
+            timestamps, self._framed = self._framed, []
+        return timestamps
+
+    def frame_sent(self, timestamps: List[float]):
+        """Notes from take_framed() whose frame has been transmitted"""
+        if not timestamps:
+            return
+        now = time.perf_counter()
+        with self._lock:
+            histogram = self.histograms["send"]
+            for timestamp in timestamps:
+                histogram.record(now - timestamp)
+
+    def _advance(self, stage: str, source: str, target: Optional[str]):
+        now = time.perf_counter()
+        with self._lock:
+            timestamps = getattr(self, source)
+            if not timestamps:
+                return
+            histogram = self.histograms[stage]
+            for timestamp in timestamps:
+                histogram.record(now - timestamp)
+            setattr(self, source, [])
+            if target:
+                getattr(self, target).extend(timestamps)
+
+    def _record(self, stage: str, seconds: float):
+        with self._lock:
+            self.histograms[stage].record(seconds)
+
+    def report(self) -> Dict[str, Dict[str, float]]:
+        """Per-stage summaries, each measured from the MIDI input callback"""
+        with self._lock:
+            return {stage: self.histograms[stage].summary() for stage in STAGES}
+
+    def print_report(self):
+        print("Note latency from MIDI input (ms):")
+        for stage, s in self.report().items():
+            print(f"  {stage:<8} n={s['count']:<6} p50 {s['p50_ms']:7.2f}  p95 {s['p95_ms']:7.2f}  "
+                  f"p99 {s['p99_ms']:7.2f}  max {s['max_ms']:7.2f}")
+
+    def reset(self):
+        with self._lock:
+            for stage in STAGES:
+                self.histograms[stage] = LatencyHistogram()
+            self._pending, self._drawing, self._framed = [], [], []
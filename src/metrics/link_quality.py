@@ -0,0 +1,32 @@
+from dataclasses import asdict, dataclass
+from typing import Dict, Optional
+
+@dataclass
+class LinkStats:
+    """Per-source counters for a remote note stream"""
+    received: int = 0       # Payloads applied
+    duplicates: int = 0     # Same sequence number as the last applied payload
+    stale: int = 0          # Older than the last applied payload (arrived late)
+    gaps: int = 0           # Times one or more payloads went missing
+    lost: int = 0           # Payloads skipped over by those gaps
+    resyncs: int = 0        # Sequence restarts accepted after repeated stale payloads
+    last_sequence: Optional[int] = None
+    stale_streak: int = 0   # Stale payloads in a row, reset by any newer one
+
+    @property
+    def loss_rate(self) -> float:
+        expected = self.received + self.lost
+        return self.lost / expected if expected else 0.0
+
+    def as_dict(self) -> Dict[str, float]:
+        stats = asdict(self)
+        stats["loss_rate"] = self.loss_rate
+        return stats
+
+def print_link_stats(stats: Dict[str, LinkStats]):
+    print("Remote link quality:")
+    if not stats:
+        print("  no remote sources")
+    for source_id, s in stats.items():
+        print(f"  {source_id:<16} received {s.received:<6} lost {s.lost} ({s.loss_rate:.1%}) in {s.gaps} gaps | "
+              f"stale {s.stale} duplicates {s.duplicates} resyncs {s.resyncs}")
@@ -1,16 +1,39 @@
 import mido
+import queue
 import threading
 import time
-from typing import Callable, Set, Optional
+from typing import Callable, Optional
+
+from .midi_watcher import MIDIDeviceWatcher, WATCH_INTERVAL
+from .note_state import NoteState
+from ..metrics.latency import LatencyTracer
 
 class MIDIHandler:
-    def __init__(self, note_callback: Callable[[int, bool], None]):
+    def __init__(self, note_callback: Callable[[int, bool, int], None], mode: str = "callback",
+                 note_state: Optional[NoteState] = None, tracer: Optional[LatencyTracer] = None):
+        """mode: "callback" uses the backend's native input callback,
+        "poll" polls iter_pending() every millisecond.
+
+        Messages update note_state (velocity, channel, sustain pedal);
+        note_callback(note, is_on, velocity) fires when a note starts or
+        stops sounding.
+        """
         self.note_callback = note_callback
+        self.note_state = note_state or NoteState()
+        self.tracer = tracer
+        self.mode = mode
         self.input = None
+        self.device_name = None  # Device currently open
         self.devices = []
         self.current_device_index = -1
         self.thread = None
         self.running = False
+        self.watcher = None
+        self.device_change_callback = None
+        self._connect_lock = threading.RLock()  # connect() may race the watcher thread
+
+        # (timestamp, message) pairs from the input callback
+        self.events: "queue.SimpleQueue" = queue.SimpleQueue()
         
         # Try to load last used device
         self.last_device = None
@@ -35,8 +58,16 @@ class MIDIHandler:
         self.current_device_index = (self.current_device_index + 1) % len(self.devices)
         return self.devices[self.current_device_index]
     
-    def connect(self, device_name: Optional[str] = None) -> bool:
-        """Connect to MIDI device"""
+    def connect(self, device_name: Optional[str] = None, remember: bool = True) -> bool:
+        """Connect to MIDI device.
+
+        remember: make it the saved device, preferred on later starts and
+        switched back to by watch() whenever it reappears.
+        """
+        with self._connect_lock:
+            return self._connect(device_name, remember)
+
+    def _connect(self, device_name: Optional[str], remember: bool) -> bool:
         try:
             if self.input:
                 self.close()
@@ -47,41 +78,125 @@ class MIDIHandler:
             if not device_name:
                 return False
                 
-            self.input = mido.open_input(device_name)
-            self.last_device = device_name
-            
-            # Save successful device
-            with open('last_midi_device.txt', 'w') as f:
-                f.write(device_name)
-            
             self.running = True
-            self.thread = threading.Thread(target=self._midi_listener, daemon=True)
+            if self.mode == "callback":
+                self.input = mido.open_input(device_name, callback=self._on_message)
+                self.thread = threading.Thread(target=self._dispatch_events, daemon=True)
+            else:
+                self.input = mido.open_input(device_name)
+                self.thread = threading.Thread(target=self._midi_listener, daemon=True)
             self.thread.start()
+            self.device_name = device_name
+            if remember:
+                self.last_device = device_name
+                if self.watcher:
+                    self.watcher.preferred_device = device_name
+
+                # Save successful device
+                with open('last_midi_device.txt', 'w') as f:
+                    f.write(device_name)
             return True
             
         except Exception as e:
             print(f"MIDI connection error: {e}")
             return False
     
+    def watch(self, interval: float = WATCH_INTERVAL,
+              on_change: Optional[Callable[[str, bool], None]] = None):
+        """Keep an input open as devices come and go.
+
+        With no input open, any device that appears is used; the saved
+        device is switched back to whenever it is plugged back in, and if
+        the open device goes away another available one is tried.
+        on_change(device, connected) is called from the watcher thread.
+        """
+        self.device_change_callback = on_change
+        if not self.watcher:
+            self.watcher = MIDIDeviceWatcher(self._device_connected, self._device_disconnected,
+                                             interval, preferred_device=self.last_device)
+            self.watcher.start()
+
+    def _device_connected(self, name: str):
+        with self._connect_lock:
+            self._switch_to(name)
+
+    def _switch_to(self, name: str):
+        if self.input and (name != self.last_device or name == self.device_name):
+            return  # Keep the open device unless the saved one is back
+        # Without a saved device the first one found becomes it, as with connect()
+        remember = not self.last_device or name == self.last_device
+        if self.connect(name, remember) and self.device_change_callback:
+            self.device_change_callback(name, True)
+
+    def _device_disconnected(self, name: str):
+        with self._connect_lock:
+            if not self.input or name != self.device_name:
+                return
+            self.close()
+            if self.device_change_callback:
+                self.device_change_callback(name, False)
+            # Fall back to whatever else is plugged in
+            for other in sorted(self.watcher.devices if self.watcher else ()):
+                if other != name:
+                    self._switch_to(other)
+                    if self.input:
+                        break
+
+    def _on_message(self, message):
+        """Input callback (runs on the MIDI backend's thread)"""
+        self.events.put((time.perf_counter(), message))
+
+    def _dispatch_events(self):
+        """Deliver queued events; blocks instead of polling while idle"""
+        while self.running:
+            event = self.events.get()
+            if event is None:
+                break
+            timestamp, message = event
+            try:
+                self._handle_message(message, timestamp)
+            except Exception as e:
+                print(f"MIDI callback error: {e}")
+
+    def _handle_message(self, message, timestamp: Optional[float] = None):
+        for note, is_on, velocity in self.note_state.handle_message(message):
+            if self.tracer:
+                self.tracer.begin(timestamp or time.perf_counter())
+            self.note_callback(note, is_on, velocity)
+
     def _midi_listener(self):
         """MIDI message listener thread"""
         while self.running and self.input:
             try:
                 for message in self.input.iter_pending():
-                    if message.type == 'note_on':
-                        self.note_callback(message.note, message.velocity > 0)
-                    elif message.type == 'note_off':
-                        self.note_callback(message.note, False)
+                    self._handle_message(message)
                 time.sleep(0.001)
             except Exception as e:
                 print(f"MIDI listener error: {e}")
                 break
     
     def close(self):
-        """Close MIDI connection"""
+        """Close MIDI connection, releasing any notes still held on it"""
         self.running = False
+        self.events.put(None)  # Wake the dispatcher
         if self.thread:
             self.thread.join(timeout=1.0)
+            self.thread = None
         if self.input:
             self.input.close()
-            self.input = None 
\ No newline at end of file
+            self.input = None
+        self.device_name = None
+        # Drop anything left over, including the wake-up marker
+        while not self.events.empty():
+            self.events.get_nowait()
+        # Their note-offs will never arrive from the closed port
+        for note in self.note_state.clear_local():
+            try:
+                self.note_callback(note, False, 0)
+            except Exception as e:
+                print(f"MIDI callback error: {e}")
+
+    def stop_watching(self):
+        if self.watcher:
+            self.watcher.stop()
+            self.watcher = None
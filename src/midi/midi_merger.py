@@ -0,0 +1,168 @@
+import mido
+import queue
+import threading
+import time
+from typing import Callable, Dict, List, Optional
+
+from .midi_watcher import MIDIDeviceWatcher, WATCH_INTERVAL
+from .note_state import NoteState, NUM_NOTES
+from ..metrics.latency import LatencyTracer
+
+class MIDIInputMerger:
+    """Opens every MIDI input port and merges them into one event stream.
+
+    Each port's native callback stamps its messages and queues them on a
+    single queue, so the dispatcher sees one time-ordered stream tagged with
+    the source port. Each port has its own NoteState (velocity, channel and
+    sustain pedal): note_callback(note, is_on, velocity) only fires when a
+    note starts sounding on any port or stops sounding on all of them, and
+    closing a port releases just that port's notes.
+    """
+
+    def __init__(self, note_callback: Callable[[int, bool, int], None],
+                 message_callback: Optional[Callable[[str, mido.Message], None]] = None,
+                 tracer: Optional[LatencyTracer] = None):
+        self.note_callback = note_callback
+        self.message_callback = message_callback
+        self.tracer = tracer
+        self.inputs: Dict[str, mido.ports.BaseInput] = {}
+        self.port_notes: Dict[str, NoteState] = {}
+        self._note_counts = [0] * NUM_NOTES  # Ports sounding each note
+        self.watcher = None
+        self.device_change_callback = None
+
+        # (timestamp, port_name, message); None wakes the dispatcher to exit
+        self.events: "queue.SimpleQueue" = queue.SimpleQueue()
+        self._stamp_lock = threading.Lock()  # Keeps queue order == timestamp order
+        self._state_lock = threading.Lock()
+        self.running = True
+        self.thread = threading.Thread(target=self._dispatch_events, daemon=True)
+        self.thread.start()
+
+    @property
+    def ports(self) -> List[str]:
+        return list(self.inputs)
+
+    def open_all(self) -> List[str]:
+        """Open every available input port, close ports that have gone away"""
+        available = mido.get_input_names()
+        for name in self.ports:
+            if name not in available:
+                self.close_port(name)
+        for name in available:
+            if name not in self.inputs:
+                self.open_port(name)
+        return self.ports
+
+    def watch(self, interval: float = WATCH_INTERVAL,
+              on_change: Optional[Callable[[str, bool], None]] = None):
+        """Open and close ports as devices are plugged in and removed.
+
+        Scanning runs on the watcher thread; on_change(device, connected) is
+        called from there after each port is opened or closed.
+        """
+        self.device_change_callback = on_change
+        if not self.watcher:
+            self.watcher = MIDIDeviceWatcher(self._device_connected, self._device_disconnected, interval)
+            self.watcher.start()
+
+    def rescan(self):
+        """Pick up device changes now without blocking the caller"""
+        if self.watcher:
+            self.watcher.rescan()
+        else:
+            self.open_all()
+
+    def _device_connected(self, name: str):
+        if self.open_port(name) and self.device_change_callback:
+            self.device_change_callback(name, True)
+
+    def _device_disconnected(self, name: str):
+        if name not in self.inputs:
+            return
+        self.close_port(name)
+        if self.device_change_callback:
+            self.device_change_callback(name, False)
+
+    def open_port(self, name: str) -> bool:
+        """Open one input port and add it to the merged stream"""
+        if name in self.inputs:
+            return True
+        try:
+            self.inputs[name] = mido.open_input(name, callback=lambda message: self._on_message(name, message))
+            print(f"MIDI input opened: {name}")
+            return True
+        except Exception as e:
+            print(f"Error opening MIDI input {name}: {e}")
+            return False
+
+    def close_port(self, name: str):
+        """Close one input port and release the notes it was holding"""
+        port = self.inputs.pop(name, None)
+        if port:
+            try:
+                port.close()
+            except Exception as e:
+                print(f"Error closing MIDI input {name}: {e}")
+        # Queue the release so it is ordered after the port's last messages
+        self._put(name, None)
+
+    def _put(self, name: str, message: Optional[mido.Message]):
+        with self._stamp_lock:
+            self.events.put((time.perf_counter(), name, message))
+
+    def _on_message(self, name: str, message: mido.Message):
+        """Input callback (runs on the MIDI backend's thread)"""
+        self._put(name, message)
+
+    def _dispatch_events(self):
+        while self.running:
+            event = self.events.get()
+            if event is None:
+                break
+            timestamp, name, message = event
+            try:
+                if message is None:
+                    self._release_port(name)
+                    continue
+                if self.message_callback:
+                    self.message_callback(name, message)
+                state = self.port_notes.get(name)
+                if state is None:
+                    state = self.port_notes[name] = NoteState()
+                for note, is_on, velocity in state.handle_message(message):
+                    if self.tracer:
+                        self.tracer.begin(timestamp)
+                    self._note_changed(note, is_on, velocity)
+            except Exception as e:
+                print(f"MIDI callback error: {e}")
+
+    def _note_changed(self, note: int, is_on: bool, velocity: int):
+        with self._state_lock:
+            self._note_counts[note] += 1 if is_on else -1
+            changed = self._note_counts[note] == (1 if is_on else 0)
+        if changed:
+            self.note_callback(note, is_on, velocity)
+
+    def _release_port(self, name: str):
+        state = self.port_notes.get(name)
+        if state:
+            for note in state.clear_local():
+                self._note_changed(note, False, 0)
+        if name not in self.inputs:
+            self.port_notes.pop(name, None)
+
+    def close(self):
+        """Close every port and stop the watcher and dispatcher"""
+        if self.watcher:
+            self.watcher.stop()
+            self.watcher = None
+        for name in self.ports:
+            port = self.inputs.pop(name)
+            try:
+                port.close()
+            except Exception as e:
+                print(f"Error closing MIDI input {name}: {e}")
+        self.running = False
+        self.events.put(None)
+        self.thread.join(timeout=1.0)
@@ -0,0 +1,268 @@
+"""MIDI file playback through the same path as live input.
+
+Messages go through a NoteState (velocity, channel, sustain pedal) and
+note_callback(note, is_on, velocity) fires exactly as it does for
+MIDIHandler and MIDIInputMerger, so a recorded passage can stand in for a
+keyboard on machines without MIDI hardware.
+
+    python -m src.midi.midi_player song.mid
+    python -m src.midi.midi_player song.mid --speed 4
+    python -m src.midi.midi_player song.mid --fast --render
+    python -m src.midi.midi_player --fast --render --wled --mqtt events --coalesce 0.003
+
+Without a file a synthetic chord passage is played, so the benchmarks run
+on machines (or CI) with no MIDI hardware or files.
+"""
+import argparse
+import statistics
+import threading
+import time
+from typing import Callable, Dict, List, Optional, Tuple, Union
+
+import mido
+import numpy as np
+
+from .note_state import NoteState
+from ..communication import note_codec
+from ..metrics.latency import LatencyTracer
+
+# Sleep until this close to an event, then spin for the last stretch
+SPIN_THRESHOLD = 0.002
+
+# Events played later than this count as late
+LATE_THRESHOLD = 0.001
+
+Event = Tuple[float, mido.Message]  # (seconds from start, message)
+
+def load_events(path: str) -> List[Event]:
+    """Channel messages from a MIDI file with absolute times in seconds"""
+    events = []
+    now = 0.0
+    for message in mido.MidiFile(path):
+        now += message.time  # Delta seconds, tempo changes already applied
+        if not message.is_meta:
+            events.append((now, message))
+    return events
+
+class MIDIFilePlayer:
+    """Plays MIDI files in real time, at N x speed or as fast as possible"""
+
+    def __init__(self, note_callback: Callable[[int, bool, int], None],
+                 note_state: Optional[NoteState] = None,
+                 message_callback: Optional[Callable[[mido.Message], None]] = None,
+                 tracer: Optional[LatencyTracer] = None):
+        self.note_callback = note_callback
+        self.message_callback = message_callback
+        self.tracer = tracer
+        self.note_state = note_state or NoteState()
+        self.thread = None
+        self._stop = threading.Event()
+        self.stats: Dict[str, float] = {}
+
+    def play(self, source: Union[str, List[Event]], speed: float = 1.0) -> Dict[str, float]:
+        """Play a file (or preloaded events) and block until it finishes.
+
+        speed: 1.0 plays in real time, N plays N times faster, 0 plays as
+        fast as possible.
+        """
+        events = load_events(source) if isinstance(source, str) else source
+        self._stop.clear()
+        self.stats = {"events": 0, "notes": 0, "late": 0, "max_late_ms": 0.0, "duration": 0.0}
+
+        start = time.perf_counter()
+        for at, message in events:
+            if self._stop.is_set():
+                break
+            if speed > 0:
+                due = start + at / speed
+                self._wait_until(due)
+                late = time.perf_counter() - due
+                if late > LATE_THRESHOLD:
+                    self.stats["late"] += 1
+                self.stats["max_late_ms"] = max(self.stats["max_late_ms"], late * 1000)
+            self._handle_message(message)
+
+        # Release anything still sounding (stopped early or no note-offs in the file)
+        for note in self.note_state.clear_local():
+            self.note_callback(note, False, 0)
+        self.stats["duration"] = time.perf_counter() - start
+        return self.stats
+
+    def _wait_until(self, due: float):
+        while True:
+            remaining = due - time.perf_counter()
+            if remaining <= 0 or self._stop.is_set():
+                return
+            if remaining > SPIN_THRESHOLD:
+                self._stop.wait(remaining - SPIN_THRESHOLD)
+            else:
+                time.sleep(0)  # Spin, but let other threads run
+
+    def _handle_message(self, message: mido.Message):
+        self.stats["events"] += 1
+        if self.message_callback:
+            self.message_callback(message)
+        for note, is_on, velocity in self.note_state.handle_message(message):
+            if is_on:
+                self.stats["notes"] += 1
+            if self.tracer:
+                self.tracer.begin(time.perf_counter())
+            self.note_callback(note, is_on, velocity)
+
+    def start(self, source: Union[str, List[Event]], speed: float = 1.0):
+        """Play in a background thread"""
+        self.stop()
+        self.thread = threading.Thread(target=self.play, args=(source, speed), daemon=True)
+        self.thread.start()
+
+    @property
+    def playing(self) -> bool:
+        return self.thread is not None and self.thread.is_alive()
+
+    def stop(self):
+        self._stop.set()
+        if self.thread:
+            self.thread.join(timeout=1.0)
+            self.thread = None
+
+# Strip used by the --render/--wled benchmarks: the test visualizer's piano roll
+BENCH_LEDS = 144
+BENCH_START_NOTE = 36
+BENCH_TOTAL_NOTES = 48
+BENCH_LED_OFFSET = 1
+BENCH_NOTE_OFFSET = -7
+
+def demo_events(chords: int = 500, interval: float = 0.05) -> List[Event]:
+    """Synthetic passage of four-note chords, for benchmarks without a MIDI file"""
+    events = []
+    for i in range(chords):
+        root = 36 + (i * 5) % 48
+        at = i * interval
+        for offset, note in enumerate((root, root + 4, root + 7, root + 12)):
+            events.append((at + offset * 0.002, mido.Message("note_on", note=note, velocity=64 + i % 64)))
+        for note in (root, root + 4, root + 7, root + 12):
+            events.append((at + interval * 0.9, mido.Message("note_off", note=note)))
+    return events
+
+class LoopbackMQTT:
+    """Stands in for the paho client in benchmarks: decodes every publish.
+
+    Without coalescing that decode runs inside publish_notes, so it is part
+    of the publish timing.
+    """
+
+    def __init__(self):
+        self.messages = 0
+        self.bytes = 0
+
+    def publish(self, topic, payload=b"", qos=0, retain=False):
+        if isinstance(payload, (bytes, bytearray)) and payload:
+            note_codec.decode(payload)
+            self.messages += 1
+            self.bytes += len(payload)
+
+    def will_set(self, *args, **kwargs):
+        pass
+
+    def connect(self, *args, **kwargs):
+        pass
+
+    def loop_start(self):
+        pass
+
+    def loop_stop(self):
+        pass
+
+    def disconnect(self):
+        pass
+
+    def subscribe(self, *args, **kwargs):
+        pass
+
+def print_timings(stage: str, times: List[float]):
+    times = sorted(times)
+    print(f"{stage}: n={len(times)} mean {statistics.mean(times) * 1e6:.1f} us, "
+          f"p99 {times[int(len(times) * 0.99)] * 1e6:.1f} us")
+
+def main():
+    parser = argparse.ArgumentParser(description="Play a MIDI file through the live note path")
+    parser.add_argument("file", nargs="?", help="MIDI file (default: a synthetic chord passage)")
+    parser.add_argument("--speed", type=float, default=1.0, help="Playback speed multiplier")
+    parser.add_argument("--fast", action="store_true", help="Play as fast as possible")
+    parser.add_argument("--render", action="store_true",
+                        help="Build the piano roll LED frame on every note change and time it")
+    parser.add_argument("--wled", action="store_true",
+                        help="Also send each frame through WLEDManager to a loopback socket and time it")
+    parser.add_argument("--mqtt", choices=("events", "snapshot"),
+                        help="Publish every note change with MusicMQTTClient (loopback, no broker) and time it")
+    parser.add_argument("--coalesce", type=float, default=0.0, metavar="SECONDS",
+                        help="MQTT coalescing window for --mqtt")
+    args = parser.parse_args()
+
+    timings: Dict[str, List[float]] = {}
+    player = MIDIFilePlayer(lambda note, is_on, velocity: None)
+    stages = []  # (name, function) run in order on every note change
+
+    if args.render or args.wled:
+        from ..visualizers.led_frame import LEDFrameEngine, piano_roll_notes
+        engine = LEDFrameEngine(
+            piano_roll_notes(BENCH_LEDS, BENCH_START_NOTE, BENCH_TOTAL_NOTES, BENCH_LED_OFFSET, BENCH_NOTE_OFFSET),
+            [(255, 0, 0), (0, 255, 0), (0, 0, 255)]
+        )
+        frame = [engine.buffer]
+
+        def render():
+            frame[0] = engine.render_velocity(player.note_state.active, player.note_state.local_velocity)
+        stages.append(("render", render))
+
+    if args.wled:
+        import socket
+        from ..communication.wled_client import WLEDManager
+        from ..config.device_config import WLEDDevice
+        sink = socket.socket(socket.AF_INET, socket.SOCK_DGRAM)
+        sink.bind(("127.0.0.1", 0))
+        wled = WLEDManager([WLEDDevice(name="bench", ip="127.0.0.1", port=sink.getsockname()[1],
+                                       num_leds=BENCH_LEDS)])
+        stages.append(("wled", lambda: wled.send_frame("bench", frame[0])))
+
+    if args.mqtt:
+        from ..communication.mqtt_client import MusicMQTTClient
+        loopback = LoopbackMQTT()
+        mqtt = MusicMQTTClient("bench", "bench", mode=args.mqtt, snapshot_interval=0,
+                               coalesce_window=args.coalesce)
+        mqtt.client = loopback
+        mqtt.connect()
+        mqtt.connected = True  # No broker to confirm it
+
+        def publish():
+            state = player.note_state
+            mqtt.publish_notes(set(np.flatnonzero(state.local).tolist()), state.local_velocity)
+        stages.append(("publish", publish))
+
+    if stages:
+        def on_note(note, is_on, velocity):
+            for name, stage in stages:
+                start = time.perf_counter()
+                stage()
+                timings.setdefault(name, []).append(time.perf_counter() - start)
+        player.note_callback = on_note
+
+    events = load_events(args.file) if args.file else demo_events()
+    stats = player.play(events, 0 if args.fast else args.speed)
+    rate = stats['events'] / stats['duration'] if stats['duration'] else 0.0
+    print(f"{stats['events']} events, {stats['notes']} notes in {stats['duration']:.3f}s ({rate:.0f} events/s)")
+    if not args.fast:
+        print(f"late events: {stats['late']}, max lateness {stats['max_late_ms']:.2f} ms")
+    for name, times in timings.items():
+        print_timings(name, times)
+    if args.wled:
+        print(f"wled: {wled.get_stats()['bench']}, {wled.dropped_packets} packets dropped")
+        wled.close()
+        sink.close()
+    if args.mqtt:
+        mqtt.disconnect()  # Flushes anything still coalescing
+        print(f"mqtt: {mqtt.changes} changes -> {mqtt.publishes} publishes, "
+              f"{loopback.messages} payloads decoded, {loopback.bytes} bytes")
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,68 @@
+import mido
+import threading
+from typing import Callable, List, Optional, Set
+
+# Seconds between scans of the MIDI input port list
+WATCH_INTERVAL = 1.0
+
+class MIDIDeviceWatcher:
+    """Watches the MIDI input port list from a background thread.
+
+    The port list is rescanned every interval (or on rescan()) and diffed
+    against the previous scan; on_connect / on_disconnect are called with the
+    port name from the watcher thread, so device enumeration never runs on
+    the render thread.
+    """
+
+    def __init__(self, on_connect: Callable[[str], None], on_disconnect: Callable[[str], None],
+                 interval: float = WATCH_INTERVAL, preferred_device: Optional[str] = None):
+        self.on_connect = on_connect
+        self.on_disconnect = on_disconnect
+        self.interval = interval
+        self.preferred_device = preferred_device  # Reported first when it appears
+        self.devices: Set[str] = set()
+        self.running = False
+        self.thread = None
+        self._wake = threading.Event()
+
+    def start(self):
+        if self.thread:
+            return
+        self.running = True
+        self.thread = threading.Thread(target=self._watch, daemon=True)
+        self.thread.start()
+
+    def rescan(self):
+        """Ask the watcher thread to scan now instead of waiting for the next interval"""
+        self._wake.set()
+
+    def _watch(self):
+        while self.running:
+            try:
+                self.scan()
+            except Exception as e:
+                print(f"MIDI watcher error: {e}")
+            self._wake.wait(self.interval)
+            self._wake.clear()
+
+    def scan(self):
+        """Diff the current port list against the last scan"""
+        available = set(mido.get_input_names())
+        removed = self.devices - available
+        added: List[str] = sorted(available - self.devices)
+        if self.preferred_device in added:
+            added.remove(self.preferred_device)
+            added.insert(0, self.preferred_device)
+
+        self.devices = available
+        for name in removed:
+            self.on_disconnect(name)
+        for name in added:
+            self.on_connect(name)
+
+    def stop(self):
+        self.running = False
+        self._wake.set()
+        if self.thread:
+            self.thread.join(timeout=1.0)
+            self.thread = None
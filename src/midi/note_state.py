@@ -0,0 +1,155 @@
+import threading
+import numpy as np
+from typing import Dict, Iterable, List, Set, Tuple
+
+NUM_NOTES = 128
+NUM_CHANNELS = 16
+SUSTAIN_CC = 64  # Damper pedal; values >= 64 mean down
+
+# (note, is_on, velocity) for a note that started or stopped sounding
+NoteChange = Tuple[int, bool, int]
+
+class NoteState:
+    """Active notes from local MIDI and remote sources, kept as refcounts.
+
+    Updates are applied incrementally so that checking whether a note is
+    sounding is a single array lookup, independent of the number of sources.
+    Local notes keep their velocity per channel, and a released key keeps
+    sounding while that channel's sustain pedal (CC64) is down.
+    """
+
+    def __init__(self):
+        self.local_notes: Set[int] = set()
+        self.remote_notes: Dict[str, Set[int]] = {}  # {source_id: notes}
+
+        # Local notes: velocity per channel (0 = silent), keys held down and the sustain latch
+        self.velocity = np.zeros((NUM_CHANNELS, NUM_NOTES), dtype=np.uint8)
+        self.held = np.zeros((NUM_CHANNELS, NUM_NOTES), dtype=bool)
+        self.sustain = np.zeros(NUM_CHANNELS, dtype=bool)
+        self.local_velocity = np.zeros(NUM_NOTES, dtype=np.uint8)  # Loudest channel per note
+
+        self.local = np.zeros(NUM_NOTES, dtype=bool)
+        self.remote_counts = np.zeros(NUM_NOTES, dtype=np.uint16)  # Sources holding each note
+        self.remote = np.zeros(NUM_NOTES, dtype=bool)
+        self.active = np.zeros(NUM_NOTES, dtype=bool)  # Local or any remote source
+
+        self._lock = threading.Lock()
+
+    def _refresh(self, note: int):
+        self.active[note] = self.local[note] or self.remote[note]
+
+    def _refresh_local(self, note: int):
+        velocity = self.velocity[:, note].max()
+        self.local_velocity[note] = velocity
+        self.local[note] = velocity > 0
+        if velocity:
+            self.local_notes.add(note)
+        else:
+            self.local_notes.discard(note)
+        self._refresh(note)
+
+    def _silence(self, channel: int, note: int) -> bool:
+        was_on = self.local[note]
+        self.velocity[channel, note] = 0
+        self._refresh_local(note)
+        return bool(was_on and not self.local[note])
+
+    def note_on(self, note: int, velocity: int = 127, channel: int = 0) -> bool:
+        """Press a local key; returns True if the note started sounding"""
+        if not velocity:
+            return self.note_off(note, channel)
+        with self._lock:
+            was_on = self.local[note]
+            self.held[channel, note] = True
+            self.velocity[channel, note] = velocity
+            self._refresh_local(note)
+            return not was_on
+
+    def note_off(self, note: int, channel: int = 0) -> bool:
+        """Release a local key; returns True if the note stopped sounding"""
+        with self._lock:
+            self.held[channel, note] = False
+            if self.sustain[channel]:
+                return False  # Latched until the pedal comes up
+            return self._silence(channel, note)
+
+    def set_sustain(self, down: bool, channel: int = 0) -> List[int]:
+        """Press or lift the sustain pedal; returns the notes that stopped sounding"""
+        with self._lock:
+            self.sustain[channel] = down
+            if down:
+                return []
+            latched = np.flatnonzero((self.velocity[channel] > 0) & ~self.held[channel])
+            return [int(note) for note in latched if self._silence(channel, int(note))]
+
+    def handle_message(self, message) -> List[NoteChange]:
+        """Apply a mido message; returns the notes that started or stopped sounding"""
+        channel = getattr(message, 'channel', 0)
+        if message.type == 'note_on' and message.velocity > 0:
+            if self.note_on(message.note, message.velocity, channel):
+                return [(message.note, True, message.velocity)]
+        elif message.type in ('note_on', 'note_off'):
+            if self.note_off(message.note, channel):
+                return [(message.note, False, 0)]
+        elif message.type == 'control_change' and message.control == SUSTAIN_CC:
+            return [(note, False, 0) for note in self.set_sustain(message.value >= 64, channel)]
+        return []
+
+    def set_local(self, note: int, is_on: bool, velocity: int = 127, channel: int = 0):
+        """Press or release a local note"""
+        if is_on:
+            self.note_on(note, velocity, channel)
+        else:
+            self.note_off(note, channel)
+
+    def clear_local(self) -> List[int]:
+        """Release all local notes and pedals; returns the notes that were sounding"""
+        with self._lock:
+            released = sorted(self.local_notes)
+            self.velocity[:] = 0
+            self.held[:] = False
+            self.sustain[:] = False
+            self.local_velocity[:] = 0
+            self.local[:] = False
+            self.active[:] = self.remote
+            self.local_notes.clear()
+            return released
+
+    def snapshot(self) -> np.ndarray:
+        """Copy of the local (channel, note) velocity array"""
+        with self._lock:
+            return self.velocity.copy()
+
+    def set_source_notes(self, source_id: str, notes: Iterable[int]):
+        """Replace the notes held by a remote source, touching only the changes"""
+        notes = set(notes)
+        with self._lock:
+            self._update_source(source_id, notes)
+            self.remote_notes[source_id] = notes
+
+    def remove_source(self, source_id: str):
+        """Forget a remote source and release its notes"""
+        with self._lock:
+            self._update_source(source_id, set())
+            self.remote_notes.pop(source_id, None)
+
+    def _update_source(self, source_id: str, notes: Set[int]):
+        old_notes = self.remote_notes.get(source_id, set())
+        for note in notes - old_notes:
+            self.remote_counts[note] += 1
+            self.remote[note] = True
+            self._refresh(note)
+        for note in old_notes - notes:
+            self.remote_counts[note] -= 1
+            if not self.remote_counts[note]:
+                self.remote[note] = False
+                self._refresh(note)
+
+    def is_active(self, note: int) -> bool:
+        return bool(self.active[note])
+
+    def is_local(self, note: int) -> bool:
+        return bool(self.local[note])
+
+    def is_remote(self, note: int) -> bool:
+        return bool(self.remote[note])
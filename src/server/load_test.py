@@ -0,0 +1,222 @@
+"""Load test for the jam room server.
+
+Starts a room server in a subprocess (one asyncio loop, so one core),
+fills it with rooms of simulated players and measures delivery. Each player
+toggles a note `rate` times a second as an event payload. It also records
+how long every frame from the others took to arrive, using the sender
+timestamp, which is the same clock on one machine.
+
+    python -m src.server.load_test --rooms 20 --clients 6 --rate 10
+    python -m src.server.load_test --ramp      # double the rooms until a limit is hit
+
+A level passes if p99 latency stays under --max-p99, at least 95% of the
+expected frames arrive, and the server process stays under 90% of a core.
+The harness's own CPU use is printed too: if it nears 100%, the clients
+are the bottleneck, not the server.
+"""
+import argparse
+import asyncio
+import json
+import os
+import random
+import socket
+import subprocess
+import sys
+import time
+from typing import Callable, Dict, List, Optional
+
+from websockets.asyncio.client import connect
+from websockets.exceptions import ConnectionClosed, WebSocketException
+
+from . import room_server
+from ..communication import note_codec
+from ..metrics.latency import LatencyHistogram
+
+MIN_DELIVERY = 0.95
+
+# Seconds to wait for every player to join before measuring anyway
+JOIN_TIMEOUT = 10.0
+MAX_SERVER_CPU = 0.90
+
+class LoadStats:
+    def __init__(self):
+        self.recording = False  # Only count once every player has joined and warmed up
+        self.sent = 0
+        self.received = 0
+        self.latency = LatencyHistogram()
+        self.failed_joins = 0
+
+async def run_player(url: str, room: str, client_id: str, rate: float, stop: asyncio.Event,
+                     stats: LoadStats, joined: asyncio.Event):
+    try:
+        websocket = await connect(url, max_queue=None)
+        await websocket.send(json.dumps({"room": room, "client_id": client_id, "instrument": "load"}))
+    except (OSError, WebSocketException, asyncio.TimeoutError) as e:
+        print(f"{client_id} could not join: {e!r}")
+        stats.failed_joins += 1
+        return
+    finally:
+        joined.set()  # Never leave run_level waiting on a failed player
+
+    async with websocket:
+
+        async def receive():
+            async for frame in websocket:
+                if isinstance(frame, bytes) and stats.recording:
+                    _, packet = room_server.decode_frame(frame)
+                    stats.received += 1
+                    stats.latency.record(max(0, note_codec.now_us() - packet.timestamp) / 1e6)
+
+        receiver = asyncio.create_task(receive())
+        note = random.randrange(21, 109)
+        sequence = 0
+        is_on = False
+        await asyncio.sleep(random.random() / rate)  # Spread players across the period
+        next_send = time.perf_counter()
+        try:
+            while not stop.is_set():
+                is_on = not is_on
+                sequence += 1
+                await websocket.send(note_codec.encode_events([(note, is_on, 100)], sequence))
+                if stats.recording:
+                    stats.sent += 1
+                next_send += 1.0 / rate
+                await asyncio.sleep(max(0.0, next_send - time.perf_counter()))
+        except ConnectionClosed:
+            pass
+        receiver.cancel()
+
+async def run_level(url: str, rooms: int, clients: int, rate: float, duration: float,
+                    server_cpu: Optional[Callable[[], float]] = None) -> Dict[str, float]:
+    """Run rooms x clients players and measure for duration seconds"""
+    stop = asyncio.Event()
+    stats = LoadStats()
+    joined: List[asyncio.Event] = []
+    tasks = []
+    for r in range(rooms):
+        for c in range(clients):
+            event = asyncio.Event()
+            joined.append(event)
+            tasks.append(asyncio.create_task(
+                run_player(url, f"room{r}", f"player{r}_{c}", rate, stop, stats, event)))
+    try:
+        await asyncio.wait_for(asyncio.gather(*(event.wait() for event in joined)), JOIN_TIMEOUT)
+    except asyncio.TimeoutError:
+        print(f"{sum(not event.is_set() for event in joined)} players still joining after {JOIN_TIMEOUT:g} s")
+    await asyncio.sleep(1.0)  # Warm up
+
+    stats.recording = True
+    cpu_start = os.times()
+    server_start = server_cpu() if server_cpu else float("nan")
+    start = time.perf_counter()
+    await asyncio.sleep(duration)
+    elapsed = time.perf_counter() - start
+    cpu_end = os.times()
+    server_end = server_cpu() if server_cpu else float("nan")
+    stats.recording = False
+    stop.set()
+    await asyncio.gather(*tasks, return_exceptions=True)
+
+    expected = stats.sent * (clients - 1)
+    summary = stats.latency.summary()
+    return {
+        "rooms": rooms,
+        "clients": rooms * clients,
+        "failed_joins": stats.failed_joins,
+        "sent_per_s": stats.sent / elapsed,
+        "received_per_s": stats.received / elapsed,
+        "delivery": stats.received / expected if expected else 1.0,
+        "p50_ms": summary["p50_ms"],
+        "p99_ms": summary["p99_ms"],
+        "harness_cpu": ((cpu_end.user - cpu_start.user) + (cpu_end.system - cpu_start.system)) / elapsed,
+        "server_cpu": (server_end - server_start) / elapsed,
+    }
+
+def free_port() -> int:
+    with socket.socket() as s:
+        s.bind(("127.0.0.1", 0))
+        return s.getsockname()[1]
+
+def start_server(port: int) -> subprocess.Popen:
+    process = subprocess.Popen([sys.executable, "-m", "src.server.room_server",
+                                "--host", "127.0.0.1", "--port", str(port)],
+                               stdout=subprocess.DEVNULL)
+    deadline = time.monotonic() + 10.0
+    while time.monotonic() < deadline:
+        try:
+            socket.create_connection(("127.0.0.1", port), timeout=0.2).close()
+            return process
+        except OSError:
+            time.sleep(0.1)
+    process.kill()
+    raise RuntimeError("Room server did not start")
+
+def server_cpu_seconds(process: subprocess.Popen) -> float:
+    """User + system CPU the server has used so far (Linux /proc)"""
+    try:
+        with open(f"/proc/{process.pid}/stat") as f:
+            fields = f.read().rsplit(")", 1)[1].split()
+        return (int(fields[11]) + int(fields[12])) / os.sysconf("SC_CLK_TCK")
+    except (OSError, ValueError, IndexError):
+        return float("nan")
+
+def run(args, rooms: int) -> Dict[str, float]:
+    """One level against a fresh server (or --url)"""
+    process = None
+    url = args.url
+    if not url:
+        port = free_port()
+        process = start_server(port)
+        url = f"ws://127.0.0.1:{port}"
+    try:
+        server_cpu = (lambda: server_cpu_seconds(process)) if process else None
+        return asyncio.run(run_level(url, rooms, args.clients, args.rate, args.duration, server_cpu))
+    finally:
+        if process:
+            process.terminate()
+            process.wait()
+
+def passed(result: Dict[str, float], max_p99_ms: float) -> bool:
+    return (not result["failed_joins"]
+            and result["p99_ms"] <= max_p99_ms and result["delivery"] >= MIN_DELIVERY
+            and not result["server_cpu"] > MAX_SERVER_CPU)
+
+def print_result(result: Dict[str, float], ok: bool):
+    print(f"{result['rooms']:>5} rooms {result['clients']:>6} clients | "
+          f"in {result['sent_per_s']:>7.0f}/s out {result['received_per_s']:>8.0f}/s "
+          f"delivered {result['delivery']:>6.1%} | p50 {result['p50_ms']:6.1f} ms p99 {result['p99_ms']:6.1f} ms | "
+          f"server cpu {result['server_cpu']:>4.0%} harness cpu {result['harness_cpu']:>4.0%} | "
+          f"failed joins {result['failed_joins']} | "
+          f"{'ok' if ok else 'FAIL'}")
+
+def main():
+    parser = argparse.ArgumentParser(description="Load test the jam room server")
+    parser.add_argument("--url", help="Test a running server instead of starting one")
+    parser.add_argument("--rooms", type=int, default=10)
+    parser.add_argument("--clients", type=int, default=6, help="Players per room")
+    parser.add_argument("--rate", type=float, default=10.0, help="Note changes per player per second")
+    parser.add_argument("--duration", type=float, default=10.0, help="Seconds measured per level")
+    parser.add_argument("--max-p99", type=float, default=50.0, help="p99 latency limit in ms")
+    parser.add_argument("--ramp", action="store_true", help="Double --rooms until a level fails")
+    args = parser.parse_args()
+
+    rooms = args.rooms
+    best = None
+    while True:
+        result = run(args, rooms)
+        ok = passed(result, args.max_p99)
+        print_result(result, ok)
+        if not args.ramp:
+            return
+        if not ok:
+            break
+        best = result
+        rooms *= 2
+    if best:
+        print(f"Sustained {best['rooms']} rooms x {args.clients} clients ({best['clients']} total) "
+              f"at {args.rate:g} note changes/s each")
+    else:
+        print("The first level already failed; try fewer --rooms")
+
+if __name__ == "__main__":
+    main()
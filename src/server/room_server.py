@@ -0,0 +1,261 @@
+"""WebSocket jam rooms: every participant sees every other participant's notes.
+
+A client opens a WebSocket and sends one text message to join:
+
+    {"room": "ABCD", "client_id": "guitar_1a2b", "instrument": "guitar", "merged": false}
+
+After that it sends its notes as binary note_codec payloads (snapshots or
+events, as over MQTT). The server keeps each participant's velocities and
+sends the other participants binary frames:
+
+    id_length uint8, source id (utf-8), note_codec velocity payload
+
+carrying the source's full state with its own sequence number and
+timestamp. A client that joined with "merged": true instead receives one
+frame with source id "*": the loudest velocity of each note across the
+room. Leaves arrive as text: {"type": "left", "client_id": ...}.
+
+Each client has a mailbox holding only the latest frame per source. A slow
+consumer therefore never builds a backlog: while it is still sending, newer
+frames replace the ones it has not taken yet (counted as dropped), which is
+safe because every frame is a full state.
+"""
+import argparse
+import asyncio
+import json
+import time
+from dataclasses import dataclass
+from typing import Dict, Optional, Union
+
+import numpy as np
+from websockets.asyncio.server import ServerConnection, serve
+from websockets.exceptions import ConnectionClosed
+
+from ..communication import note_codec
+
+DEFAULT_PORT = 8765
+
+# Seconds a new connection has to send its join message
+JOIN_TIMEOUT = 5.0
+
+MERGED_SOURCE = "*"
+
+# Source ids are length-prefixed with one byte in frames
+MAX_CLIENT_ID_BYTES = 255
+
+Frame = Union[bytes, str]
+
+@dataclass
+class ServerCounters:
+    """Totals since the server started, including clients that have left"""
+    received: int = 0
+    sent: int = 0
+    dropped: int = 0
+
+def encode_frame(source_id: str, payload: bytes) -> bytes:
+    source = source_id.encode()
+    if len(source) > MAX_CLIENT_ID_BYTES:
+        raise ValueError(f"Source id longer than {MAX_CLIENT_ID_BYTES} bytes")
+    return bytes([len(source)]) + source + payload
+
+def decode_frame(frame: bytes):
+    """(source_id, NotePacket) from a server frame"""
+    length = frame[0]
+    return frame[1:1 + length].decode(), note_codec.decode(frame[1 + length:])
+
+class ClientSession:
+    """One connected participant and its outgoing mailbox"""
+
+    def __init__(self, websocket: ServerConnection, client_id: str, instrument: str, merged: bool = False,
+                 counters: Optional[ServerCounters] = None):
+        self.websocket = websocket
+        self.counters = counters or ServerCounters()
+        self.client_id = client_id
+        self.instrument = instrument
+        self.merged = merged
+        self.velocities = np.zeros(note_codec.NUM_NOTES, dtype=np.uint8)
+        self.sequence = 0  # Of the last payload applied
+        self.pending: Dict[str, Frame] = {}  # Latest unsent frame per source
+        self.ready = asyncio.Event()
+        self.sent = 0
+        self.dropped = 0  # Frames replaced before they could be sent
+
+    def offer(self, source_id: str, frame: Frame):
+        if source_id in self.pending:
+            self.dropped += 1
+            self.counters.dropped += 1
+        self.pending[source_id] = frame
+        self.ready.set()
+
+    async def send_loop(self):
+        """Send whatever is in the mailbox; send() waits while the socket is backed up"""
+        try:
+            while True:
+                await self.ready.wait()
+                self.ready.clear()
+                frames, self.pending = self.pending, {}
+                for frame in frames.values():
+                    await self.websocket.send(frame)
+                    self.sent += 1
+                    self.counters.sent += 1
+        except ConnectionClosed:
+            pass  # The receive side cleans up
+
+class Room:
+    def __init__(self, code: str):
+        self.code = code
+        self.sessions: Dict[str, ClientSession] = {}
+        self.sequence = 0  # Merged frame counter
+
+    def join(self, session: ClientSession):
+        """Add a participant and give it everyone's current notes"""
+        old = self.sessions.get(session.client_id)
+        if old:
+            self.leave(old)  # Same client reconnecting
+        self.sessions[session.client_id] = session
+        if session.merged:
+            session.offer(MERGED_SOURCE, self._merged_frame())
+            return
+        for other in self.sessions.values():
+            if other is not session and other.velocities.any():
+                session.offer(other.client_id, encode_frame(
+                    other.client_id, note_codec.encode_velocities(other.velocities, other.sequence)))
+
+    def leave(self, session: ClientSession):
+        if self.sessions.get(session.client_id) is not session:
+            return
+        del self.sessions[session.client_id]
+        left = json.dumps({"type": "left", "client_id": session.client_id})
+        for other in self.sessions.values():
+            if not other.merged:
+                other.offer(session.client_id, left)
+        if session.velocities.any():
+            session.velocities[:] = 0
+            self._fan_out_merged()
+
+    def apply(self, session: ClientSession, payload: bytes):
+        """Update a participant's notes from a payload and fan the result out"""
+        packet = note_codec.decode(payload)
+        if packet.is_snapshot:
+            if packet.velocities is not None:
+                session.velocities[:] = packet.velocities
+            else:
+                session.velocities[:] = 0
+                session.velocities[list(packet.notes)] = 127
+        else:
+            for note, is_on, velocity in packet.events:
+                session.velocities[note] = velocity if is_on else 0
+        session.sequence = packet.sequence
+        # Encoded once, shared by every recipient
+        frame = encode_frame(session.client_id, note_codec.encode_velocities(
+            session.velocities, packet.sequence, packet.timestamp))
+        for other in self.sessions.values():
+            if other is not session and not other.merged:
+                other.offer(session.client_id, frame)
+        self._fan_out_merged(packet.timestamp)
+
+    def merged_velocities(self) -> np.ndarray:
+        """Loudest velocity of each note across the room"""
+        merged = np.zeros(note_codec.NUM_NOTES, dtype=np.uint8)
+        for session in self.sessions.values():
+            np.maximum(merged, session.velocities, out=merged)
+        return merged
+
+    def _merged_frame(self, timestamp: Optional[int] = None) -> bytes:
+        self.sequence = (self.sequence + 1) % note_codec.SEQUENCE_MOD
+        return encode_frame(MERGED_SOURCE, note_codec.encode_velocities(
+            self.merged_velocities(), self.sequence, timestamp))
+
+    def _fan_out_merged(self, timestamp: Optional[int] = None):
+        listeners = [s for s in self.sessions.values() if s.merged]
+        if listeners:
+            frame = self._merged_frame(timestamp)
+            for session in listeners:
+                session.offer(MERGED_SOURCE, frame)
+
+class RoomServer:
+    def __init__(self):
+        self.rooms: Dict[str, Room] = {}
+        self.counters = ServerCounters()
+
+    async def handle(self, websocket: ServerConnection):
+        try:
+            hello = json.loads(await asyncio.wait_for(websocket.recv(), JOIN_TIMEOUT))
+            code = str(hello["room"])
+            client_id = str(hello["client_id"])
+        except (asyncio.TimeoutError, ConnectionClosed, ValueError, KeyError, TypeError) as e:
+            print(f"Rejected connection: {e!r}")
+            await websocket.close(1008, "Expected a join message")
+            return
+        if not client_id or len(client_id.encode()) > MAX_CLIENT_ID_BYTES:
+            print(f"Rejected connection: client_id must be 1-{MAX_CLIENT_ID_BYTES} UTF-8 bytes")
+            await websocket.close(1008, f"client_id must be 1-{MAX_CLIENT_ID_BYTES} UTF-8 bytes")
+            return
+        session = ClientSession(websocket, client_id, str(hello.get("instrument", "")),
+                                bool(hello.get("merged")), self.counters)
+
+        room = self.rooms.get(code)
+        if room is None:
+            room = self.rooms[code] = Room(code)
+        room.join(session)
+        sender = asyncio.create_task(session.send_loop())
+        try:
+            async for message in websocket:
+                if isinstance(message, str):
+                    continue  # No client text messages after the join yet
+                self.counters.received += 1
+                try:
+                    room.apply(session, message)
+                except ValueError as e:
+                    print(f"Bad note payload from {session.client_id}: {e}")
+        except ConnectionClosed:
+            pass
+        finally:
+            sender.cancel()
+            room.leave(session)
+            if not room.sessions and self.rooms.get(code) is room:
+                del self.rooms[code]
+
+    def stats(self) -> Dict[str, int]:
+        return {
+            "rooms": len(self.rooms),
+            "clients": sum(len(room.sessions) for room in self.rooms.values()),
+            "received": self.counters.received,
+            "sent": self.counters.sent,
+            "dropped": self.counters.dropped,
+        }
+
+    async def print_stats(self, interval: float):
+        last, last_time = self.stats(), time.monotonic()
+        while True:
+            await asyncio.sleep(interval)
+            stats, now = self.stats(), time.monotonic()
+            elapsed = now - last_time
+            print(f"rooms {stats['rooms']} clients {stats['clients']} | "
+                  f"in {(stats['received'] - last['received']) / elapsed:.0f}/s "
+                  f"out {(stats['sent'] - last['sent']) / elapsed:.0f}/s "
+                  f"dropped {stats['dropped'] - last['dropped']}")
+            last, last_time = stats, now
+
+    async def serve(self, host: str = "0.0.0.0", port: int = DEFAULT_PORT, stats_interval: float = 0.0):
+        async with serve(self.handle, host, port):
+            print(f"Room server listening on ws://{host}:{port}")
+            if stats_interval > 0:
+                await self.print_stats(stats_interval)
+            else:
+                await asyncio.Future()
+
+def main():
+    parser = argparse.ArgumentParser(description="WebSocket jam room server")
+    parser.add_argument("--host", default="0.0.0.0")
+    parser.add_argument("--port", type=int, default=DEFAULT_PORT)
+    parser.add_argument("--stats", type=float, default=0.0, metavar="SECONDS",
+                        help="Print throughput every SECONDS")
+    args = parser.parse_args()
+    try:
+        asyncio.run(RoomServer().serve(args.host, args.port, args.stats))
+    except KeyboardInterrupt:
+        pass
+
+if __name__ == "__main__":
+    main()
@@ -1,6 +1,17 @@
 import pygame
+import time
+import numpy as np
 from typing import Set, Dict, Tuple, Optional
 from abc import ABC, abstractmethod
+from ..midi.note_state import NoteState
+from ..metrics.latency import LatencyTracer
+from ..metrics.link_quality import print_link_stats
+
+# Remote sources silent this long are dropped (senders publish a snapshot every 2 s)
+REMOTE_SOURCE_TTL = 6.0
+
+# Posted by the MIDI device watcher thread: event.device, event.connected
+MIDI_DEVICE_EVENT = pygame.USEREVENT + 1
 
 class BaseVisualizer(ABC):
     def __init__(self, width: int, height: int, fps: int = 30):
@@ -13,14 +24,23 @@ class BaseVisualizer(ABC):
         self.font = pygame.font.Font(None, 20)
         self.running = True
         
-        # Note storage
-        self.local_notes: Set[int] = set()  # Notes from local MIDI
-        self.remote_notes: Dict[str, Set[int]] = {}  # Notes from MQTT {source_id: notes}
+        # Note storage - the sets are owned by note_state, update them through it
+        self.note_state = NoteState()
+        self.local_notes: Set[int] = self.note_state.local_notes  # Notes from local MIDI
+        self.remote_notes: Dict[str, Set[int]] = self.note_state.remote_notes  # Notes from MQTT {source_id: notes}
+        self.remote_last_seen: Dict[str, float] = {}  # {source_id: time.monotonic() of last update}
+        self._next_expiry_check = 0.0
         
         # Common settings
         self.color_mapping: str = "chromatic"  # or "harmonic"
         self.test_mode: bool = False
         self.last_message: str = "No messages"
+
+        # Note latency from MIDI input to LED packet, printed with 'l' (see print_metrics)
+        self.latency = LatencyTracer()
+
+        # Set by subclasses; remote notes it queues are applied once per frame in run()
+        self.mqtt = None
         
     @abstractmethod
     def draw(self):
@@ -34,14 +54,56 @@ class BaseVisualizer(ABC):
     
     def handle_remote_notes(self, source_id: str, notes: Set[int]):
         """Handle incoming remote notes"""
-        self.remote_notes[source_id] = notes
+        self.note_state.set_source_notes(source_id, notes)
+        self.remote_last_seen[source_id] = time.monotonic()
+
+    def remove_remote_source(self, source_id: str):
+        """Forget a remote source that went offline or timed out, releasing its notes"""
+        self.note_state.remove_source(source_id)
+        self.remote_last_seen.pop(source_id, None)
+        if self.mqtt:
+            self.mqtt.forget_source(source_id)
+
+    def expire_remote_sources(self, ttl: float = REMOTE_SOURCE_TTL):
+        """Drop remote sources that have not sent anything for ttl seconds"""
+        now = time.monotonic()
+        for source_id, last_seen in list(self.remote_last_seen.items()):
+            if now - last_seen > ttl:
+                print(f"Remote source {source_id} timed out")
+                self.remove_remote_source(source_id)
         
-    def handle_local_note(self, note: int, is_on: bool):
+    def handle_local_note(self, note: int, is_on: bool, velocity: int = 127):
         """Handle local MIDI note events"""
-        if is_on:
-            self.local_notes.add(note)
-        else:
-            self.local_notes.discard(note)
+        self.note_state.set_local(note, is_on, velocity)
+        self.latency.note_applied()
+
+    def clear_local_notes(self):
+        """Release all local notes"""
+        self.note_state.clear_local()
+            
+    def post_midi_device_event(self, device: str, connected: bool):
+        """Hand a MIDI hotplug change from the watcher thread to the render loop"""
+        pygame.event.post(pygame.event.Event(MIDI_DEVICE_EVENT, device=device, connected=connected))
+
+    def handle_midi_device_event(self, event):
+        """Show a MIDI device connecting or disconnecting"""
+        state = "Connected to" if event.connected else "Disconnected"
+        print(f"MIDI {state.lower()}: {event.device}")
+        self.last_midi_message = f"{state}: {event.device}"
+
+    def print_metrics(self):
+        """Print note latency and per-source MQTT link quality"""
+        self.latency.print_report()
+        if self.mqtt:
+            print_link_stats(self.mqtt.link_stats)
+
+    def active_note_mask(self, include_remote: bool = True) -> np.ndarray:
+        """Boolean array of the 128 MIDI notes that are currently sounding"""
+        return self.note_state.active if include_remote else self.note_state.local
+
+    def note_velocities(self) -> np.ndarray:
+        """Velocity (0-127) of each sounding local note, loudest channel wins"""
+        return self.note_state.local_velocity
             
     def draw_info(self, info_text: str):
         """Draw information overlay"""
@@ -55,7 +117,13 @@ class BaseVisualizer(ABC):
         try:
             while self.running:
                 self.running = self.handle_events()
+                if self.mqtt:
+                    self.mqtt.process_messages()
+                if time.monotonic() >= self._next_expiry_check:
+                    self.expire_remote_sources()
+                    self._next_expiry_check = time.monotonic() + 1.0
                 self.screen.fill((0, 0, 0))
+                self.latency.draw_started()
                 self.draw()
                 pygame.display.flip()
                 self.clock.tick(self.fps)
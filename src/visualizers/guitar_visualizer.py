@@ -1,17 +1,20 @@
 import pygame
-import socket
-import time
-import mido
 from typing import Set
-import threading
-from .base_visualizer import BaseVisualizer
-from src.communication.mqtt_client import MusicMQTTClient
+from .base_visualizer import BaseVisualizer, MIDI_DEVICE_EVENT
+from .led_frame import LEDFrameEngine
+from src.communication.mqtt_client import MusicMQTTClient, ANY_INSTRUMENT
+from src.config.settings import MQTT_ROOM
+from src.midi.midi_merger import MIDIInputMerger
+from src.communication.wled_client import WLEDManager
+from src.config.device_config import WLEDDevice
 import uuid
 
 # Constants
 SCREEN_WIDTH = 1200
 SCREEN_HEIGHT = 400
 FPS = 30
+LED_FPS = 60  # LED output rate, independent of the display clock
+MQTT_COALESCE_WINDOW = 0.003  # Strummed chords go out as one MQTT message
 
 # WLED settings
 WLED_IP = "192.168.8.144"
@@ -59,27 +62,32 @@ class GuitarVisualizer(BaseVisualizer):
         # MQTT setup
         print("\nSetting up MQTT...")
         try:
-            self.mqtt = MusicMQTTClient(self.client_id, self.instrument_type)
+            self.mqtt = MusicMQTTClient(self.client_id, self.instrument_type, mode="events",
+                                        coalesce_window=MQTT_COALESCE_WINDOW, deferred=True,
+                                        clock_sync=True, jitter_buffer=True, room=MQTT_ROOM)
             if self.mqtt.connect():
                 self.mqtt_status = f"MQTT: Connected ({self.client_id})"
-                for instrument in ['piano', 'drums', 'bass', 'guitar']:
-                    self.mqtt.register_callback(instrument, self._handle_remote_notes)
+                # One wildcard subscription receives every instrument
+                self.mqtt.register_callback(ANY_INSTRUMENT, self._handle_remote_notes)
         except Exception as e:
             self.mqtt_status = f"MQTT: Error - {str(e)}"
 
-        # Initialize note storage
-        self.local_notes = set()
-        self.remote_notes = {}
-        
         # Create fretboard matrix
         self.matrix = self.create_fretboard_matrix()
+        self.led_engine = LEDFrameEngine(
+            [note for string_notes in self.matrix for note in string_notes],
+            CHROMATIC_COLORS, active_scale=1.5, inactive_scale=0.1
+        )
 
-        # MIDI setup
-        self.midi_input = None
+        # MIDI setup: every connected device is merged into one note stream
+        self.midi = MIDIInputMerger(self.handle_midi_note, tracer=self.latency)
         self.setup_midi()
 
         # WLED setup
-        self.udp_socket = socket.socket(socket.AF_INET, socket.SOCK_DGRAM)
+        self.wled_device = WLEDDevice(name="Guitar Fretboard", ip=WLED_IP, port=WLED_PORT,
+                                      num_leds=STRINGS * FRETS, instrument=self.instrument_type)
+        self.wled = WLEDManager([self.wled_device], tracer=self.latency)
+        self.wled.start_output(LED_FPS)
 
     def create_fretboard_matrix(self):
         """Create matrix of notes for each fret position"""
@@ -117,8 +125,8 @@ class GuitarVisualizer(BaseVisualizer):
                 note_class = note % 12
                 base_color = CHROMATIC_COLORS[note_class]
                 
-                is_local = note in self.local_notes
-                is_remote = any(note in notes for notes in self.remote_notes.values())
+                is_local = self.note_state.is_local(note)
+                is_remote = self.note_state.is_remote(note)
                 
                 if is_local:
                     # Local note: White
@@ -132,22 +140,11 @@ class GuitarVisualizer(BaseVisualizer):
 
                 pygame.draw.circle(self.screen, color, (x, y), 10)
 
-    def create_wled_data(self) -> bytes:
+    def create_wled_data(self) -> bytearray:
         """Create WLED data packet"""
-        data = []
-        for string in range(STRINGS):
-            for fret in range(FRETS):
-                note = self.matrix[string][fret]
-                note_class = note % 12
-                color = CHROMATIC_COLORS[note_class]
-                
-                if note in self.local_notes or any(note in notes for notes in self.remote_notes.values()):
-                    color = tuple(min(int(c * 1.5), 255) for c in color)
-                else:
-                    color = tuple(int(c * 0.1) for c in color)
-                
-                data.extend(color)
-        return bytes(data)
+        frame = self.led_engine.render_velocity(self.active_note_mask(), self.note_velocities())
+        self.latency.frame_built()
+        return frame
 
     def draw(self):
         """Implementation of abstract method from BaseVisualizer"""
@@ -176,9 +173,13 @@ class GuitarVisualizer(BaseVisualizer):
         for event in pygame.event.get():
             if event.type == pygame.QUIT:
                 return False
+            elif event.type == MIDI_DEVICE_EVENT:
+                self.handle_midi_device_event(event)
             elif event.type == pygame.KEYDOWN:
                 if event.key == pygame.K_q:
                     return False
+                elif event.key == pygame.K_l:
+                    self.print_metrics()
                 elif event.key == pygame.K_m:
                     print("Rescanning MIDI devices...")
                     self.setup_midi()
@@ -187,83 +188,43 @@ class GuitarVisualizer(BaseVisualizer):
                     mode = "LOCAL" if self.local_input_enabled else "REMOTE"
                     print(f"\nSwitched to {mode} input mode")
                     if not self.local_input_enabled:
-                        self.local_notes.clear()
+                        self.clear_local_notes()
                         self.mqtt.publish_notes(self.local_notes)
         return True
 
     def setup_midi(self):
-        """Set up MIDI input with device switching"""
-        try:
-            # Get fresh list of devices
-            self.midi_devices = mido.get_input_names()
-            print(f"\nAvailable MIDI devices: {self.midi_devices}")
-            
-            if self.midi_devices:
-                # Close existing connection if any
-                if self.midi_input:
-                    try:
-                        self.midi_input.close()
-                        self.midi_input = None
-                        time.sleep(0.1)  # Give it time to close
-                    except:
-                        print("Error closing previous MIDI device")
+        """Watch for MIDI inputs; every port feeds one merged note stream.
 
-                # Update device index
-                self.current_midi_device_index = (self.current_midi_device_index + 1) % len(self.midi_devices)
-                device_name = self.midi_devices[self.current_midi_device_index]
-                
-                print(f"Attempting to connect to: {device_name} (Device {self.current_midi_device_index + 1} of {len(self.midi_devices)})")
-                
-                self.midi_input = mido.open_input(device_name)
-                self.last_midi_message = f"Connected to: {device_name}"
-                print(f"Successfully connected to MIDI device: {device_name}")
-                
-                # Start MIDI listener thread
-                midi_thread = threading.Thread(target=self.midi_listener, daemon=True)
-                midi_thread.start()
-            else:
-                print("No MIDI devices found")
-                self.last_midi_message = "No devices found"
-                self.current_midi_device_index = -1
-        except Exception as e:
-            print(f"MIDI setup error: {e}")
-            self.last_midi_message = f"Error: {str(e)}"
-            self.current_midi_device_index = -1
+        Ports are scanned and opened on the watcher thread, which posts
+        MIDI_DEVICE_EVENT as devices come and go.
+        """
+        if self.midi.watcher:
+            self.midi.rescan()
+        else:
+            self.midi.watch(on_change=self.post_midi_device_event)
 
-    def midi_listener(self):
-        """Listen for MIDI messages"""
-        print("Starting MIDI listener...")
-        try:
-            while self.midi_input:
-                for message in self.midi_input.iter_pending():
-                    # Only process MIDI input if local input is enabled
-                    if self.local_input_enabled:
-                        if message.type == 'note_on' and message.velocity > 0:
-                            self.handle_local_note(message.note, True)
-                            print(f"LOCAL MIDI Note ON: {message.note}")
-                        elif message.type == 'note_off' or (message.type == 'note_on' and message.velocity == 0):
-                            self.handle_local_note(message.note, False)
-                            print(f"LOCAL MIDI Note OFF: {message.note}")
-                time.sleep(0.001)
-        except Exception as e:
-            print(f"MIDI listener error: {e}")
-        finally:
-            print("MIDI listener ended")
+    def handle_midi_note(self, note: int, is_on: bool, velocity: int = 127):
+        """Handle a note from the merged MIDI input"""
+        # Only process MIDI input if local input is enabled
+        if self.local_input_enabled:
+            self.handle_local_note(note, is_on, velocity)
+            print(f"LOCAL MIDI Note {'ON' if is_on else 'OFF'}: {note}")
 
-    def handle_local_note(self, note: int, is_on: bool):
+    def handle_local_note(self, note: int, is_on: bool, velocity: int = 127):
         """Handle local MIDI note and publish to MQTT"""
-        if is_on:
-            self.local_notes.add(note)
-        else:
-            self.local_notes.discard(note)
+        super().handle_local_note(note, is_on, velocity)
         
         # Publish updated notes via MQTT
-        self.mqtt.publish_notes(self.local_notes)
+        self.mqtt.publish_notes(self.local_notes, self.note_velocities())
 
     def _handle_remote_notes(self, data: dict):
         """Handle remote notes from other instruments"""
         source_id = data["client_id"]
         instrument = data["instrument"]
+        if data.get("offline"):
+            print(f"REMOTE MQTT {instrument} ({source_id}) went offline")
+            self.remove_remote_source(source_id)
+            return
         notes = set(data["notes"])
         old_notes = self.remote_notes.get(source_id, set())
         
@@ -276,15 +237,13 @@ class GuitarVisualizer(BaseVisualizer):
         if removed_notes:
             print(f"REMOTE MQTT Note OFF from {instrument} ({source_id}): {removed_notes}")
             
-        self.remote_notes[source_id] = notes
+        self.handle_remote_notes(source_id, notes)
         self.mqtt_status = f"MQTT: Last msg from {instrument} ({source_id})"
 
     def send_wled_data(self, data: bytes):
         """Send data to WLED"""
         try:
-            packet = bytearray([2, 255])  # WARLS protocol
-            packet.extend(data)
-            self.udp_socket.sendto(packet, (WLED_IP, WLED_PORT))
+            self.wled.submit_frame(self.wled_device.name, data)
         except Exception as e:
             print(f"WLED communication error: {e}")
 
@@ -0,0 +1,81 @@
+import numpy as np
+from typing import List, Sequence, Tuple
+
+# Marks an LED that is not mapped to any note (always dark)
+NO_NOTE = -1
+
+def piano_roll_notes(num_leds: int, start_note: int, total_notes: int,
+                     led_offset: int = 0, note_offset: int = 0) -> List[int]:
+    """One LED per note after led_offset dark LEDs, shifted by note_offset and
+    wrapping within total_notes from start_note (the piano roll strip layout)"""
+    led_notes = [NO_NOTE] * led_offset
+    for i in range(num_leds - led_offset):
+        led_notes.append(start_note + ((i + note_offset) % total_notes))
+    return led_notes
+
+class LEDFrameEngine:
+    """Builds WLED frames from a precomputed LED -> note mapping.
+
+    Every LED is mapped once to an index into an "active" array (a MIDI note,
+    a pitch class, a segment...). Colors come from a palette indexed by
+    ``key % len(palette)``. A frame is then one fancy-index of the active
+    array plus one ``np.where`` written into a reusable ``bytearray``.
+    """
+
+    def __init__(self, led_notes: Sequence[int],
+                 palette: Sequence[Tuple[int, int, int]],
+                 active_scale: float = 1.0,
+                 inactive_scale: float = 0.1):
+        self.num_leds = len(led_notes)
+        self.led_notes = np.asarray(led_notes, dtype=np.intp)
+        self._dark = self.led_notes == NO_NOTE
+        self.active_scale = active_scale
+        self.inactive_scale = inactive_scale
+
+        # Reusable output buffer and an (num_leds, 3) view onto it
+        self.buffer = bytearray(self.num_leds * 3)
+        self._frame = np.frombuffer(self.buffer, dtype=np.uint8).reshape(self.num_leds, 3)
+
+        self.set_palette(palette)
+
+    def set_palette(self, palette: Sequence[Tuple[int, int, int]]):
+        """Precompute active/inactive palettes and per-LED colors"""
+        base = np.asarray(palette, dtype=np.float64)
+        self.active_palette = self._scale(base, self.active_scale)
+        self.inactive_palette = self._scale(base, self.inactive_scale)
+
+        palette_index = self.led_notes % len(base)
+        self._active_colors = self.active_palette[palette_index]
+        self._inactive_colors = self.inactive_palette[palette_index]
+        self._active_colors[self._dark] = 0
+        self._inactive_colors[self._dark] = 0
+
+    @staticmethod
+    def _scale(colors: np.ndarray, scale: float) -> np.ndarray:
+        # Matches int(min(c * scale, 255)) used by the list-based renderers
+        return np.minimum(colors * scale, 255).astype(np.uint8)
+
+    def render(self, active: np.ndarray) -> bytearray:
+        """Render a frame; ``active`` is a boolean array indexed by LED key"""
+        lit = active[self.led_notes]
+        self._frame[...] = np.where(lit[:, None], self._active_colors, self._inactive_colors)
+        return self.buffer
+
+    def render_levels(self, levels: np.ndarray) -> bytearray:
+        """Render a frame scaling each LED's color by ``levels[key]`` (0.0-1.0)"""
+        scale = levels[self.led_notes][:, None]
+        self._frame[...] = np.minimum(self._active_colors * scale, 255).astype(np.uint8)
+        return self.buffer
+
+    def render_velocity(self, active: np.ndarray, velocity: np.ndarray) -> bytearray:
+        """Render a frame with lit LEDs scaled by ``velocity[key]`` (1-127).
+
+        Active keys with velocity 0 (e.g. remote notes) are drawn at full
+        brightness; a lit LED is never dimmer than an unlit one.
+        """
+        lit = active[self.led_notes]
+        key_velocity = velocity[self.led_notes]
+        scale = np.where(key_velocity > 0, key_velocity / 127.0, 1.0)[:, None]
+        colors = np.maximum(self._active_colors * scale, self._inactive_colors).astype(np.uint8)
+        self._frame[...] = np.where(lit[:, None], colors, self._inactive_colors)
+        return self.buffer
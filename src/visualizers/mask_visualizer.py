@@ -1,18 +1,21 @@
 import pygame
-import socket
-import time
-import mido
 from typing import Set
-import threading
-from .base_visualizer import BaseVisualizer
-from src.communication.mqtt_client import MusicMQTTClient
+from .base_visualizer import BaseVisualizer, MIDI_DEVICE_EVENT
+from .led_frame import LEDFrameEngine
+from src.communication.mqtt_client import MusicMQTTClient, ANY_INSTRUMENT
+from src.config.settings import MQTT_ROOM
+from src.midi.midi_merger import MIDIInputMerger
+from src.communication.wled_client import WLEDManager
+from src.config.device_config import WLEDDevice
 import uuid
 import math
+import numpy as np
 
 # Constants
 SCREEN_WIDTH = 800
 SCREEN_HEIGHT = 600
 FPS = 30
+LED_FPS = 60  # LED output rate, independent of the display clock
 
 # WLED settings
 WLED_IP = "192.168.8.148"  # Update with your WLED IP
@@ -44,10 +47,8 @@ class MaskVisualizer(BaseVisualizer):
         self.mqtt_status = "MQTT: Not connected"
         self.last_midi_message = "No MIDI connected"
 
-        # MIDI device management
-        self.midi_devices = mido.get_input_names()
-        self.current_midi_device_index = -1
-        self.midi_input = None
+        # MIDI input: every connected device is merged into one note stream
+        self.midi = MIDIInputMerger(self.handle_midi_note, tracer=self.latency)
 
         # Generate unique client ID and set instrument type
         self.client_id = f"mask_{uuid.uuid4().hex[:8]}"
@@ -56,7 +57,8 @@ class MaskVisualizer(BaseVisualizer):
         # MQTT setup
         print("\nSetting up MQTT...")
         try:
-            self.mqtt = MusicMQTTClient(self.client_id, self.instrument_type)
+            self.mqtt = MusicMQTTClient(self.client_id, self.instrument_type, deferred=True,
+                                        clock_sync=True, jitter_buffer=True, room=MQTT_ROOM)
             print(f"Created MQTT client with ID: {self.client_id}")
         except Exception as e:
             print(f"MQTT setup error: {e}")
@@ -68,60 +70,48 @@ class MaskVisualizer(BaseVisualizer):
 
         # WLED setup
         print(f"Setting up WLED connection to {WLED_IP}:{WLED_PORT}")
-        self.udp_socket = socket.socket(socket.AF_INET, socket.SOCK_DGRAM)
+        self.wled_device = WLEDDevice(name="Mask", ip=WLED_IP, port=WLED_PORT,
+                                      num_leds=TOTAL_LEDS, instrument=self.instrument_type)
+        self.wled = WLEDManager([self.wled_device], tracer=self.latency)
+        self.wled.start_output(LED_FPS)
+        self.led_engine = LEDFrameEngine(
+            [segment for segment in range(NUM_SEGMENTS) for _ in range(LEDS_PER_SEGMENT)],
+            SEGMENT_COLORS, active_scale=1.0
+        )
         print("Initialization complete.")
 
         if self.mqtt.connect():
             self.mqtt_status = f"MQTT: Connected ({self.client_id})"
             print("Successfully connected to MQTT broker")
-            # Subscribe to other instruments
-            for instrument in ['guitar', 'drums', 'bass', 'piano']:
-                print(f"Subscribing to {instrument} messages...")
-                self.mqtt.register_callback(instrument, self.handle_remote_notes)
+            # One wildcard subscription receives every instrument
+            self.mqtt.register_callback(ANY_INSTRUMENT, self._handle_remote_notes)
         else:
             self.mqtt_status = "MQTT: Connection failed"
             print("Failed to connect to MQTT broker")
 
     def setup_midi(self):
-        """Set up MIDI input with device switching"""
-        try:
-            self.midi_devices = mido.get_input_names()
-            print(f"\nAvailable MIDI devices: {self.midi_devices}")
-            
-            if self.midi_devices:
-                if self.midi_input:
-                    self.midi_input.close()
-                    self.midi_input = None
-                    time.sleep(0.1)
-
-                self.current_midi_device_index = (self.current_midi_device_index + 1) % len(self.midi_devices)
-                device_name = self.midi_devices[self.current_midi_device_index]
-                
-                self.midi_input = mido.open_input(device_name)
-                self.last_midi_message = f"Connected to: {device_name}"
-                
-                midi_thread = threading.Thread(target=self.midi_listener, daemon=True)
-                midi_thread.start()
-            else:
-                self.last_midi_message = "No devices found"
-                self.current_midi_device_index = -1
-        except Exception as e:
-            print(f"MIDI setup error: {e}")
-            self.last_midi_message = f"Error: {str(e)}"
+        """Watch for MIDI inputs; every port feeds one merged note stream.
 
-    def midi_listener(self):
-        """Listen for MIDI messages"""
-        try:
-            while self.midi_input:
-                for message in self.midi_input.iter_pending():
-                    if self.local_input_enabled:
-                        if message.type == 'note_on' and message.velocity > 0:
-                            self.handle_local_note(message.note, True)
-                        elif message.type == 'note_off' or (message.type == 'note_on' and message.velocity == 0):
-                            self.handle_local_note(message.note, False)
-                time.sleep(0.001)
-        except Exception as e:
-            print(f"MIDI listener error: {e}")
+        Ports are scanned and opened on the watcher thread, which posts
+        MIDI_DEVICE_EVENT as devices come and go.
+        """
+        if self.midi.watcher:
+            self.midi.rescan()
+        else:
+            self.midi.watch(on_change=self.post_midi_device_event)
+
+    def handle_midi_note(self, note: int, is_on: bool, velocity: int = 127):
+        """Handle a note from the merged MIDI input"""
+        if self.local_input_enabled:
+            self.handle_local_note(note, is_on, velocity)
+
+    def _handle_remote_notes(self, data: dict):
+        """Handle remote notes from other instruments"""
+        if data.get("offline"):
+            self.remove_remote_source(data["client_id"])
+            return
+        self.handle_remote_notes(data["client_id"], data["notes"])
+        self.mqtt_status = f"MQTT: Last msg from {data['instrument']} ({data['client_id']})"
 
     def draw_hex_segment(self, center_x, center_y, segment_index, intensity):
         """Draw a hexagonal LED segment"""
@@ -145,22 +135,17 @@ class MaskVisualizer(BaseVisualizer):
         # Draw outline
         pygame.draw.polygon(self.screen, (100, 100, 100), points, 1)
 
-    def create_wled_data(self):
+    def segment_intensities(self) -> np.ndarray:
+        """Intensity per segment based on active local notes (one octave each)"""
+        mask = self.active_note_mask(include_remote=False)
+        segment_notes = mask[:NUM_SEGMENTS * 12].reshape(NUM_SEGMENTS, 12).sum(axis=1)
+        return np.minimum(1.0, segment_notes / 6)  # Max intensity at 6 notes
+
+    def create_wled_data(self) -> bytearray:
         """Create LED data for WLED"""
-        led_data = []
-        
-        # Calculate average intensity for each segment based on active notes
-        for segment in range(NUM_SEGMENTS):
-            note_range = range(segment * 12, (segment + 1) * 12)  # Map each segment to an octave
-            segment_notes = sum(1 for note in note_range if note in self.local_notes)
-            intensity = min(1.0, segment_notes / 6)  # Max intensity at 6 notes
-            
-            # Add LED colors for this segment
-            base_color = SEGMENT_COLORS[segment]
-            segment_color = tuple(int(c * intensity) for c in base_color)
-            led_data.extend(segment_color * LEDS_PER_SEGMENT)
-            
-        return led_data
+        frame = self.led_engine.render_levels(self.segment_intensities())
+        self.latency.frame_built()
+        return frame
 
     def draw(self):
         """Main draw method"""
@@ -171,10 +156,7 @@ class MaskVisualizer(BaseVisualizer):
             center_x = SCREEN_WIDTH // 2
             center_y = SCREEN_HEIGHT // 2
             
-            for segment in range(NUM_SEGMENTS):
-                note_range = range(segment * 12, (segment + 1) * 12)
-                segment_notes = sum(1 for note in note_range if note in self.local_notes)
-                intensity = min(1.0, segment_notes / 6)
+            for segment, intensity in enumerate(self.segment_intensities()):
                 self.draw_hex_segment(center_x, center_y, segment, intensity)
             
             # Draw status bar at bottom
@@ -209,9 +191,7 @@ class MaskVisualizer(BaseVisualizer):
     def send_wled_data(self, data):
         """Send data to WLED device"""
         try:
-            packet = bytearray([2, 255])  # WARLS protocol header
-            packet.extend(data)
-            self.udp_socket.sendto(packet, (WLED_IP, WLED_PORT))
+            self.wled.submit_frame(self.wled_device.name, data)
         except Exception as e:
             print(f"Error sending WLED data: {e}")
 
@@ -220,9 +200,13 @@ class MaskVisualizer(BaseVisualizer):
         for event in pygame.event.get():
             if event.type == pygame.QUIT:
                 return False
+            elif event.type == MIDI_DEVICE_EVENT:
+                self.handle_midi_device_event(event)
             elif event.type == pygame.KEYDOWN:
                 if event.key == pygame.K_t:
                     self.local_input_enabled = not self.local_input_enabled
+                elif event.key == pygame.K_l:
+                    self.print_metrics()
                 elif event.key == pygame.K_m:
                     self.setup_midi()
                 elif event.key == pygame.K_q:
@@ -36,19 +36,18 @@ class PianoVisualizer(BaseVisualizer):
         self.color_mapping = "chromatic"
         self.last_message = "No message"
         
-    def _handle_midi_note(self, note: int, is_on: bool):
+    def _handle_midi_note(self, note: int, is_on: bool, velocity: int = 127):
         """Handle local MIDI note"""
-        if is_on:
-            self.local_notes.add(note)
-            self.mqtt.publish_notes(self.local_notes)
-        else:
-            self.local_notes.discard(note)
-            self.mqtt.publish_notes(self.local_notes)
+        self.handle_local_note(note, is_on, velocity)
+        self.mqtt.publish_notes(self.local_notes, self.note_velocities())
     
     def _handle_remote_notes(self, data: dict):
         """Handle remote notes from MQTT"""
         source_id = data["client_id"]
-        self.remote_notes[source_id] = set(data["notes"])
+        if data.get("offline"):
+            self.remove_remote_source(source_id)
+            return
+        self.handle_remote_notes(source_id, set(data["notes"]))
     
     def draw(self):
         """Draw piano visualization"""
@@ -27,10 +27,7 @@ class PianoVisualizer(BaseVisualizer):
         self.color_mapping = "chromatic"
         self.last_message = "Test Mode Active" if test_mode else "Ready"
     
-    def _handle_midi_note(self, note: int, is_on: bool):
+    def _handle_midi_note(self, note: int, is_on: bool, velocity: int = 127):
         """Handle local MIDI note"""
-        if is_on:
-            self.local_notes.add(note)
-        else:
-            self.local_notes.discard(note)
+        self.handle_local_note(note, is_on, velocity)
         print(f"MIDI Note {'ON' if is_on else 'OFF'}: {note}") 
\ No newline at end of file
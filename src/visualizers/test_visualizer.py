@@ -1,17 +1,21 @@
 import pygame
-import socket
-import time
-import mido
 from typing import Set
-import threading
-from .base_visualizer import BaseVisualizer
-from src.communication.mqtt_client import MusicMQTTClient
+from .base_visualizer import BaseVisualizer, MIDI_DEVICE_EVENT
+from .led_frame import LEDFrameEngine, piano_roll_notes
+from src.communication.mqtt_client import MusicMQTTClient, ANY_INSTRUMENT
+from src.config.settings import MQTT_ROOM
+from src.midi.midi_merger import MIDIInputMerger
+from src.midi.midi_player import MIDIFilePlayer
+from src.communication.wled_client import WLEDManager
+from src.config.device_config import WLEDDevice
+import sys
 import uuid
 
 # Constants
 SCREEN_WIDTH = 1200
 SCREEN_HEIGHT = 400
 FPS = 30
+LED_FPS = 60  # LED output rate, independent of the display clock
 
 # WLED settings
 WLED_IP = "192.168.8.106"
@@ -55,10 +59,10 @@ class TestVisualizer(BaseVisualizer):
         self.mqtt_status = "MQTT: Not connected"
         self.last_midi_message = "No MIDI connected"
 
-        # MIDI device management
-        self.midi_devices = mido.get_input_names()
-        self.current_midi_device_index = -1
-        self.midi_input = None
+        # MIDI input: every connected device is merged into one note stream
+        self.midi = MIDIInputMerger(self.handle_midi_note, tracer=self.latency)
+        # MIDI file playback feeds the same note path as live input
+        self.player = MIDIFilePlayer(self.handle_midi_note, tracer=self.latency)
 
         # Generate unique client ID and set instrument type
         self.client_id = f"test_{uuid.uuid4().hex[:8]}"
@@ -67,16 +71,15 @@ class TestVisualizer(BaseVisualizer):
         # MQTT setup
         print("\nSetting up MQTT...")
         try:
-            self.mqtt = MusicMQTTClient(self.client_id, self.instrument_type)
+            self.mqtt = MusicMQTTClient(self.client_id, self.instrument_type, mode="events", deferred=True,
+                                        clock_sync=True, jitter_buffer=True, room=MQTT_ROOM)
             print(f"Created MQTT client with ID: {self.client_id}")
             
             if self.mqtt.connect():
                 self.mqtt_status = f"MQTT: Connected ({self.client_id})"
                 print("Successfully connected to MQTT broker")
-                # Subscribe to other instruments
-                for instrument in ['guitar', 'drums', 'bass', 'piano']:
-                    print(f"Subscribing to {instrument} messages...")
-                    self.mqtt.register_callback(instrument, self._handle_remote_notes)
+                # One wildcard subscription receives every instrument
+                self.mqtt.register_callback(ANY_INSTRUMENT, self._handle_remote_notes)
             else:
                 self.mqtt_status = "MQTT: Connection failed"
                 print("Failed to connect to MQTT broker")
@@ -84,77 +87,41 @@ class TestVisualizer(BaseVisualizer):
             self.mqtt_status = f"MQTT: Error - {str(e)}"
             print(f"MQTT setup error: {e}")
 
-        # Initialize remote notes storage
-        self.remote_notes = {}  # Store notes from other clients
-        self.local_notes = set()  # Store local notes
-
         # MIDI setup
         print("Setting up MIDI...")
         self.setup_midi()
 
         # WLED setup
         print(f"Setting up WLED connection to {WLED_IP}:{WLED_PORT}")
-        self.udp_socket = socket.socket(socket.AF_INET, socket.SOCK_DGRAM)
+        self.led_engine = self.create_led_engine()
+        self.wled_device = WLEDDevice(name="Piano Roll", ip=WLED_IP, port=WLED_PORT,
+                                      num_leds=NUM_LEDS, instrument=self.instrument_type)
+        self.wled = WLEDManager([self.wled_device], tracer=self.latency)
+        self.wled.start_output(LED_FPS)
         print("Initialization complete.")
 
     def setup_midi(self):
-        """Set up MIDI input with device switching"""
-        try:
-            # Get fresh list of devices
-            self.midi_devices = mido.get_input_names()
-            print(f"\nAvailable MIDI devices: {self.midi_devices}")
-            
-            if self.midi_devices:
-                # Close existing connection if any
-                if self.midi_input:
-                    try:
-                        self.midi_input.close()
-                        self.midi_input = None
-                        time.sleep(0.1)  # Give it time to close
-                    except:
-                        print("Error closing previous MIDI device")
+        """Watch for MIDI inputs; every port feeds one merged note stream.
 
-                # Update device index
-                self.current_midi_device_index = (self.current_midi_device_index + 1) % len(self.midi_devices)
-                device_name = self.midi_devices[self.current_midi_device_index]
-                
-                print(f"Attempting to connect to: {device_name} (Device {self.current_midi_device_index + 1} of {len(self.midi_devices)})")
-                
-                self.midi_input = mido.open_input(device_name)
-                self.last_midi_message = f"Connected to: {device_name}"
-                print(f"Successfully connected to MIDI device: {device_name}")
-                
-                # Start MIDI listener thread
-                midi_thread = threading.Thread(target=self.midi_listener, daemon=True)
-                midi_thread.start()
-            else:
-                print("No MIDI devices found")
-                self.last_midi_message = "No devices found"
-                self.current_midi_device_index = -1
-        except Exception as e:
-            print(f"MIDI setup error: {e}")
-            self.last_midi_message = f"Error: {str(e)}"
-            self.current_midi_device_index = -1
+        Ports are scanned and opened on the watcher thread, which posts
+        MIDI_DEVICE_EVENT as devices come and go.
+        """
+        if self.midi.watcher:
+            self.midi.rescan()
+        else:
+            self.midi.watch(on_change=self.post_midi_device_event)
 
-    def midi_listener(self):
-        """Listen for MIDI messages"""
-        print("Starting MIDI listener...")
-        try:
-            while self.midi_input:
-                for message in self.midi_input.iter_pending():
-                    # Only process MIDI input if local input is enabled
-                    if self.local_input_enabled:
-                        if message.type == 'note_on' and message.velocity > 0:
-                            self.handle_local_note(message.note, True)
-                            print(f"LOCAL MIDI Note ON: {message.note}")
-                        elif message.type == 'note_off' or (message.type == 'note_on' and message.velocity == 0):
-                            self.handle_local_note(message.note, False)
-                            print(f"LOCAL MIDI Note OFF: {message.note}")
-                time.sleep(0.001)
-        except Exception as e:
-            print(f"MIDI listener error: {e}")
-        finally:
-            print("MIDI listener ended")
+    def handle_midi_note(self, note: int, is_on: bool, velocity: int = 127):
+        """Handle a note from the merged MIDI input"""
+        # Only process MIDI input if local input is enabled
+        if self.local_input_enabled:
+            self.handle_local_note(note, is_on, velocity)
+            print(f"LOCAL MIDI Note {'ON' if is_on else 'OFF'}: {note}")
+
+    def play_midi_file(self, path: str, speed: float = 1.0):
+        """Play a .mid file as if it were a connected keyboard (speed 0 = as fast as possible)"""
+        print(f"Playing MIDI file: {path} at {speed}x")
+        self.player.start(path, speed)
 
     def draw(self):
         """Implementation of abstract method from BaseVisualizer"""
@@ -170,7 +137,7 @@ class TestVisualizer(BaseVisualizer):
                         f"Local Notes: {len(self.local_notes)} | "
                         f"Remote Sources: {len(self.remote_notes)} "
                         f"(Notes: {sum(len(notes) for notes in self.remote_notes.values())}) | "
-                        f"Press 't' to toggle mode | 'm' to rescan MIDI | 'q' to quit")
+                        f"Press 't' to toggle mode | 'm' to rescan MIDI | 'l' latency | 'q' to quit")
             self.draw_info(info_text)
             
             led_data = self.create_wled_data()
@@ -200,8 +167,8 @@ class TestVisualizer(BaseVisualizer):
                 note_class = note % 12
                 base_color = CHROMATIC_COLORS[note_class]
                 
-                is_local = note in self.local_notes
-                is_remote = any(note in notes for notes in self.remote_notes.values())
+                is_local = self.note_state.is_local(note)
+                is_remote = self.note_state.is_remote(note)
                 
                 if is_local:
                     color = (255, 255, 255)  # Local note: White
@@ -230,7 +197,7 @@ class TestVisualizer(BaseVisualizer):
                 note_class = note % 12
                 color = CHROMATIC_COLORS[note_class]
                 
-                if note in self.local_notes or any(note in notes for notes in self.remote_notes.values()):
+                if self.note_state.is_active(note):
                     color = tuple(min(int(c * 1.5), 255) for c in color)
                 else:
                     color = tuple(int(c * 0.3) for c in color)
@@ -268,35 +235,23 @@ class TestVisualizer(BaseVisualizer):
                     print(f"Clicked note OFF: {note}")
                 return
 
-    def create_wled_data(self) -> bytes:
+    def create_led_engine(self) -> LEDFrameEngine:
+        """Map each LED to its note - one LED per note, with offset"""
+        # Blank LEDs for physical offset, then note LEDs with note offset compensation
+        led_notes = piano_roll_notes(NUM_LEDS, START_NOTE, TOTAL_NOTES, LED_OFFSET, LED_NOTE_OFFSET)
+        # Full brightness for active notes, dimmed for inactive
+        return LEDFrameEngine(led_notes, CHROMATIC_COLORS, active_scale=1.0, inactive_scale=0.1)
+
+    def create_wled_data(self) -> bytearray:
         """Create WLED data packet - one LED per note, with offset"""
-        data = []
-        
-        # Add blank LEDs for physical offset
-        for _ in range(LED_OFFSET):
-            data.extend((0, 0, 0))  # Dark LEDs for offset
-            
-        # Add note LEDs with note offset compensation
-        for i in range(NUM_LEDS - LED_OFFSET):
-            # Adjust the note mapping to account for LED offset
-            note = START_NOTE + ((i + LED_NOTE_OFFSET) % TOTAL_NOTES)  # Wrap around to keep mapping
-            note_class = note % 12
-            color = CHROMATIC_COLORS[note_class]
-            
-            # Brighten if note is active (either local or remote)
-            if note in self.local_notes or any(note in notes for notes in self.remote_notes.values()):
-                data.extend(color)  # Full brightness for active notes
-            else:
-                data.extend(tuple(int(c * 0.1) for c in color))  # Dimmed for inactive
-        
-        return bytes(data)
+        frame = self.led_engine.render_velocity(self.active_note_mask(), self.note_velocities())
+        self.latency.frame_built()
+        return frame
 
     def send_wled_data(self, data: bytes):
         """Send data to WLED"""
         try:
-            packet = bytearray([2, 255])  # WARLS protocol
-            packet.extend(data)
-            self.udp_socket.sendto(packet, (WLED_IP, WLED_PORT))
+            self.wled.submit_frame(self.wled_device.name, data)
         except Exception as e:
             print(f"WLED communication error: {e}")
 
@@ -305,9 +260,13 @@ class TestVisualizer(BaseVisualizer):
         for event in pygame.event.get():
             if event.type == pygame.QUIT:
                 return False
+            elif event.type == MIDI_DEVICE_EVENT:
+                self.handle_midi_device_event(event)
             elif event.type == pygame.KEYDOWN:
                 if event.key == pygame.K_q:
                     return False
+                elif event.key == pygame.K_l:
+                    self.print_metrics()
                 elif event.key == pygame.K_m:
                     print("Rescanning MIDI devices...")
                     self.setup_midi()
@@ -316,13 +275,13 @@ class TestVisualizer(BaseVisualizer):
                     mode = "LOCAL" if self.local_input_enabled else "REMOTE"
                     print(f"\nSwitched to {mode} input mode")
                     if not self.local_input_enabled:
-                        self.local_notes.clear()
+                        self.clear_local_notes()
                         self.mqtt.publish_notes(self.local_notes)
             elif event.type == pygame.MOUSEBUTTONDOWN:
                 self.handle_mouse_click(event.pos)
             elif event.type == pygame.MOUSEBUTTONUP:
                 # Optional: clear all notes on mouse release
-                # self.local_notes.clear()
+                # self.clear_local_notes()
                 # self.mqtt.publish_notes(self.local_notes)
                 pass
         return True
@@ -331,6 +290,10 @@ class TestVisualizer(BaseVisualizer):
         """Handle remote notes from other instruments"""
         source_id = data["client_id"]
         instrument = data["instrument"]
+        if data.get("offline"):
+            print(f"REMOTE MQTT {instrument} ({source_id}) went offline")
+            self.remove_remote_source(source_id)
+            return
         notes = set(data["notes"])
         old_notes = self.remote_notes.get(source_id, set())
         
@@ -343,30 +306,30 @@ class TestVisualizer(BaseVisualizer):
         if removed_notes:
             print(f"REMOTE MQTT Note OFF from {instrument} ({source_id}): {removed_notes}")
             
-        self.remote_notes[source_id] = notes
+        self.handle_remote_notes(source_id, notes)
         self.mqtt_status = f"MQTT: Last msg from {instrument} ({source_id})"
 
-    def handle_local_note(self, note: int, is_on: bool):
+    def handle_local_note(self, note: int, is_on: bool, velocity: int = 127):
         """Handle local MIDI note and publish to MQTT"""
-        if is_on:
-            self.local_notes.add(note)
-        else:
-            self.local_notes.discard(note)
+        super().handle_local_note(note, is_on, velocity)
         
         # Publish updated notes via MQTT
-        self.mqtt.publish_notes(self.local_notes)
+        self.mqtt.publish_notes(self.local_notes, self.note_velocities())
 
     def cleanup(self):
         """Override cleanup to handle MIDI, MQTT and WLED"""
         print("Cleaning up...")
-        if self.midi_input:
-            self.midi_input.close()
+        self.player.stop()
+        self.midi.close()
         self.mqtt.disconnect()  # Add MQTT disconnect
-        self.udp_socket.close()
+        self.wled.close()
         super().cleanup()
         print("Cleanup complete.")
 
 if __name__ == "__main__":
     print("Starting Test Visualizer...")
     visualizer = TestVisualizer()
+    if len(sys.argv) > 1:
+        # python -m src.visualizers.test_visualizer song.mid [speed]
+        visualizer.play_midi_file(sys.argv[1], float(sys.argv[2]) if len(sys.argv) > 2 else 1.0)
     visualizer.run()
\ No newline at end of file
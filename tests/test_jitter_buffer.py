@@ -0,0 +1,23 @@
+from src.communication.jitter_buffer import JitterBuffer
+
+def test_updates_play_after_the_delay_in_order():
+    buffer = JitterBuffer()
+    buffer.push("a", 1_000, 2_000, "a1", offset_us=0)
+    buffer.push("a", 1_500, 2_100, "a2", offset_us=0)
+    assert buffer.pop_due(1_000) == []
+    assert buffer.pop_due(10_000) == ["a1", "a2"]
+
+def test_forget_drops_queued_updates():
+    buffer = JitterBuffer()
+    buffer.push("a", 1_000, 5_000, "a1", offset_us=0)
+    buffer.push("b", 1_000, 5_000, "b1", offset_us=0)
+    buffer.push("a", 2_000, 6_000, "a2", offset_us=0)
+    buffer.forget("a")
+    assert buffer.pop_due(100_000) == ["b1"]
+
+def test_source_plays_again_after_forget():
+    buffer = JitterBuffer()
+    buffer.push("a", 1_000, 5_000, "old", offset_us=0)
+    buffer.forget("a")
+    buffer.push("a", 3_000, 4_000, "new", offset_us=0)
+    assert buffer.pop_due(100_000) == ["new"]
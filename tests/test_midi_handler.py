@@ -0,0 +1,148 @@
+import threading
+import time
+
+import mido
+import pytest
+
+from src.midi.midi_handler import MIDIHandler
+
+class FakePort:
+    def __init__(self, name, callback=None):
+        self.name = name
+        self.callback = callback
+        self.closed = False
+
+    def iter_pending(self):
+        return iter(())
+
+    def close(self):
+        self.closed = True
+
+class FakeMido:
+    """Port list and open ports standing in for the MIDI backend"""
+
+    def __init__(self, monkeypatch, devices):
+        self.devices = list(devices)
+        self.ports = []
+        monkeypatch.setattr(mido, "get_input_names", lambda: list(self.devices))
+        monkeypatch.setattr(mido, "open_input", self.open_input)
+
+    def open_input(self, name, callback=None):
+        if name not in self.devices:
+            raise IOError(f"No such port: {name}")
+        port = FakePort(name, callback)
+        self.ports.append(port)
+        return port
+
+def wait_for(condition, timeout=2.0):
+    deadline = time.monotonic() + timeout
+    while not condition():
+        if time.monotonic() > deadline:
+            raise AssertionError("Timed out")
+        time.sleep(0.01)
+
+@pytest.fixture(autouse=True)
+def in_tmp_path(tmp_path, monkeypatch):
+    # MIDIHandler keeps last_midi_device.txt in the working directory
+    monkeypatch.chdir(tmp_path)
+
+def make_handler(saved=None):
+    if saved:
+        with open("last_midi_device.txt", "w") as f:
+            f.write(saved)
+    notes = []
+    handler = MIDIHandler(lambda note, is_on, velocity: notes.append((note, is_on, velocity)))
+    return handler, notes
+
+def test_callback_mode_delivers_notes(monkeypatch):
+    backend = FakeMido(monkeypatch, ["Keys"])
+    handler, notes = make_handler()
+    assert handler.connect()
+    port = backend.ports[-1]
+    port.callback(mido.Message("note_on", note=60, velocity=90))
+    port.callback(mido.Message("note_off", note=60))
+    wait_for(lambda: len(notes) == 2)
+    assert notes == [(60, True, 90), (60, False, 0)]
+    handler.close()
+    assert port.closed
+
+def test_watch_falls_back_when_saved_device_is_missing(monkeypatch):
+    FakeMido(monkeypatch, ["Other Keys"])
+    handler, _ = make_handler(saved="Keys")
+    changes = []
+    handler.watch(interval=3600, on_change=lambda name, connected: changes.append((name, connected)))
+    try:
+        wait_for(lambda: handler.device_name is not None)
+        assert handler.device_name == "Other Keys"
+        assert handler.last_device == "Keys"  # Fallback does not replace the saved device
+        assert changes == [("Other Keys", True)]
+    finally:
+        handler.stop_watching()
+        handler.close()
+
+def test_watch_switches_back_to_saved_device(monkeypatch):
+    backend = FakeMido(monkeypatch, ["Other Keys"])
+    handler, _ = make_handler(saved="Keys")
+    handler.watch(interval=3600)
+    try:
+        wait_for(lambda: handler.device_name is not None)
+        backend.devices.append("Keys")
+        handler.watcher.scan()
+        assert handler.device_name == "Keys"
+        assert backend.ports[0].closed
+    finally:
+        handler.stop_watching()
+        handler.close()
+
+def test_watch_reconnects_after_unplug(monkeypatch):
+    backend = FakeMido(monkeypatch, ["Keys", "Pads"])
+    handler, _ = make_handler(saved="Keys")
+    changes = []
+    handler.watch(interval=3600, on_change=lambda name, connected: changes.append((name, connected)))
+    try:
+        wait_for(lambda: handler.device_name is not None)
+        assert handler.device_name == "Keys"
+
+        backend.devices.remove("Keys")
+        handler.watcher.scan()
+        assert handler.device_name == "Pads"  # Fell back to what is still plugged in
+
+        backend.devices.append("Keys")
+        handler.watcher.scan()
+        assert handler.device_name == "Keys"
+        assert changes == [("Keys", True), ("Keys", False), ("Pads", True), ("Keys", True)]
+    finally:
+        handler.stop_watching()
+        handler.close()
+
+def test_first_device_is_saved_without_a_saved_device(monkeypatch):
+    FakeMido(monkeypatch, ["Keys"])
+    handler, _ = make_handler()
+    handler.watch(interval=3600)
+    try:
+        wait_for(lambda: handler.device_name is not None)
+        assert handler.last_device == "Keys"
+        with open("last_midi_device.txt") as f:
+            assert f.read() == "Keys"
+    finally:
+        handler.stop_watching()
+        handler.close()
+
+def test_unplug_releases_held_notes(monkeypatch):
+    backend = FakeMido(monkeypatch, ["Keys", "Pads"])
+    handler, notes = make_handler(saved="Keys")
+    handler.watch(interval=3600)
+    try:
+        wait_for(lambda: handler.device_name is not None)
+        backend.ports[-1].callback(mido.Message("note_on", note=60, velocity=90))
+        backend.ports[-1].callback(mido.Message("note_on", note=64, velocity=80))
+        wait_for(lambda: len(notes) == 2)
+
+        backend.devices.remove("Keys")
+        handler.watcher.scan()
+        assert handler.device_name == "Pads"
+        assert notes[2:] == [(60, False, 0), (64, False, 0)]
+        assert not handler.note_state.local_notes
+    finally:
+        handler.stop_watching()
+        handler.close()
@@ -0,0 +1,97 @@
+import ctypes
+import errno
+import socket
+
+import pytest
+
+from src.communication.udp_batch import BatchSender
+
+@pytest.fixture
+def receiver():
+    sock = socket.socket(socket.AF_INET, socket.SOCK_DGRAM)
+    sock.bind(("127.0.0.1", 0))
+    sock.settimeout(1.0)
+    yield sock
+    sock.close()
+
+class FullAfterSocket:
+    """Socket whose buffer fills up (or that fails with `error`) after `capacity` datagrams"""
+
+    def __init__(self, capacity, error=BlockingIOError):
+        self.capacity = capacity
+        self.error = error
+        self.sent = []
+
+    def setblocking(self, flag):
+        pass
+
+    def setsockopt(self, *args):
+        pass
+
+    def sendto(self, packet, address):
+        if len(self.sent) >= self.capacity:
+            raise self.error
+        self.sent.append(bytes(packet))
+
+    def close(self):
+        pass
+
+def make_batch(address, count):
+    return [(memoryview(bytearray([i]) * 8), address) for i in range(count)]
+
+@pytest.mark.parametrize("use_sendmmsg", [True, False])
+def test_batch_arrives_in_order(receiver, use_sendmmsg):
+    sender = BatchSender()
+    if not use_sendmmsg:
+        sender._sendmmsg = None
+    elif not sender.uses_sendmmsg:
+        pytest.skip("sendmmsg not available on this platform")
+    address = receiver.getsockname()
+    assert sender.send(make_batch(address, 5)) == 5
+    assert [receiver.recv(64) for _ in range(5)] == [bytes([i]) * 8 for i in range(5)]
+    assert sender.dropped == 0
+    sender.close()
+
+def test_sendto_fallback_drops_the_rest_when_full():
+    sock = FullAfterSocket(capacity=2)
+    sender = BatchSender(sock)
+    sender._sendmmsg = None
+    assert not sender.uses_sendmmsg
+    assert sender.send(make_batch(("127.0.0.1", 9), 5)) == 2
+    assert sock.sent == [bytes([0]) * 8, bytes([1]) * 8]
+    assert sender.dropped == 3
+
+def test_sendto_fallback_counts_errors_as_dropped():
+    sock = FullAfterSocket(capacity=1, error=OSError(errno.ENETUNREACH, "Network is unreachable"))
+    sender = BatchSender(sock)
+    sender._sendmmsg = None
+    assert sender.send(make_batch(("127.0.0.1", 9), 3)) == 1
+    assert sender.dropped == 2
+    assert sender.errors == 1
+    assert sender.last_error.errno == errno.ENETUNREACH
+
+def test_sendmmsg_errors_are_counted_as_dropped():
+    sender = BatchSender()
+    if not sender.uses_sendmmsg:
+        pytest.skip("sendmmsg not available on this platform")
+    calls = []
+
+    def sendmmsg(fd, messages, count, flags):
+        calls.append(count)
+        if len(calls) == 1:
+            return 2  # The first two went out, the third fails
+        ctypes.set_errno(errno.EHOSTUNREACH)
+        return -1
+
+    sender._sendmmsg = sendmmsg
+    assert sender.send(make_batch(("127.0.0.1", 9), 5)) == 2
+    assert calls == [5, 3]
+    assert sender.dropped == 3
+    assert sender.errors == 1
+    assert sender.last_error.errno == errno.EHOSTUNREACH
+    sender.close()
+
+def test_empty_batch():
+    sender = BatchSender(FullAfterSocket(capacity=0))
+    assert sender.send([]) == 0
+    assert sender.dropped == 0
@@ -0,0 +1,197 @@
+import errno
+import socket
+import time
+
+import pytest
+
+from src.communication.wled_client import (
+    ARTNET_HEADER_LEN, ARTNET_SEQUENCE_OFFSET, DDP_FLAGS_PUSH, DDP_FLAGS_VER1, DDP_HEADER_LEN,
+    DDP_MAX_DATA, DMX_PIXELS_PER_UNIVERSE, DNRGB, DNRGB_MAX_LEDS, DRGB, E131_HEADER_LEN,
+    E131_SEQUENCE_OFFSET, REALTIME_TIMEOUT, WARLS, DDPEncoder, WLEDManager,
+)
+from src.config.device_config import WLEDDevice
+
+@pytest.fixture
+def receiver():
+    sock = socket.socket(socket.AF_INET, socket.SOCK_DGRAM)
+    sock.bind(("127.0.0.1", 0))
+    sock.settimeout(1.0)
+    yield sock
+    sock.close()
+
+def receive(sock, count):
+    return [sock.recv(65536) for _ in range(count)]
+
+def assert_nothing_more(sock):
+    sock.settimeout(0.05)
+    with pytest.raises(socket.timeout):
+        sock.recv(65536)
+
+def make_manager(receiver, num_leds, protocol, **kwargs):
+    device = WLEDDevice("strip", "127.0.0.1", receiver.getsockname()[1], num_leds, protocol=protocol)
+    return WLEDManager([device], **kwargs)
+
+def make_frame(num_leds):
+    return bytes(i % 251 for i in range(num_leds * 3))
+
+def test_warls_packet(receiver):
+    manager = make_manager(receiver, 3, "warls")
+    assert manager.send_frame("strip", bytes(range(1, 10)))
+    packet, = receive(receiver, 1)
+    assert packet == bytes([WARLS, REALTIME_TIMEOUT, 0, 1, 2, 3, 1, 4, 5, 6, 2, 7, 8, 9])
+    manager.close()
+
+def test_drgb_packet(receiver):
+    frame = make_frame(100)
+    manager = make_manager(receiver, 100, "realtime")
+    manager.send_frame("strip", frame)
+    packet, = receive(receiver, 1)
+    assert packet == bytes([DRGB, REALTIME_TIMEOUT]) + frame
+    manager.close()
+
+def test_dnrgb_splits_at_489_leds(receiver):
+    frame = make_frame(600)
+    manager = make_manager(receiver, 600, "realtime")
+    manager.send_frame("strip", frame)
+    first, second = receive(receiver, 2)
+    assert first[:4] == bytes([DNRGB, REALTIME_TIMEOUT, 0, 0])
+    assert first[4:] == frame[:DNRGB_MAX_LEDS * 3]
+    assert second[:4] == bytes([DNRGB, REALTIME_TIMEOUT, DNRGB_MAX_LEDS >> 8, DNRGB_MAX_LEDS & 0xFF])
+    assert second[4:] == frame[DNRGB_MAX_LEDS * 3:]
+    manager.close()
+
+def test_ddp_fragments_and_pushes_last_packet(receiver):
+    frame = make_frame(600)
+    manager = make_manager(receiver, 600, "ddp")
+    manager.send_frame("strip", frame)
+    first, second = receive(receiver, 2)
+    for packet, start in ((first, 0), (second, DDP_MAX_DATA)):
+        length = len(packet) - DDP_HEADER_LEN
+        assert packet[1] == 1  # Sequence
+        assert int.from_bytes(packet[4:8], "big") == start
+        assert int.from_bytes(packet[8:10], "big") == length
+        assert packet[DDP_HEADER_LEN:] == frame[start:start + length]
+    assert len(first) == DDP_HEADER_LEN + DDP_MAX_DATA
+    assert first[0] == DDP_FLAGS_VER1
+    assert second[0] == DDP_FLAGS_VER1 | DDP_FLAGS_PUSH
+    manager.close()
+
+def test_ddp_sequence_wraps_from_15_to_1():
+    encoder = DDPEncoder(10)
+    sequences = [encoder.encode(bytes(30))[0][1] for _ in range(16)]
+    assert sequences == list(range(1, 16)) + [1]
+
+def test_ddp_devices_push_together(receiver):
+    port = receiver.getsockname()[1]
+    devices = [WLEDDevice(name, "127.0.0.1", port, 10, protocol="ddp") for name in ("a", "b")]
+    manager = WLEDManager(devices)
+    assert manager.send_frames({"a": make_frame(10), "b": bytes(30)}) == 2
+    packets = receive(receiver, 4)
+    assert [packet[0] for packet in packets] == [DDP_FLAGS_VER1] * 2 + [DDP_FLAGS_VER1 | DDP_FLAGS_PUSH] * 2
+    assert [len(packet) for packet in packets[2:]] == [DDP_HEADER_LEN] * 2
+    manager.close()
+
+def test_e131_universes_and_sequence(receiver):
+    frame = make_frame(200)
+    manager = make_manager(receiver, 200, "e131")
+    for sequence in (1, 2):
+        manager.send_frame("strip", frame, force=True)
+        first, second = receive(receiver, 2)
+        assert first[4:16] == b"ASC-E1.17\x00\x00\x00"
+        assert [int.from_bytes(p[113:115], "big") for p in (first, second)] == [1, 2]
+        assert first[E131_SEQUENCE_OFFSET] == second[E131_SEQUENCE_OFFSET] == sequence
+        assert first[E131_HEADER_LEN:] == frame[:DMX_PIXELS_PER_UNIVERSE * 3]
+        assert second[E131_HEADER_LEN:] == frame[DMX_PIXELS_PER_UNIVERSE * 3:]
+        assert int.from_bytes(second[123:125], "big") == len(second) - E131_HEADER_LEN + 1
+    manager.close()
+
+def test_artnet_universes_have_even_length(receiver):
+    frame = make_frame(DMX_PIXELS_PER_UNIVERSE + 1)
+    manager = make_manager(receiver, DMX_PIXELS_PER_UNIVERSE + 1, "artnet")
+    manager.send_frame("strip", frame)
+    first, second = receive(receiver, 2)
+    assert first[:8] == b"Art-Net\x00"
+    assert [p[14] for p in (first, second)] == [1, 2]  # SubUni
+    assert first[ARTNET_SEQUENCE_OFFSET] == second[ARTNET_SEQUENCE_OFFSET] == 1
+    assert int.from_bytes(second[16:18], "big") == 4  # 3 slots padded to 4
+    assert second[ARTNET_HEADER_LEN:] == frame[-3:] + b"\x00"
+    manager.close()
+
+def test_unchanged_frames_are_suppressed_until_keepalive(receiver):
+    frame = make_frame(10)
+    manager = make_manager(receiver, 10, "drgb", keepalive_interval=0.1)
+    assert manager.send_frame("strip", frame)
+    assert not manager.send_frame("strip", frame)
+    assert manager.send_frame("strip", bytes(30))  # A change goes out at once
+    time.sleep(0.15)
+    assert manager.send_frame("strip", bytes(30))  # Unchanged, but due for a keepalive
+    assert manager.get_stats()["strip"] == {"sent": 3, "suppressed": 1, "keepalives": 1}
+    assert [p[2:] for p in receive(receiver, 3)] == [frame, bytes(30), bytes(30)]
+    assert_nothing_more(receiver)
+    manager.close()
+
+def test_output_thread_sends_keepalives(receiver):
+    manager = make_manager(receiver, 10, "drgb", keepalive_interval=0.05)
+    manager.start_output(rate=100)
+    manager.submit_frame("strip", make_frame(10))
+    time.sleep(0.3)
+    manager.stop_output()
+    stats = manager.get_stats()["strip"]
+    assert stats["keepalives"] >= 3
+    packets = receive(receiver, stats["sent"])
+    assert all(p[2:] == make_frame(10) for p in packets)
+    manager.close()
+
+def test_identical_e131_devices_keep_their_own_stream(receiver):
+    port = receiver.getsockname()[1]
+    devices = [WLEDDevice(name, "127.0.0.1", port, 10, protocol="e131") for name in ("a", "b")]
+    manager = WLEDManager(devices)
+    cids = {name: manager.encoders[name].cid for name in ("a", "b")}
+    assert cids["a"] != cids["b"]
+    frame = make_frame(10)
+    for sequence in (1, 2, 3):
+        manager.send_frames({"a": frame, "b": frame}, force=True)
+        a, b = receive(receiver, 2)
+        assert a[22:38] == cids["a"] and b[22:38] == cids["b"]
+        assert a[E131_SEQUENCE_OFFSET] == b[E131_SEQUENCE_OFFSET] == sequence
+    manager.close()
+
+def test_identical_realtime_devices_share_encoded_packets(receiver):
+    port = receiver.getsockname()[1]
+    devices = [WLEDDevice(name, "127.0.0.1", port, 10, protocol="drgb") for name in ("a", "b")]
+    manager = WLEDManager(devices)
+    frame = make_frame(10)
+    manager.send_frames({"a": frame, "b": frame})
+    assert receive(receiver, 2) == [bytes([DRGB, REALTIME_TIMEOUT]) + frame] * 2
+    manager.close()
+
+class UnreachableSocket:
+    def sendto(self, packet, address):
+        raise OSError(errno.EHOSTUNREACH, "No route to host")
+
+def test_failed_send_is_not_suppressed(receiver):
+    frame = make_frame(10)
+    manager = make_manager(receiver, 10, "drgb")
+    sock = manager.sender.sock
+    manager.sender.sock = UnreachableSocket()
+    manager.sender._sendmmsg = None
+    assert not manager.send_frame("strip", frame)
+    assert manager.sender.errors == 1
+    assert manager.get_stats()["strip"]["sent"] == 0
+    manager.sender.sock = sock
+    assert manager.send_frame("strip", frame)  # Resent, not suppressed as unchanged
+    assert receive(receiver, 1) == [bytes([DRGB, REALTIME_TIMEOUT]) + frame]
+    manager.close()
+
+def test_direct_sends_while_output_thread_runs(receiver):
+    manager = make_manager(receiver, 10, "ddp", keepalive_interval=0.001)
+    manager.start_output(rate=1000)
+    for i in range(200):
+        manager.send_frame("strip", bytes([i % 256]) * 30)
+        manager.submit_frame("strip", bytes([255 - i % 256]) * 30)
+    manager.stop_output()
+    sent = manager.get_stats()["strip"]["sent"]
+    sequences = [packet[1] for packet in receive(receiver, sent)]
+    # One encoder, one sequence counter: every packet follows the previous one
+    assert all(b == a % 15 + 1 for a, b in zip(sequences, sequences[1:]))
+    manager.close()
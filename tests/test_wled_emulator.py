@@ -0,0 +1,55 @@
+import time
+
+import pytest
+
+from src.communication.wled_client import DNRGB_MAX_LEDS, WLEDManager
+from src.communication.wled_emulator import WLEDEmulator
+from src.config.device_config import WLEDDevice
+
+FRAMES = 5
+
+def make_frame(num_leds, seed):
+    return bytes((i * 7 + seed) % 256 for i in range(num_leds * 3))
+
+def send_and_receive(protocol, num_leds, emulator_leds=0):
+    """Send FRAMES distinct frames through WLEDManager to an emulated device"""
+    emulator = WLEDEmulator([0], num_leds=emulator_leds)
+    device = emulator.devices[emulator.ports[0]]
+    manager = WLEDManager([WLEDDevice("strip", "127.0.0.1", device.port, num_leds, protocol=protocol)])
+    frames = [make_frame(num_leds, seed) for seed in range(FRAMES)]
+    packets = 0
+    for frame in frames:
+        assert manager.send_frame("strip", frame)
+        packets += len(manager.encoders["strip"].packets)
+    deadline = time.monotonic() + 2.0
+    while device.packets < packets and time.monotonic() < deadline:
+        emulator.poll(0.05)
+    manager.close()
+    emulator.close()
+    return device, frames[-1]
+
+@pytest.mark.parametrize("protocol, num_leds", [
+    ("warls", 100),
+    ("drgb", 300),
+    ("realtime", 1000),  # DNRGB, ends on a short packet
+    ("ddp", 1000),
+])
+def test_emulator_decodes_manager_frames(protocol, num_leds):
+    device, last = send_and_receive(protocol, num_leds)
+    assert bytes(device.leds) == last
+    assert device.frames == FRAMES
+    assert device.dropped == device.out_of_order == device.malformed == 0
+
+def test_dnrgb_whole_packets_with_known_length():
+    device, last = send_and_receive("dnrgb", DNRGB_MAX_LEDS * 2, emulator_leds=DNRGB_MAX_LEDS * 2)
+    assert bytes(device.leds) == last
+    assert device.frames == FRAMES
+    assert device.dropped == 0
+
+def test_dnrgb_whole_packets_with_unknown_length():
+    # Without a short packet the first frame only ends when the next one
+    # starts; from then on the learned length ends each frame
+    device, last = send_and_receive("dnrgb", DNRGB_MAX_LEDS * 2)
+    assert bytes(device.leds) == last
+    assert device.frames == FRAMES
+    assert device.dropped == 0